@@ -1,38 +1,36 @@
 import asyncio
-from aiogram import Bot, Dispatcher
-from aiogram.enums.parse_mode import ParseMode
-from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
-from handlers import setup_message_routers
-from callbacks import setup_callback_routers
 
+from app import close_resources, create_bot, create_dispatcher, init_resources
 from config import config
-from db.pool import create_db_pool, close_db_pool
-from handlers import main_menu
+from webhook import run_webhook
 
 async def main():
-    # Инициализация пула соединений с БД
-    await create_db_pool()
-    
-    bot = Bot(
-        token=config.BOT_TOKEN.get_secret_value(),
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-    )
-    
-    dp = Dispatcher(storage=MemoryStorage())
-    
-    # Регистрация роутеров
-    message_routers = setup_message_routers()
-    callback_routers = setup_callback_routers()
-    dp.include_router(message_routers)
-    dp.include_router(callback_routers)
-    
-    await bot.delete_webhook(drop_pending_updates=True)
+    await init_resources()
+
+    bot = create_bot()
+    dp = create_dispatcher()
+
     try:
-        await dp.start_polling(bot)
+        if config.BOT_MODE == 'webhook':
+            await run_webhook(
+                dp, bot,
+                url=config.WEBHOOK_URL,
+                path=config.WEBHOOK_PATH,
+                host=config.WEBHOOK_HOST,
+                port=config.WEBHOOK_PORT,
+                secret=config.WEBHOOK_SECRET.get_secret_value(),
+                max_concurrent=config.WEBHOOK_MAX_CONCURRENT,
+                drain_timeout=config.WEBHOOK_DRAIN_TIMEOUT,
+                drop_pending_updates=config.DROP_PENDING_UPDATES
+            )
+        else:
+            # Накопившиеся обновления не сбрасываем: polling дочитает их после перезапуска
+            await bot.delete_webhook(drop_pending_updates=config.DROP_PENDING_UPDATES)
+            # Типы обновлений по зарегистрированным обработчикам (в том числе chat_member)
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
         await bot.session.close()
-        await close_db_pool()
+        await close_resources()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
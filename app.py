@@ -0,0 +1,89 @@
+from aiogram import Bot, Dispatcher
+from aiogram.enums.parse_mode import ParseMode
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.memory import MemoryStorage
+from handlers import setup_message_routers
+from callbacks import setup_callback_routers
+
+from config import config
+from db.pool import create_db_pool, close_db_pool
+from db.listener import add_notify_handler, start_listener, stop_listener
+from db.card_pool import CARDS_CHANGED_CHANNEL, load_card_pool, refresh_card_pool
+from db.pack_catalogue import PACKS_CHANGED_CHANNEL, load_pack_catalogue, refresh_pack_catalogue
+from db.leaderboard import SCORE_CHANGED_CHANNEL, load_leaderboard, refresh_leaderboard
+from db.profile_stats import STATS_CHANGED_CHANNEL, refresh_user_stats
+from db.fsm_storage import PostgresStorage
+from middlewares import FSMFlushMiddleware, ThrottlingMiddleware
+
+# Сборка бота, общая для однопроцессного запуска (__main__.py) и воркеров runner.py
+
+async def init_resources(pool_min_size: int = None, pool_max_size: int = None, migrate: bool = True):
+    """Пул БД, кэши в памяти и LISTEN для их обновления"""
+    # Инициализация пула соединений с БД
+    await create_db_pool(pool_min_size, pool_max_size, migrate)
+
+    # Пул карт в памяти и его обновление по NOTIFY при изменении таблицы cards
+    await load_card_pool()
+    add_notify_handler(CARDS_CHANGED_CHANNEL, refresh_card_pool)
+
+    # Каталог паков в памяти, сбрасывается по NOTIFY при изменении packs/collections
+    await load_pack_catalogue()
+    add_notify_handler(PACKS_CHANGED_CHANNEL, refresh_pack_catalogue)
+
+    # Рейтинг по очкам в памяти, обновляется по NOTIFY при изменении users.score
+    await load_leaderboard()
+    add_notify_handler(SCORE_CHANGED_CHANNEL, refresh_leaderboard)
+
+    # Сводка профиля сбрасывается по NOTIFY и при записи в другом процессе
+    add_notify_handler(STATS_CHANGED_CHANNEL, refresh_user_stats)
+
+    await start_listener()
+
+async def close_resources():
+    await stop_listener()
+    await close_db_pool()
+
+def create_bot() -> Bot:
+    # Свой адрес Bot API: локальный сервер Bot API или тестовый двойник Telegram
+    session = None
+    if config.TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL))
+
+    return Bot(
+        token=config.BOT_TOKEN.get_secret_value(),
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+
+def create_dispatcher() -> Dispatcher:
+    if config.FSM_STORAGE == 'postgres':
+        storage = PostgresStorage(ttl=config.FSM_TTL, cache_size=config.FSM_CACHE_SIZE)
+    else:
+        storage = MemoryStorage()
+    dp = Dispatcher(storage=storage)
+    if isinstance(storage, PostgresStorage):
+        # Все изменения состояния за обновление - одной записью в БД
+        dp.update.outer_middleware(FSMFlushMiddleware(storage))
+
+    # Ограничение частоты до фильтров и обработчиков; доступно в обработчиках как throttling
+    throttling = ThrottlingMiddleware(
+        rate=config.THROTTLE_RATE,
+        burst=config.THROTTLE_BURST,
+        action_limits={
+            'game': (config.THROTTLE_GAME_RATE, config.THROTTLE_GAME_BURST),
+            'pack': (config.THROTTLE_PACK_RATE, config.THROTTLE_PACK_BURST),
+            'market_buy': (config.THROTTLE_MARKET_BUY_RATE, config.THROTTLE_MARKET_BUY_BURST),
+        }
+    )
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    dp["throttling"] = throttling
+
+    # Регистрация роутеров
+    message_routers = setup_message_routers()
+    callback_routers = setup_callback_routers()
+    dp.include_router(message_routers)
+    dp.include_router(callback_routers)
+    return dp
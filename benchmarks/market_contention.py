@@ -0,0 +1,231 @@
+"""Нагрузочная проверка покупки на маркете при конкурирующих покупателях.
+
+Создает в локальном Postgres синтетического продавца с объявлениями и
+покупателей, которые одновременно пытаются купить одни и те же объявления.
+После прогона проверяет инварианты: каждое объявление продано не больше
+одного раза, деньги не появились и не пропали, карта у покупателя, история,
+витрина и счетчики маркета согласованы. Синтетические данные удаляются.
+
+Запускать только на локальной или тестовой БД.
+
+Запуск:
+    python -m benchmarks.market_contention --buyers 50 --listings 200
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import Dict, List
+
+from db import metrics
+from db.card_queries import grant_cards
+from db.metrics import Histogram
+from db.pool import close_db_pool, create_db_pool
+from db.user_queries import buy_market_listing, create_market_listing, remove_market_listing
+
+# Диапазон user_id синтетических игроков (заведомо не Telegram id)
+SYNTHETIC_USER_BASE = 9_000_000_000_000
+
+def empty_data() -> Dict:
+    """Что создал прогон; заполняется по шагам, чтобы cleanup убрал и недоделанную подготовку"""
+    return {
+        'seller_id': SYNTHETIC_USER_BASE,
+        'buyer_ids': [],
+        'user_ids': [],
+        'user_card_ids': [],
+        'listing_ids': [],
+        'serials': {}
+    }
+
+async def setup(pool, data: Dict, buyers: int, listings: int, price: int, balance: int):
+    """Создает продавца с объявлениями и покупателей, записывая созданное в data"""
+    seller_id = data['seller_id']
+    buyer_ids = [SYNTHETIC_USER_BASE + i for i in range(1, buyers + 1)]
+
+    async with pool.acquire() as conn:
+        await conn.executemany(
+            "INSERT INTO users (user_id, username, balance) VALUES ($1, $2, $3)",
+            [(seller_id, 'bench_seller', 0)] +
+            [(buyer_id, f'bench_buyer_{i}', balance) for i, buyer_id in enumerate(buyer_ids)]
+        )
+        data['buyer_ids'] = buyer_ids
+        data['user_ids'] = [seller_id] + buyer_ids
+
+        card_ids = [row['id'] for row in await conn.fetch("SELECT id FROM cards ORDER BY id LIMIT $1", listings)]
+        if not card_ids:
+            raise RuntimeError("В таблице cards нет карт")
+        granted = await grant_cards(conn, seller_id, [card_ids[i % len(card_ids)] for i in range(listings)])
+
+    data['user_card_ids'] = [item['user_card_id'] for item in granted['granted']]
+    # Сколько номеров выдано по каждой карте и последний из них - для отката счетчиков
+    serials = data['serials']
+    for item in granted['granted']:
+        card = serials.setdefault(item['card_id'], {'amount': 0, 'last_serial': 0})
+        card['amount'] += 1
+        card['last_serial'] = max(card['last_serial'], item['serial_number'])
+
+    for user_card_id in data['user_card_ids']:
+        listing_id = await create_market_listing(seller_id, user_card_id, price)
+        if listing_id is None:
+            raise RuntimeError(f"Не удалось выставить карточку {user_card_id}")
+        data['listing_ids'].append(listing_id)
+
+async def buyer(buyer_id: int, listing_ids: List[int], latency: Histogram, outcomes: Dict, rng: random.Random):
+    """Пытается купить каждое объявление в случайном порядке"""
+    order = list(listing_ids)
+    rng.shuffle(order)
+    for listing_id in order:
+        started = time.perf_counter()
+        try:
+            success, message = await buy_market_listing(listing_id, buyer_id)
+            key = "куплено" if success else message
+        except Exception as e:
+            key = f"ошибка: {type(e).__name__}"
+        latency.observe(time.perf_counter() - started)
+        outcomes[key] = outcomes.get(key, 0) + 1
+
+async def check_invariants(pool, data: Dict, total_before: int, purchases: int) -> List[str]:
+    """Возвращает список нарушенных инвариантов"""
+    problems = []
+    async with pool.acquire() as conn:
+        total_after = await conn.fetchval(
+            "SELECT SUM(balance) FROM users WHERE user_id = ANY($1::bigint[])", data['user_ids']
+        )
+        if total_after != total_before:
+            problems.append(f"сумма балансов изменилась: {total_before} -> {total_after}")
+
+        sold = await conn.fetch(
+            "SELECT id, card_id, buyer_id FROM market_listings WHERE id = ANY($1::int[]) AND is_sold = TRUE",
+            data['listing_ids']
+        )
+        if len(sold) != purchases:
+            problems.append(f"продано объявлений {len(sold)}, успешных покупок {purchases}")
+
+        owners = {
+            row['id']: row['user_id'] for row in await conn.fetch(
+                "SELECT id, user_id FROM user_cards WHERE id = ANY($1::int[])", data['user_card_ids']
+            )
+        }
+        wrong_owner = [row['id'] for row in sold if owners.get(row['card_id']) != row['buyer_id']]
+        if wrong_owner:
+            problems.append(f"карта не у покупателя в объявлениях: {wrong_owner[:10]}")
+
+        history = await conn.fetchval(
+            "SELECT COUNT(*) FROM market_sales_history WHERE user_card_id = ANY($1::int[])", data['user_card_ids']
+        )
+        if history != len(sold):
+            problems.append(f"записей истории {history}, продаж {len(sold)}")
+
+        still_listed = await conn.fetchval(
+            "SELECT COUNT(*) FROM market_active_listings WHERE id = ANY($1::int[])",
+            [row['id'] for row in sold]
+        )
+        if still_listed:
+            problems.append(f"проданных объявлений в витрине: {still_listed}")
+
+        mismatched = await conn.fetch("""
+            SELECT COALESCE(mlc.rarity, mal.rarity) AS rarity, mlc.active, mal.actual
+            FROM market_listing_counts mlc
+            FULL JOIN (
+                SELECT rarity, COUNT(*) AS actual FROM market_active_listings GROUP BY rarity
+            ) mal ON mal.rarity = mlc.rarity
+            WHERE COALESCE(mlc.active, 0) != COALESCE(mal.actual, 0)
+        """)
+        for row in mismatched:
+            problems.append(f"счетчик {row['rarity']}: {row['active']}, в витрине {row['actual']}")
+    return problems
+
+async def cleanup(pool, data: Dict):
+    """Удаляет синтетических игроков, их карты, объявления и историю и откатывает счетчики номеров"""
+    async with pool.acquire() as conn:
+        unsold = await conn.fetch(
+            "SELECT id, user_id FROM market_listings WHERE id = ANY($1::int[]) AND is_sold = FALSE",
+            data['listing_ids']
+        )
+    # Непроданные снимаем штатно, чтобы вернуть счетчики маркета
+    for row in unsold:
+        await remove_market_listing(row['id'], row['user_id'])
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "DELETE FROM market_sales_history WHERE user_card_id = ANY($1::int[])", data['user_card_ids']
+            )
+            await conn.execute("DELETE FROM market_listings WHERE id = ANY($1::int[])", data['listing_ids'])
+            await conn.execute("DELETE FROM user_cards WHERE id = ANY($1::int[])", data['user_card_ids'])
+            await conn.execute("DELETE FROM users WHERE user_id = ANY($1::bigint[])", data['user_ids'])
+            await conn.execute(
+                "DELETE FROM user_profile_aggregates WHERE user_id = ANY($1::bigint[])", data['user_ids']
+            )
+
+            # Возвращаем счетчики номеров, чтобы прогон не завышал тираж карт. Если
+            # за время прогона карту выдали настоящему игроку, номер после наших
+            # уже занят - такой счетчик не трогаем, остается пропуск в номерах
+            card_ids = sorted(data['serials'])
+            restored = await conn.fetch("""
+                UPDATE card_serial_counters csc
+                SET last_serial = csc.last_serial - s.amount
+                FROM unnest($1::int[], $2::int[], $3::int[]) AS s(card_id, amount, last_serial)
+                WHERE csc.card_id = s.card_id AND csc.last_serial = s.last_serial
+                RETURNING csc.card_id
+            """,
+                card_ids,
+                [data['serials'][card_id]['amount'] for card_id in card_ids],
+                [data['serials'][card_id]['last_serial'] for card_id in card_ids]
+            )
+    skipped = len(card_ids) - len(restored)
+    if skipped:
+        print(f"⚠ Счетчики номеров не возвращены для {skipped} карт: их выдавали во время прогона")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Конкурирующие покупки на маркете")
+    parser.add_argument('--buyers', type=int, default=50, help="одновременных покупателей")
+    parser.add_argument('--listings', type=int, default=200, help="объявлений продавца")
+    parser.add_argument('--price', type=int, default=10, help="цена каждого объявления")
+    parser.add_argument('--balance', type=int, default=None,
+                        help="стартовый баланс покупателя (по умолчанию хватает на половину объявлений)")
+    parser.add_argument('--seed', type=int, default=None, help="сид порядка покупок")
+    args = parser.parse_args()
+
+    balance = args.balance if args.balance is not None else args.price * max(1, args.listings // 2)
+    rng = random.Random(args.seed)
+
+    pool = await create_db_pool()
+    data = empty_data()
+    try:
+        await setup(pool, data, args.buyers, args.listings, args.price, balance)
+        async with pool.acquire() as conn:
+            total_before = await conn.fetchval(
+                "SELECT SUM(balance) FROM users WHERE user_id = ANY($1::bigint[])", data['user_ids']
+            )
+
+        metrics.reset_metrics()
+        latency = Histogram()
+        outcomes: Dict[str, int] = {}
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            buyer(buyer_id, data['listing_ids'], latency, outcomes, random.Random(rng.random()))
+            for buyer_id in data['buyer_ids']
+        ))
+        elapsed = time.perf_counter() - started
+
+        purchases = outcomes.get("куплено", 0)
+        print(f"Покупателей: {args.buyers}, объявлений: {args.listings}, попыток: {latency.count:,}")
+        print(f"Время: {elapsed:.2f} с, попыток/с: {latency.count / elapsed:,.0f}, покупок/с: {purchases / elapsed:,.0f}")
+        print(f"Задержка попытки: {latency.summary()}")
+        for outcome, count in sorted(outcomes.items(), key=lambda item: -item[1]):
+            print(f"  {outcome}: {count:,}")
+        print("\nЗапросы и пул:")
+        print(metrics.dump_metrics(pool))
+
+        problems = await check_invariants(pool, data, total_before, purchases)
+        print("\nИтог:", "инварианты соблюдены" if not problems else "нарушения:")
+        for problem in problems:
+            print(f"  ⚠ {problem}")
+    finally:
+        # И после прогона, и после сбоя подготовки: иначе повторный запуск упрется в users
+        await cleanup(pool, data)
+        await close_db_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+"""Симуляция шансов выпадения паков и замер скорости генерации карт.
+
+Открывает миллионы виртуальных паков против синтетической таблицы cards
+(в памяти) или против паков и карт из локального Postgres и сравнивает
+наблюдаемые доли редкостей с заявленными шансами.
+
+Запуск:
+    python -m benchmarks.pack_drop_rates --packs 1000000
+    python -m benchmarks.pack_drop_rates --from-db --packs 200000
+"""
+import argparse
+import asyncio
+import math
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from db import card_pool
+from db.pack_queries import COLLECTION_PACK_SETTINGS, draw_pack_cards, generate_pack_cards
+from db.rarity_roll import RARITIES, make_rng, new_seed, pack_chances, spawn_seeds
+
+SYNTHETIC_COLLECTION_ID = 1
+
+# Паки для прогона без БД: типичные настройки таблицы packs + коллекционный пак
+SAMPLE_PACKS = [
+    {'id': 1, 'name': 'Бесплатный', 'cost': 0, 'cards_amount': 3,
+     'common_chance': 70, 'rare_chance': 20, 'epic_chance': 8, 'legendary_chance': 2},
+    {'id': 2, 'name': 'Стандартный', 'cost': 100, 'cards_amount': 3,
+     'common_chance': 50, 'rare_chance': 30, 'epic_chance': 15, 'legendary_chance': 5},
+    {'id': 3, 'name': 'Премиум', 'cost': 300, 'cards_amount': 5,
+     'common_chance': 20, 'rare_chance': 40, 'epic_chance': 25, 'legendary_chance': 15},
+    dict(COLLECTION_PACK_SETTINGS, id=f'collection_{SYNTHETIC_COLLECTION_ID}',
+         name='Коллекционный', collection_id=SYNTHETIC_COLLECTION_ID),
+]
+
+def synthetic_cards(per_rarity: int) -> List[Dict]:
+    """Синтетическая таблица cards: per_rarity карт каждой редкости, четверть - в коллекции"""
+    cards = []
+    for rarity in RARITIES:
+        for i in range(per_rarity):
+            card_id = len(cards) + 1
+            cards.append({
+                'id': card_id,
+                'player_name': f'{rarity.capitalize()} Player {i}',
+                'uniq_name': f'{rarity}_{i}',
+                'rarity': rarity,
+                'weight': 60 + card_id % 40,
+                'collection_id': SYNTHETIC_COLLECTION_ID if i % 4 == 0 else None
+            })
+    return cards
+
+async def load_from_db() -> Tuple[List[Dict], List[Dict]]:
+    """Читает паки и карты из локальной БД (только чтение)"""
+    import asyncpg
+    from db.pool import DB_SETTINGS
+
+    conn = await asyncpg.connect(**DB_SETTINGS)
+    try:
+        packs = [dict(row) for row in await conn.fetch("SELECT * FROM packs ORDER BY id")]
+        collections = await conn.fetch("SELECT id, name FROM collections WHERE is_active = true ORDER BY id")
+        cards = [dict(row) for row in await conn.fetch("SELECT * FROM cards")]
+    finally:
+        await conn.close()
+
+    for collection in collections:
+        packs.append(dict(
+            COLLECTION_PACK_SETTINGS,
+            id=f"collection_{collection['id']}",
+            name=collection['name'],
+            collection_id=collection['id']
+        ))
+    return packs, cards
+
+def wilson_interval(successes: int, total: int, z: float) -> Tuple[float, float]:
+    """Доверительный интервал Уилсона для доли"""
+    if total == 0:
+        return 0.0, 0.0
+    p = successes / total
+    denominator = 1 + z * z / total
+    center = (p + z * z / (2 * total)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+    return center - margin, center + margin
+
+def simulate(pack: Dict, packs_count: int, seed: int) -> Tuple[Counter, int, float]:
+    """Открывает packs_count виртуальных паков, возвращает счетчик редкостей, недостачу карт и время"""
+    counts = Counter()
+    missing = 0
+    expected_cards = pack['cards_amount']
+
+    started = time.perf_counter()
+    for pack_seed in spawn_seeds(seed, packs_count):
+        cards = draw_pack_cards(pack, make_rng(pack_seed))
+        missing += expected_cards - len(cards)
+        for card in cards:
+            counts[card['rarity']] += 1
+    elapsed = time.perf_counter() - started
+
+    return counts, missing, elapsed
+
+async def measure_generate(pack: Dict, packs_count: int, batch: int) -> float:
+    """Скорость полного пути generate_pack_cards (паков в секунду)"""
+    started = time.perf_counter()
+    opened = 0
+    while opened < packs_count:
+        size = min(batch, packs_count - opened)
+        await generate_pack_cards(pack, packs_count=size)
+        opened += size
+    return packs_count / (time.perf_counter() - started)
+
+def report(pack: Dict, counts: Counter, missing: int, packs_count: int, elapsed: float, z: float) -> bool:
+    """Печатает наблюдаемые доли с интервалами; возвращает False, если заявленный шанс вне интервала"""
+    total = sum(counts.values())
+    effective = dict(pack_chances(pack))
+    advertised_sum = sum(pack[f'{rarity}_chance'] for rarity in RARITIES)
+    ok = True
+
+    print(f"\n=== Пак {pack['id']} «{pack['name']}»: {packs_count:,} паков, {total:,} карт ===")
+    print(f"Скорость: {packs_count / elapsed:,.0f} паков/с ({elapsed:.2f} с)")
+    if advertised_sum != 100:
+        ok = False
+        print(f"⚠ Сумма заявленных шансов {advertised_sum}%, а не 100%")
+    if missing:
+        ok = False
+        print(f"⚠ Не хватило карт: {missing:,} (пустые корзины редкостей)")
+
+    print(f"{'редкость':<10} {'заявлено':>9} {'ожидается':>10} {'наблюдается':>12}   интервал {z:.2f}σ")
+    for rarity in RARITIES:
+        low, high = wilson_interval(counts[rarity], total, z)
+        advertised = pack[f'{rarity}_chance'] / 100
+        observed = counts[rarity] / total if total else 0
+        flag = "" if low <= advertised <= high else "  ⚠"
+        ok = ok and not flag
+        print(
+            f"{rarity:<10} {advertised:>9.2%} {effective[rarity] / 100:>10.2%} "
+            f"{observed:>12.4%}   [{low:.4%}, {high:.4%}]{flag}"
+        )
+    return ok
+
+async def main():
+    parser = argparse.ArgumentParser(description="Симуляция шансов выпадения паков")
+    parser.add_argument('--packs', type=int, default=1_000_000, help="паков на каждый тип")
+    parser.add_argument('--cards-per-rarity', type=int, default=200, help="синтетических карт каждой редкости")
+    parser.add_argument('--from-db', action='store_true', help="взять паки и карты из локального Postgres")
+    parser.add_argument('--seed', type=int, default=None, help="сид прогона (для воспроизводимости)")
+    parser.add_argument('--z', type=float, default=3.0, help="ширина доверительного интервала в σ")
+    parser.add_argument('--batch', type=int, default=10, help="паков за вызов generate_pack_cards")
+    args = parser.parse_args()
+
+    if args.from_db:
+        packs, cards = await load_from_db()
+    else:
+        packs, cards = SAMPLE_PACKS, synthetic_cards(args.cards_per_rarity)
+    card_pool.set_cards(cards)
+
+    seed = new_seed() if args.seed is None else args.seed
+    print(f"Сид прогона: {seed}, карт в пуле: {len(cards)}")
+
+    all_ok = True
+    for pack in packs:
+        counts, missing, elapsed = simulate(pack, args.packs, seed)
+        all_ok = report(pack, counts, missing, args.packs, elapsed, args.z) and all_ok
+        rate = await measure_generate(pack, min(args.packs, 100_000), args.batch)
+        print(f"generate_pack_cards (по {args.batch}): {rate:,.0f} паков/с")
+
+    print("\nИтог:", "все шансы совпадают с заявленными" if all_ok else "есть расхождения (⚠)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,210 @@
+"""Проверка режима вебхука против локального двойника Telegram.
+
+Поднимает фейковый Bot API (отвечает на getMe, setWebhook, sendMessage и
+answerCallbackQuery и запоминает вызовы) и сервер вебхука с тестовым
+обработчиком, который имитирует работу бота задержкой и отвечает сообщением.
+Затем шлет в вебхук пачку обновлений так же, как Telegram: параллельно, с
+секретом в заголовке. Проверяет, что:
+  - обновления без секрета или с чужим секретом отклонены (401);
+  - все принятые обновления обработаны ровно один раз;
+  - одновременно обрабатывается не больше --concurrency обновлений;
+  - при остановке посреди нагрузки принятые обновления дорабатываются,
+    а новые получают 503 (Telegram доставит их после перезапуска).
+
+БД и настоящий Telegram не нужны.
+
+Запуск:
+    python -m benchmarks.webhook_load --updates 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiohttp import ClientError, ClientSession, web
+
+from db.metrics import Histogram
+from webhook import SECRET_HEADER, run_webhook
+
+FAKE_TOKEN = "123456:fake"
+SECRET = "bench-secret"
+API_PORT = 18081
+WEBHOOK_PORT = 18080
+WEBHOOK_PATH = "/webhook"
+
+class FakeTelegram:
+    """Минимальный Bot API: возвращает правдоподобные ответы и считает вызовы"""
+
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+        self.webhook: Dict = {}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(await request.post())
+
+        if method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        elif method == 'setWebhook':
+            self.webhook = params
+            result = True
+        elif method == 'sendMessage':
+            result = {
+                'message_id': self.calls[method],
+                'date': int(time.time()),
+                'chat': {'id': int(params['chat_id']), 'type': 'private'},
+                'text': params.get('text', '')
+            }
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+def make_update(update_id: int) -> Dict:
+    user_id = 1000 + update_id % 97
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': f'ping {update_id}'
+        }
+    }
+
+async def post_update(http: ClientSession, update: Dict, secret: str, latency: Histogram, statuses: Dict):
+    started = time.perf_counter()
+    try:
+        async with http.post(
+            f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}", json=update, headers={SECRET_HEADER: secret}
+        ) as response:
+            status = response.status
+    except ClientError:
+        # Сервер уже закрыт: Telegram в этом случае повторит доставку
+        status = 'нет соединения'
+    latency.observe(time.perf_counter() - started)
+    statuses[status] = statuses.get(status, 0) + 1
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузка на вебхук против двойника Telegram")
+    parser.add_argument('--updates', type=int, default=2000, help="обновлений в основном прогоне")
+    parser.add_argument('--concurrency', type=int, default=20, help="одновременных обработок")
+    parser.add_argument('--senders', type=int, default=40, help="параллельных соединений отправителя")
+    parser.add_argument('--work', type=float, default=0.01, help="время обработки одного обновления, с")
+    args = parser.parse_args()
+
+    fake = FakeTelegram()
+    api_runner = web.AppRunner(fake.make_app())
+    await api_runner.setup()
+    await web.TCPSite(api_runner, '127.0.0.1', API_PORT).start()
+
+    processed: List[int] = []
+    active = 0
+    peak = 0
+
+    router = Router()
+
+    @router.message()
+    async def echo(message: Message):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        try:
+            await asyncio.sleep(args.work)
+            await message.answer(message.text)
+            processed.append(message.message_id)
+        finally:
+            active -= 1
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot(FAKE_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{API_PORT}")))
+
+    stop_event = asyncio.Event()
+    server_task = asyncio.create_task(run_webhook(
+        dp, bot,
+        url=f"http://127.0.0.1:{WEBHOOK_PORT}",
+        path=WEBHOOK_PATH,
+        host='127.0.0.1',
+        port=WEBHOOK_PORT,
+        secret=SECRET,
+        max_concurrent=args.concurrency,
+        drain_timeout=max(5.0, args.work * 100),
+        stop_event=stop_event
+    ))
+    while not fake.webhook:
+        await asyncio.sleep(0.01)
+
+    problems = []
+    async with ClientSession() as http:
+        senders = asyncio.Semaphore(args.senders)
+        latency = Histogram()
+        statuses: Dict[int, int] = {}
+
+        async def send(update_id: int, secret: str = SECRET):
+            async with senders:
+                await post_update(http, make_update(update_id), secret, latency, statuses)
+
+        # Чужой секрет и пустой заголовок
+        await send(0, "wrong")
+        await send(0, "")
+        if statuses.get(401) != 2:
+            problems.append(f"обновления без секрета не отклонены: {statuses}")
+
+        latency = Histogram()
+        statuses = {}
+        started = time.perf_counter()
+        await asyncio.gather(*(send(update_id) for update_id in range(1, args.updates + 1)))
+        # Дожидаемся фоновой обработки принятых обновлений
+        while len(processed) < statuses.get(200, 0) and time.perf_counter() - started < 60:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        print(f"Обновлений: {args.updates:,}, обработано: {len(processed):,}, время: {elapsed:.2f} с, "
+              f"обновлений/с: {len(processed) / elapsed:,.0f}")
+        print(f"Ответ вебхука: {latency.summary()}")
+        print(f"Статусы: {statuses}, пик одновременных обработок: {peak}")
+        if statuses.get(200) != args.updates:
+            problems.append(f"приняты не все обновления: {statuses}")
+        if sorted(processed) != list(range(1, args.updates + 1)):
+            problems.append("обработаны не все обновления или с повторами")
+        if peak > args.concurrency:
+            problems.append(f"превышен лимит одновременных обработок: {peak} > {args.concurrency}")
+
+        # Остановка посреди нагрузки
+        processed.clear()
+        statuses = {}
+        base = args.updates + 1
+        burst = [asyncio.create_task(send(base + i)) for i in range(args.concurrency * 3)]
+        while sum(statuses.values()) < args.concurrency:
+            await asyncio.sleep(0.001)
+        stop_event.set()
+        await asyncio.gather(*burst)
+        await server_task
+
+        print(f"Остановка под нагрузкой: статусы {statuses}, доработано {len(processed)}")
+        if len(processed) != statuses.get(200, 0):
+            problems.append(f"принято {statuses.get(200, 0)}, доработано {len(processed)}")
+        if any(status not in (200, 503, 'нет соединения') for status in statuses):
+            problems.append(f"неожиданные ответы при остановке: {statuses}")
+
+    print(f"Вызовы Bot API: {fake.calls}")
+    await bot.session.close()
+    await api_runner.cleanup()
+
+    print("\nИтог:", "все проверки пройдены" if not problems else "нарушения:")
+    for problem in problems:
+        print(f"  ⚠ {problem}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
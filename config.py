@@ -1,10 +1,60 @@
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic_settings import SettingsConfigDict
 from pydantic import SecretStr
+from typing import Literal
 
-class Config(BaseSettings):
+from db.settings import DatabaseSettings
+
+class Config(DatabaseSettings):
+    # Настройки БД (DB_*) унаследованы из db/settings.py
     BOT_TOKEN: SecretStr
+    # Telegram ID администраторов (в .env: ADMIN_IDS=[123, 456])
+    ADMIN_IDS: list[int] = []
+
+    # Получение обновлений: long polling или вебхук
+    BOT_MODE: Literal['polling', 'webhook'] = 'polling'
+    # Адрес Bot API (пусто - api.telegram.org; для локального сервера Bot API или тестового двойника)
+    TELEGRAM_API_URL: str = ''
+    # Сбрасывать ли накопившиеся обновления при запуске
+    DROP_PENDING_UPDATES: bool = False
+
+    # Вебхук: публичный адрес (https://example.com), путь, где слушать локально,
+    # секрет из заголовка X-Telegram-Bot-Api-Secret-Token (A-Z, a-z, 0-9, _ и -)
+    WEBHOOK_URL: str = ''
+    WEBHOOK_PATH: str = '/webhook'
+    WEBHOOK_HOST: str = '0.0.0.0'
+    WEBHOOK_PORT: int = 8080
+    WEBHOOK_SECRET: SecretStr = ''
+    # Сколько обновлений обрабатывается одновременно и сколько ждать их при остановке (секунды)
+    WEBHOOK_MAX_CONCURRENT: int = 50
+    WEBHOOK_DRAIN_TIMEOUT: float = 30.0
+
+    # Многопроцессный запуск (runner.py): число воркеров (0 - по числу ядер),
+    # одновременных обработок в воркере, адрес отчета о здоровье (порт 0 - выключен).
+    # DB_POOL_MAX_SIZE в этом режиме - общий бюджет соединений, он делится между воркерами
+    # (на каждый - пул от 2 соединений и одно для LISTEN; лишние воркеры не запускаются)
+    WORKERS: int = 0
+    WORKER_MAX_CONCURRENT: int = 50
+    RUNNER_HEALTH_HOST: str = '127.0.0.1'
+    RUNNER_HEALTH_PORT: int = 0
+
+    # Хранилище FSM: postgres (переживает перезапуск) или memory
+    FSM_STORAGE: Literal['postgres', 'memory'] = 'postgres'
+    # Через сколько секунд без изменений сессия считается брошенной
+    FSM_TTL: int = 86400
+    # Сколько сессий держать в памяти процесса (0 - читать из БД в каждом обновлении)
+    FSM_CACHE_SIZE: int = 10000
+
+    # Ограничение частоты: событий в секунду на пользователя и сколько подряд без задержки
+    THROTTLE_RATE: float = 2.0
+    THROTTLE_BURST: int = 5
+    # Отдельные лимиты на ставки в играх, покупку паков и покупку на маркете
+    THROTTLE_GAME_RATE: float = 1.0
+    THROTTLE_GAME_BURST: int = 3
+    THROTTLE_PACK_RATE: float = 0.5
+    THROTTLE_PACK_BURST: int = 2
+    THROTTLE_MARKET_BUY_RATE: float = 0.5
+    THROTTLE_MARKET_BUY_BURST: int = 2
 
-    class Config:
-        env_file = ".env"
+    model_config = SettingsConfigDict(env_file=".env", extra="forbid")
 
 config = Config()
\ No newline at end of file
@@ -0,0 +1,99 @@
+import asyncio
+import random
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from db.pool import get_db_pool
+
+RARITIES = ('common', 'rare', 'epic', 'legendary')
+CARDS_CHANGED_CHANNEL = 'cards_changed'
+
+# Индексы карт: по id, по редкости и по (коллекция, редкость)
+_cards_by_id: Dict[int, Dict] = {}
+_cards_by_rarity: Dict[str, List[Dict]] = {}
+_cards_by_collection: Dict[Tuple[int, str], List[Dict]] = {}
+_loaded = False
+_refresh_lock = asyncio.Lock()
+
+def set_cards(rows) -> None:
+    """Строит индексы карт из строк таблицы cards и атомарно подменяет текущие"""
+    global _cards_by_id, _cards_by_rarity, _cards_by_collection, _loaded
+
+    by_id = {}
+    by_rarity = {rarity: [] for rarity in RARITIES}
+    by_collection = {}
+
+    # Сортировка по id делает порядок в корзинах воспроизводимым
+    for row in sorted((dict(row) for row in rows), key=lambda card: card['id']):
+        by_id[row['id']] = row
+        by_rarity.setdefault(row['rarity'], []).append(row)
+        if row.get('collection_id') is not None:
+            by_collection.setdefault((row['collection_id'], row['rarity']), []).append(row)
+
+    _cards_by_id, _cards_by_rarity, _cards_by_collection = by_id, by_rarity, by_collection
+    _loaded = True
+
+async def load_card_pool() -> int:
+    """Загружает все карты из БД в память"""
+    async with _refresh_lock:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("SELECT * FROM cards")
+        set_cards(rows)
+    print(f"[{datetime.now()}] Пул карт загружен: {len(_cards_by_id)} карт")
+    return len(_cards_by_id)
+
+async def refresh_card_pool(payload: str = None):
+    """Обработчик NOTIFY cards_changed: перечитывает таблицу cards"""
+    try:
+        await load_card_pool()
+    except Exception as e:
+        print(f"[{datetime.now()}] ОШИБКА обновления пула карт: {e}")
+
+async def ensure_card_pool():
+    """Загружает пул карт, если он еще не загружен"""
+    if not _loaded:
+        await load_card_pool()
+
+def is_card_pool_loaded() -> bool:
+    return _loaded
+
+def get_all_cards() -> Dict[int, Dict]:
+    """Все карты по ID (словарь подменяется целиком при перезагрузке пула, не изменять)"""
+    return _cards_by_id
+
+def get_card(card_id: int) -> Optional[Dict]:
+    """Возвращает карту по ID из памяти"""
+    return _cards_by_id.get(card_id)
+
+def get_rarity_bucket(rarity: str, collection_id: int = None) -> List[Dict]:
+    """Возвращает список карт редкости (опционально только из коллекции)"""
+    if collection_id is not None:
+        return _cards_by_collection.get((collection_id, rarity), [])
+    return _cards_by_rarity.get(rarity, [])
+
+def collection_has_cards(collection_id: int) -> bool:
+    """Есть ли в коллекции хотя бы одна карта"""
+    return any((collection_id, rarity) in _cards_by_collection for rarity in RARITIES)
+
+def draw_card(rarity: str, collection_id: int = None, rng: random.Random = None) -> Optional[Dict]:
+    """Выбирает случайную карту редкости за O(1), без запросов к БД"""
+    bucket = get_rarity_bucket(rarity, collection_id)
+    if not bucket:
+        return None
+    rng = rng or random
+    return dict(bucket[rng.randrange(len(bucket))])
+
+def draw_card_nearest(rarity: str, collection_id: int = None, rng: random.Random = None) -> Optional[Dict]:
+    """Как draw_card, но если корзина редкости пуста, берет ближайшую непустую:
+    сначала более низкие редкости, затем более высокие"""
+    if rarity not in RARITIES:
+        return draw_card(rarity, collection_id, rng)
+
+    position = RARITIES.index(rarity)
+    order = [rarity] + list(reversed(RARITIES[:position])) + list(RARITIES[position + 1:])
+    for candidate in order:
+        card = draw_card(candidate, collection_id, rng)
+        if card:
+            return card
+    return None
@@ -1,55 +1,117 @@
 from db.pool import get_db_pool
+from db.statements import statement
+from db.profile_stats import invalidate_user_stats
+from typing import Dict
+
+# Выдача всех карт одним запросом: номера берутся из card_serial_counters,
+# строка счетчика блокируется ON CONFLICT DO UPDATE, поэтому параллельные
+# открытия не получают одинаковых номеров. Счетчики блокируются по возрастанию
+# card_id: блокировки держатся до конца транзакции открытия, и два открытия
+# с общими картами иначе могли бы взять их в разном порядке и уйти в deadlock
+GRANT_CARDS_CTE = """
+wanted AS (
+    SELECT card_id, ord
+    FROM unnest($2::int[]) WITH ORDINALITY AS t(card_id, ord)
+),
+per_card AS (
+    SELECT card_id, COUNT(*)::int AS amount
+    FROM wanted
+    GROUP BY card_id
+),
+counters AS (
+    INSERT INTO card_serial_counters AS csc (card_id, last_serial)
+    SELECT card_id, amount FROM per_card
+    ORDER BY card_id
+    ON CONFLICT (card_id) DO UPDATE
+    SET last_serial = csc.last_serial + EXCLUDED.last_serial
+    RETURNING card_id, last_serial
+),
+inserted AS (
+    INSERT INTO user_cards (user_id, card_id, serial_number, obtained_at)
+    SELECT
+        $1,
+        w.card_id,
+        (c.last_serial - p.amount
+            + ROW_NUMBER() OVER (PARTITION BY w.card_id ORDER BY w.ord))::int,
+        NOW()
+    FROM wanted w
+    JOIN per_card p USING (card_id)
+    JOIN counters c USING (card_id)
+    RETURNING id, card_id, serial_number
+)
+"""
+
+GRANT_CARDS_QUERY = statement('grant_cards', "WITH " + GRANT_CARDS_CTE + """
+SELECT i.id AS user_card_id, i.card_id, i.serial_number, c.last_serial AS total_copies
+FROM inserted i
+JOIN counters c USING (card_id)
+ORDER BY i.card_id, i.serial_number
+""")
+
+def build_grant_result(rows, card_ids) -> Dict:
+    """Собирает результат выдачи карт из строк (card_id, serial_number, ...) запроса"""
+    # Номера внутри одной карты выданы в порядке следования в card_ids
+    rows_by_card = {}
+    serial_numbers = {}
+    for row in sorted(rows, key=lambda r: (r['card_id'], r['serial_number'])):
+        rows_by_card.setdefault(row['card_id'], []).append(row)
+        serial_numbers[row['card_id']] = {
+            'serial_number': row['serial_number'],
+            'total_copies': row['total_copies']
+        }
+
+    granted = []
+    for card_id in card_ids:
+        row = rows_by_card[card_id].pop(0)
+        granted.append({
+            'card_id': card_id,
+            'user_card_id': row['user_card_id'],
+            'serial_number': row['serial_number']
+        })
+
+    return {
+        'added_count': len(rows),
+        'serial_numbers': serial_numbers,
+        'granted': granted
+    }
+
+async def grant_cards(conn, user_id: int, card_ids) -> Dict:
+    """Выдает карты пользователю одним запросом на переданном соединении"""
+    card_ids = list(card_ids)
+    if not card_ids:
+        return {'added_count': 0, 'serial_numbers': {}, 'granted': []}
+
+    rows = await conn.fetch(GRANT_CARDS_QUERY, user_id, card_ids)
+    return build_grant_result(rows, card_ids)
 
 async def add_cards_to_user(user_id: int, card_ids):
     """Добавляет карты пользователю с автоматическим присвоением порядкового номера"""
     pool = await get_db_pool()
-    added_count = 0
-    serial_numbers = {}  # Будем хранить номера для каждой карточки
-    
     async with pool.acquire() as conn:
-        for card_id in card_ids:
-            try:
-                # Получаем текущее количество таких карточек в системе
-                count_query = "SELECT COUNT(*) FROM user_cards WHERE card_id = $1"
-                total_copies = await conn.fetchval(count_query, card_id)
-                
-                # Порядковый номер = текущее количество + 1
-                serial_number = total_copies + 1
-                
-                # Добавляем карту с порядковым номером
-                query = """
-                INSERT INTO user_cards (user_id, card_id, serial_number, obtained_at) 
-                VALUES ($1, $2, $3, NOW())
-                RETURNING id
-                """
-                result = await conn.fetchval(query, user_id, card_id, serial_number)
-                
-                if result:
-                    added_count += 1
-                    serial_numbers[card_id] = {
-                        'serial_number': serial_number,
-                        'total_copies': total_copies + 1  # +1 потому что мы только что добавили
-                    }
-                    print(f"Added card {card_id} to user {user_id} with serial number #{serial_number}")
-            except Exception as e:
-                print(f"Error adding card {card_id} to user {user_id}: {e}")
-        
-        return {
-            'added_count': added_count,
-            'serial_numbers': serial_numbers
-        }
+        try:
+            granted = await grant_cards(conn, user_id, card_ids)
+            invalidate_user_stats(user_id)
+            return granted
+        except Exception as e:
+            print(f"Error adding cards {card_ids} to user {user_id}: {e}")
+            return {
+                'added_count': 0,
+                'serial_numbers': {},
+                'granted': []
+            }
     
+CARD_COPIES_QUERY = statement('get_card_copies', "SELECT last_serial FROM card_serial_counters WHERE card_id = $1")
+CARD_BY_ID_QUERY = statement('get_card_by_id', "SELECT * FROM cards WHERE id = $1")
+
 async def get_card_serial_info(card_id: int):
     """Получает информацию о порядковом номере карточки"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # Получаем общее количество таких карточек
-        count_query = "SELECT COUNT(*) FROM user_cards WHERE card_id = $1"
-        total_copies = await conn.fetchval(count_query, card_id)
+        # Получаем общее количество выпущенных копий из счетчика номеров
+        total_copies = await conn.fetchval(CARD_COPIES_QUERY, card_id) or 0
         
         # Получаем информацию о карточке
-        card_query = "SELECT * FROM cards WHERE id = $1"
-        card_info = await conn.fetchrow(card_query, card_id)
+        card_info = await conn.fetchrow(CARD_BY_ID_QUERY, card_id)
         
         return {
             'total_copies': total_copies,
@@ -73,67 +135,96 @@ async def check_cards_exist() -> bool:
         return count > 0
     
 
+USER_CARDS_BY_RARITY_QUERY = statement('get_user_cards_by_rarity', """
+SELECT 
+    c.id,
+    c.player_name,
+    c.rarity,
+    c.weight,
+    c.uniq_name,
+    c.collection_id,
+    COUNT(uc.id) as copies_count,
+    MIN(uc.serial_number) as first_serial_number
+FROM user_cards uc
+JOIN cards c ON uc.card_id = c.id
+WHERE uc.user_id = $1 AND c.rarity = $2
+GROUP BY c.id, c.player_name, c.rarity, c.weight, c.uniq_name, c.collection_id
+ORDER BY 
+    CASE c.rarity
+        WHEN 'legendary' THEN 1
+        WHEN 'epic' THEN 2
+        WHEN 'rare' THEN 3
+        WHEN 'common' THEN 4
+    END,
+    c.player_name
+""")
+
 async def get_user_cards_by_rarity(user_id: int, rarity: str):
     """Получает уникальные карты пользователя по редкости с количеством копий"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = """
-        SELECT 
-            c.id,
-            c.player_name,
-            c.rarity,
-            c.weight,
-            c.uniq_name,
-            c.collection_id,
-            COUNT(uc.id) as copies_count,
-            MIN(uc.serial_number) as first_serial_number
-        FROM user_cards uc
-        JOIN cards c ON uc.card_id = c.id
-        WHERE uc.user_id = $1 AND c.rarity = $2
-        GROUP BY c.id, c.player_name, c.rarity, c.weight, c.uniq_name, c.collection_id
-        ORDER BY 
-            CASE c.rarity
-                WHEN 'legendary' THEN 1
-                WHEN 'epic' THEN 2
-                WHEN 'rare' THEN 3
-                WHEN 'common' THEN 4
-            END,
-            c.player_name
-        """
-        results = await conn.fetch(query, user_id, rarity)
+        results = await conn.fetch(USER_CARDS_BY_RARITY_QUERY, user_id, rarity)
         return [dict(row) for row in results]
 
+USER_CARDS_BY_IDS_QUERY = statement('get_user_cards_by_ids', """
+SELECT 
+    c.id,
+    c.player_name,
+    c.rarity,
+    c.weight,
+    c.uniq_name,
+    c.collection_id,
+    COUNT(uc.id) as copies_count,
+    MIN(uc.serial_number) as first_serial_number
+FROM user_cards uc
+JOIN cards c ON uc.card_id = c.id
+WHERE uc.user_id = $1 AND uc.card_id = ANY($2::int[])
+GROUP BY c.id, c.player_name, c.rarity, c.weight, c.uniq_name, c.collection_id
+""")
+
+async def get_user_cards_by_ids(user_id: int, card_ids: list):
+    """Уникальные карты пользователя из списка ID (в порядке списка) с количеством копий"""
+    if not card_ids:
+        return []
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(USER_CARDS_BY_IDS_QUERY, user_id, list(card_ids))
+    by_id = {row['id']: dict(row) for row in rows}
+    return [by_id[card_id] for card_id in card_ids if card_id in by_id]
+
+USER_CARD_DETAILS_QUERY = statement('get_user_card_details', """
+SELECT 
+    c.*,
+    COUNT(uc.id) as copies_count,
+    MIN(uc.serial_number) as best_serial_number,
+    MIN(uc.obtained_at) as first_obtained,
+    col.name as collection_name
+FROM user_cards uc
+JOIN cards c ON uc.card_id = c.id
+LEFT JOIN collections col ON c.collection_id = col.id
+WHERE uc.user_id = $1 AND c.id = $2
+GROUP BY c.id, col.name
+""")
+
+USER_CARD_SERIALS_QUERY = statement('get_user_card_serials', """
+SELECT serial_number, obtained_at 
+FROM user_cards 
+WHERE user_id = $1 AND card_id = $2 
+ORDER BY serial_number
+""")
+
 async def get_user_card_details(user_id: int, card_id: int):
     """Получает детальную информацию о карточке пользователя"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         # Информация о карточке и количестве копий
-        query = """
-        SELECT 
-            c.*,
-            COUNT(uc.id) as copies_count,
-            MIN(uc.serial_number) as best_serial_number,
-            MIN(uc.obtained_at) as first_obtained,
-            col.name as collection_name
-        FROM user_cards uc
-        JOIN cards c ON uc.card_id = c.id
-        LEFT JOIN collections col ON c.collection_id = col.id
-        WHERE uc.user_id = $1 AND c.id = $2
-        GROUP BY c.id, col.name
-        """
-        result = await conn.fetchrow(query, user_id, card_id)
+        result = await conn.fetchrow(USER_CARD_DETAILS_QUERY, user_id, card_id)
         
         if not result:
             return None
             
         # Получаем все порядковые номера этой карточки у пользователя
-        serial_query = """
-        SELECT serial_number, obtained_at 
-        FROM user_cards 
-        WHERE user_id = $1 AND card_id = $2 
-        ORDER BY serial_number
-        """
-        serials = await conn.fetch(serial_query, user_id, card_id)
+        serials = await conn.fetch(USER_CARD_SERIALS_QUERY, user_id, card_id)
         
         return {
             'card_info': dict(result),
@@ -144,20 +235,21 @@ async def get_user_card_details(user_id: int, card_id: int):
             'serial_numbers': [dict(serial) for serial in serials]
         }
 
+USER_CARDS_COUNT_QUERY = statement('get_user_total_cards_count', """
+SELECT 
+    c.rarity,
+    COUNT(uc.id) as count
+FROM user_cards uc
+JOIN cards c ON uc.card_id = c.id
+WHERE uc.user_id = $1
+GROUP BY c.rarity
+""")
+
 async def get_user_total_cards_count(user_id: int):
     """Получает общее количество карт по редкостям"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = """
-        SELECT 
-            c.rarity,
-            COUNT(uc.id) as count
-        FROM user_cards uc
-        JOIN cards c ON uc.card_id = c.id
-        WHERE uc.user_id = $1
-        GROUP BY c.rarity
-        """
-        results = await conn.fetch(query, user_id)
+        results = await conn.fetch(USER_CARDS_COUNT_QUERY, user_id)
         
         counts = {row['rarity']: row['count'] for row in results}
         
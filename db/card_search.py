@@ -0,0 +1,118 @@
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+from db.card_pool import get_all_cards
+
+# Поиск карт по имени игрока в памяти процесса. Индекс строится из пула карт
+# и перестраивается при первом поиске после его перезагрузки (по NOTIFY cards_changed).
+# Слово запроса совпадает со словом имени, если является его началом (вес 1)
+# или похоже на него по триграммам (вес - коэффициент сходства): так находятся
+# и "мес" -> "Месси", и "Роналдо" -> "Роналду"
+MIN_WORD_SIMILARITY = 0.35
+MIN_CARD_SCORE = 0.5
+MAX_PREFIX_LENGTH = 20
+
+# Пул карт, из которого построен индекс
+_source = None
+# card_id -> нормализованное имя
+_names: Dict[int, str] = {}
+# слово имени -> карты с этим словом
+_word_cards: Dict[str, Set[int]] = {}
+# префикс слова -> слова с этим префиксом
+_prefix_words: Dict[str, Set[str]] = {}
+# триграмма -> слова, в которых она есть; слово -> его триграммы
+_trigram_words: Dict[str, Set[str]] = {}
+_word_trigrams: Dict[str, Set[str]] = {}
+
+def normalize(text: str) -> str:
+    """Нижний регистр, ё -> е, без диакритики и знаков препинания"""
+    text = unicodedata.normalize('NFKD', text.lower().replace('ё', 'е'))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(''.join(ch if ch.isalnum() else ' ' for ch in text).split())
+
+def trigrams(word: str) -> Set[str]:
+    """Триграммы слова с границами, как в pg_trgm"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def build_index(cards: Dict[int, Dict]) -> None:
+    """Строит индекс по именам карт и атомарно подменяет текущий"""
+    global _source, _names, _word_cards, _prefix_words, _trigram_words, _word_trigrams
+
+    names = {}
+    word_cards: Dict[str, Set[int]] = {}
+    for card_id, card in cards.items():
+        name = normalize(card.get('player_name') or '')
+        names[card_id] = name
+        for word in name.split():
+            word_cards.setdefault(word, set()).add(card_id)
+
+    prefix_words: Dict[str, Set[str]] = {}
+    trigram_words: Dict[str, Set[str]] = {}
+    word_trigrams: Dict[str, Set[str]] = {}
+    for word in word_cards:
+        for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+            prefix_words.setdefault(word[:length], set()).add(word)
+        word_trigrams[word] = trigrams(word)
+        for trigram in word_trigrams[word]:
+            trigram_words.setdefault(trigram, set()).add(word)
+
+    _names, _word_cards, _prefix_words = names, word_cards, prefix_words
+    _trigram_words, _word_trigrams = trigram_words, word_trigrams
+    _source = cards
+
+def _ensure_index():
+    cards = get_all_cards()
+    if cards is not _source:
+        build_index(cards)
+
+def _similar_words(query_word: str) -> Dict[str, float]:
+    """Слова индекса, подходящие к слову запроса, с весом совпадения"""
+    matches: Dict[str, float] = {}
+
+    query_trigrams = trigrams(query_word)
+    shared = Counter()
+    for trigram in query_trigrams:
+        for word in _trigram_words.get(trigram, ()):
+            shared[word] += 1
+    for word, common in shared.items():
+        similarity = common / (len(query_trigrams) + len(_word_trigrams[word]) - common)
+        if similarity >= MIN_WORD_SIMILARITY:
+            matches[word] = similarity
+
+    for word in _prefix_words.get(query_word[:MAX_PREFIX_LENGTH], ()):
+        if word.startswith(query_word):
+            matches[word] = 1.0
+    return matches
+
+def search_cards(query: str, limit: Optional[int] = 10) -> List[int]:
+    """ID карт, чье имя подходит к запросу, от лучшего совпадения
+    (limit=None - все совпадения).
+
+    Пул карт должен быть загружен (ensure_card_pool)."""
+    _ensure_index()
+    query = normalize(query)
+    if not query:
+        return []
+
+    query_words = query.split()
+    scores: Dict[int, float] = {}
+    for query_word in query_words:
+        # Для карты берется лучшее совпадение среди слов ее имени
+        best: Dict[int, float] = {}
+        for word, weight in _similar_words(query_word).items():
+            for card_id in _word_cards[word]:
+                if weight > best.get(card_id, 0):
+                    best[card_id] = weight
+        for card_id, weight in best.items():
+            scores[card_id] = scores.get(card_id, 0) + weight
+
+    ranked = []
+    for card_id, total in scores.items():
+        score = total / len(query_words)
+        if score >= MIN_CARD_SCORE:
+            name = _names[card_id]
+            ranked.append((-score, name != query, len(name), name, card_id))
+    ranked.sort()
+    return [item[-1] for item in ranked[:limit]]
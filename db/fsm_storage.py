@@ -0,0 +1,216 @@
+import asyncio
+import pickle
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from db.pool import get_db_pool
+from db.statements import statement
+
+# Данные меньше этого размера не сжимаются: zlib на них только добавляет байты
+COMPRESS_MIN_SIZE = 256
+# Как часто удалять из таблицы просроченные сессии (секунды)
+PURGE_INTERVAL = 600
+
+FSM_STATE_QUERY = statement('fsm_get_state', """
+SELECT state, data, EXTRACT(EPOCH FROM expires_at - NOW())::float8 AS ttl
+FROM fsm_states
+WHERE key = $1 AND expires_at > NOW()
+""")
+
+# Одна запись на все изменившиеся ключи: пустые удаляются, остальные
+# вставляются или перезаписываются с продленным сроком
+FSM_FLUSH_QUERY = statement('fsm_flush', """
+WITH deleted AS (
+    DELETE FROM fsm_states WHERE key = ANY($1::text[])
+)
+INSERT INTO fsm_states (key, state, data, expires_at)
+SELECT key, state, data, NOW() + make_interval(secs => $5::float8)
+FROM unnest($2::text[], $3::text[], $4::bytea[]) AS t(key, state, data)
+ON CONFLICT (key) DO UPDATE
+SET state = EXCLUDED.state,
+    data = EXCLUDED.data,
+    expires_at = EXCLUDED.expires_at
+""")
+
+FSM_PURGE_QUERY = statement('fsm_purge_expired', "DELETE FROM fsm_states WHERE expires_at <= NOW()")
+
+def serialize(data: Dict[str, Any]) -> Optional[bytes]:
+    """pickle словаря данных, сжатый zlib, если он достаточно большой"""
+    if not data:
+        return None
+    raw = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(raw) >= COMPRESS_MIN_SIZE:
+        return b'z' + zlib.compress(raw)
+    return b'p' + raw
+
+def deserialize(blob: Optional[bytes]) -> Dict[str, Any]:
+    if not blob:
+        return {}
+    raw = zlib.decompress(blob[1:]) if blob[:1] == b'z' else blob[1:]
+    return pickle.loads(raw)
+
+
+class _Entry:
+    __slots__ = ('state', 'data', 'expires', 'dirty')
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], expires: float):
+        self.state = state
+        self.data = data
+        self.expires = expires
+        self.dirty = False
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class PostgresStorage(BaseStorage):
+    """Хранилище FSM в таблице fsm_states.
+
+    Изменения копятся в памяти и пишутся одним запросом в flush() - его вызывает
+    FSMFlushMiddleware после обработки обновления, так что несколько
+    state.update_data в одном обработчике превращаются в одну запись.
+
+    Прочитанные записи остаются в памяти (до cache_size штук), и следующие
+    обновления пользователя не ходят в БД. Это верно, пока обновления одного
+    пользователя обрабатывает один процесс; при произвольной раздаче обновлений
+    между процессами нужен cache_size=0 - тогда записи читаются заново
+    в каждом обновлении.
+
+    Сессия, которую не меняли дольше ttl секунд, считается брошенной и удаляется.
+    """
+
+    def __init__(self, ttl: float = 86400, cache_size: int = 10000):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        # ключ -> запись, от давно использованных к недавним
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._dirty = set()
+        self._flush_lock = asyncio.Lock()
+        self._last_purge = 0.0
+        self.reads = 0
+        self.writes = 0
+
+    async def _entry(self, key: StorageKey) -> Tuple[str, _Entry]:
+        storage_key = self._key_builder.build(key)
+        entry = self._entries.get(storage_key)
+        now = time.monotonic()
+        if entry is not None and entry.expires <= now and not entry.dirty:
+            entry = None
+        if entry is None:
+            self.reads += 1
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                row = await conn.fetchrow(FSM_STATE_QUERY, storage_key)
+            # Пока читали, запись мог создать или изменить параллельный обработчик
+            entry = self._entries.get(storage_key)
+            if entry is None or (entry.expires <= now and not entry.dirty):
+                if row:
+                    entry = _Entry(row['state'], deserialize(row['data']), now + row['ttl'])
+                else:
+                    entry = _Entry(None, {}, now + self.ttl)
+                self._entries[storage_key] = entry
+        self._entries.move_to_end(storage_key)
+        return storage_key, entry
+
+    def _touch(self, storage_key: str, entry: _Entry):
+        entry.dirty = True
+        entry.expires = time.monotonic() + self.ttl
+        self._dirty.add(storage_key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key, entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._touch(storage_key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, entry = await self._entry(key)
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key, entry = await self._entry(key)
+        entry.data = dict(data)
+        self._touch(storage_key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, entry = await self._entry(key)
+        return entry.data.copy()
+
+    async def flush(self) -> int:
+        """Пишет в БД все накопленные изменения одним запросом; возвращает число ключей"""
+        async with self._flush_lock:
+            if not self._dirty:
+                self._trim()
+                await self._purge_expired()
+                return 0
+
+            dirty, self._dirty = self._dirty, set()
+            deleted, keys, states, blobs = [], [], [], []
+            for storage_key in dirty:
+                entry = self._entries[storage_key]
+                entry.dirty = False
+                if entry.is_empty():
+                    deleted.append(storage_key)
+                    continue
+                try:
+                    blob = serialize(entry.data)
+                except Exception as e:
+                    # Несериализуемое значение в данных: в БД остается прежняя версия
+                    print(f"[{datetime.now()}] Не удалось сохранить состояние {storage_key}: {e}")
+                    continue
+                keys.append(storage_key)
+                states.append(entry.state)
+                blobs.append(blob)
+
+            try:
+                pool = await get_db_pool()
+                async with pool.acquire() as conn:
+                    await conn.execute(FSM_FLUSH_QUERY, deleted, keys, states, blobs, float(self.ttl))
+            except Exception:
+                # Изменения остаются в памяти и уйдут со следующей записью
+                for storage_key in dirty:
+                    self._entries[storage_key].dirty = True
+                self._dirty |= dirty
+                raise
+
+            self.writes += 1
+            self._trim()
+            await self._purge_expired()
+            return len(dirty)
+
+    def _trim(self):
+        """Оставляет в памяти не больше cache_size записей (несохраненные не трогаются)"""
+        excess = len(self._entries) - self.cache_size
+        if excess <= 0:
+            return
+        for storage_key in list(self._entries):
+            if excess <= 0:
+                break
+            if not self._entries[storage_key].dirty:
+                del self._entries[storage_key]
+                excess -= 1
+
+    async def _purge_expired(self):
+        now = time.monotonic()
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute(FSM_PURGE_QUERY)
+        print(f"[{datetime.now()}] Удалены брошенные сессии FSM: {result}")
+
+    def stats(self) -> str:
+        return (
+            f"fsm: cached={len(self._entries)} dirty={len(self._dirty)} "
+            f"reads={self.reads} writes={self.writes}"
+        )
+
+    async def close(self) -> None:
+        await self.flush()
@@ -1,7 +1,91 @@
 from db.pool import get_db_pool
+from db.statements import statement
+from db.profile_stats import invalidate_user_stats
 from datetime import datetime, timedelta, timezone
 
 
+# Результат игры и итоги по игре пишутся одним запросом
+SAVE_GAME_RESULT_QUERY = statement('save_game_result', """
+WITH inserted AS (
+    INSERT INTO game_results 
+    (user_id, game_type, result, bet_amount, win_amount, player_score, opponent_score)
+    VALUES ($1, $2, $3, $4, $5, $6, $7)
+    RETURNING user_id, game_type, result, bet_amount, win_amount
+)
+INSERT INTO user_game_aggregates AS a (
+    user_id, game_type, games, wins, losses, draws, jackpots, paid_games,
+    total_bet, total_win, biggest_win
+)
+SELECT
+    user_id,
+    game_type,
+    1,
+    (result = 'win')::int,
+    (result = 'lose')::int,
+    (result = 'draw')::int,
+    (result = 'jackpot')::int,
+    (COALESCE(win_amount, 0) > 0)::int,
+    COALESCE(bet_amount, 0),
+    COALESCE(win_amount, 0),
+    COALESCE(win_amount, 0)
+FROM inserted
+ON CONFLICT (user_id, game_type) DO UPDATE SET
+    games = a.games + 1,
+    wins = a.wins + EXCLUDED.wins,
+    losses = a.losses + EXCLUDED.losses,
+    draws = a.draws + EXCLUDED.draws,
+    jackpots = a.jackpots + EXCLUDED.jackpots,
+    paid_games = a.paid_games + EXCLUDED.paid_games,
+    total_bet = a.total_bet + EXCLUDED.total_bet,
+    total_win = a.total_win + EXCLUDED.total_win,
+    biggest_win = GREATEST(a.biggest_win, EXCLUDED.biggest_win),
+    updated_at = NOW()
+""")
+
+GAME_AGGREGATES_QUERY = statement('get_game_aggregates', """
+SELECT games, wins, losses, draws, jackpots, paid_games, total_bet, total_win, biggest_win
+FROM user_game_aggregates
+WHERE user_id = $1 AND game_type = $2
+""")
+
+ALL_GAME_AGGREGATES_QUERY = statement('get_all_game_aggregates', """
+SELECT
+    COALESCE(SUM(games), 0) as games,
+    COALESCE(SUM(wins), 0) as wins,
+    COALESCE(SUM(losses), 0) as losses,
+    COALESCE(SUM(draws), 0) as draws,
+    COALESCE(SUM(total_win), 0) as total_win,
+    COALESCE(SUM(total_bet), 0) as total_bet
+FROM user_game_aggregates
+WHERE user_id = $1
+""")
+
+# Результат тренировки и счетчики тренировок в сводке профиля пишутся одним запросом
+SAVE_TRAINING_RESULT_QUERY = statement('save_training_result', """
+WITH inserted AS (
+    INSERT INTO training_results 
+    (user_id, drill_type, success, reward_earned, level, trained_at)
+    VALUES ($1, $2, $3, $4, $5, NOW())
+    RETURNING user_id, success, reward_earned, level
+)
+INSERT INTO user_profile_aggregates AS a (
+    user_id, total_trainings, successful_trainings, training_rewards, max_training_level
+)
+SELECT user_id, 1, COALESCE(success, false)::int, COALESCE(reward_earned, 0), level
+FROM inserted
+ON CONFLICT (user_id) DO UPDATE SET
+    total_trainings = a.total_trainings + 1,
+    successful_trainings = a.successful_trainings + EXCLUDED.successful_trainings,
+    training_rewards = a.training_rewards + EXCLUDED.training_rewards,
+    max_training_level = GREATEST(a.max_training_level, EXCLUDED.max_training_level),
+    updated_at = NOW()
+""")
+
+EMPTY_AGGREGATES = {
+    'games': 0, 'wins': 0, 'losses': 0, 'draws': 0, 'jackpots': 0, 'paid_games': 0,
+    'total_bet': 0, 'total_win': 0, 'biggest_win': 0
+}
+
 async def save_game_result(
     user_id: int,
     game_type: str,
@@ -11,191 +95,96 @@ async def save_game_result(
     player_score: int = None,
     opponent_score: int = None
 ) -> None:
-    """Сохраняет результат игры в базу данных"""
+    """Сохраняет результат игры в базу данных и обновляет итоги по игре"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = """
-        INSERT INTO game_results 
-        (user_id, game_type, result, bet_amount, win_amount, player_score, opponent_score)
-        VALUES ($1, $2, $3, $4, $5, $6, $7)
-        """
         await conn.execute(
-            query, user_id, game_type, result, bet_amount, 
+            SAVE_GAME_RESULT_QUERY, user_id, game_type, result, bet_amount, 
             win_amount, player_score, opponent_score
         )
+    invalidate_user_stats(user_id)
 
-async def get_user_game_stats(user_id: int, game_type: str = None):
-    """Получает статистику игр пользователя"""
+async def get_game_aggregates(user_id: int, game_type: str) -> dict:
+    """Итоги пользователя по одной игре (одна строка по первичному ключу)"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        if game_type:
-            query = """
-            SELECT 
-                COUNT(*) as total_games,
-                SUM(CASE WHEN result = 'win' THEN 1 ELSE 0 END) as wins,
-                SUM(CASE WHEN result = 'lose' THEN 1 ELSE 0 END) as losses,
-                SUM(CASE WHEN result = 'draw' THEN 1 ELSE 0 END) as draws,
-                SUM(win_amount) as total_winnings,
-                SUM(bet_amount) as total_bets
-            FROM game_results 
-            WHERE user_id = $1 AND game_type = $2
-            """
-            result = await conn.fetchrow(query, user_id, game_type)
-        else:
-            query = """
-            SELECT 
-                COUNT(*) as total_games,
-                SUM(CASE WHEN result = 'win' THEN 1 ELSE 0 END) as wins,
-                SUM(CASE WHEN result = 'lose' THEN 1 ELSE 0 END) as losses,
-                SUM(CASE WHEN result = 'draw' THEN 1 ELSE 0 END) as draws,
-                SUM(win_amount) as total_winnings,
-                SUM(bet_amount) as total_bets
-            FROM game_results 
-            WHERE user_id = $1
-            """
-            result = await conn.fetchrow(query, user_id)
-        
-        return dict(result) if result else {
-            'total_games': 0, 'wins': 0, 'losses': 0, 'draws': 0,
-            'total_winnings': 0, 'total_bets': 0
-        }
+        row = await conn.fetchrow(GAME_AGGREGATES_QUERY, user_id, game_type)
+    return dict(row) if row else dict(EMPTY_AGGREGATES)
+
+def _win_percentage(wins: int, games: int) -> float:
+    return round(wins / games * 100, 1) if games > 0 else 0
+
+async def get_user_game_stats(user_id: int, game_type: str = None):
+    """Получает статистику игр пользователя"""
+    if game_type:
+        stats = await get_game_aggregates(user_id, game_type)
+    else:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            stats = dict(await conn.fetchrow(ALL_GAME_AGGREGATES_QUERY, user_id))
+    
+    return {
+        'total_games': stats['games'],
+        'wins': stats['wins'],
+        'losses': stats['losses'],
+        'draws': stats['draws'],
+        'total_winnings': stats['total_win'],
+        'total_bets': stats['total_bet']
+    }
     
 async def get_football_dice_stats(user_id: int):
     """Получение статистики по футбольным костям"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        # Общая статистика
-        total_games = await conn.fetchval(
-            "SELECT COUNT(*) FROM game_results WHERE user_id = $1 AND game_type = 'football_dice'",
-            user_id
-        )
-        
-        wins = await conn.fetchval(
-            "SELECT COUNT(*) FROM game_results WHERE user_id = $1 AND game_type = 'football_dice' AND result = 'win'",
-            user_id
-        )
-        
-        losses = await conn.fetchval(
-            "SELECT COUNT(*) FROM game_results WHERE user_id = $1 AND game_type = 'football_dice' AND result = 'lose'",
-            user_id
-        )
-        
-        draws = await conn.fetchval(
-            "SELECT COUNT(*) FROM game_results WHERE user_id = $1 AND game_type = 'football_dice' AND result = 'draw'",
-            user_id
-        )
-        
-        # Финансовая статистика
-        total_win = await conn.fetchval(
-            "SELECT COALESCE(SUM(win_amount), 0) FROM game_results WHERE user_id = $1 AND game_type = 'football_dice'",
-            user_id
-        )
-        
-        total_bet = await conn.fetchval(
-            "SELECT COALESCE(SUM(bet_amount), 0) FROM game_results WHERE user_id = $1 AND game_type = 'football_dice'",
-            user_id
-        )
-        
-        profit = total_win - total_bet
-        
-        # Процент побед
-        win_percentage = (wins / total_games * 100) if total_games > 0 else 0
-        
-        return {
-            'total_games': total_games,
-            'wins': wins,
-            'losses': losses,
-            'draws': draws,
-            'win_percentage': round(win_percentage, 1),
-            'total_win': total_win,
-            'total_bet': total_bet,
-            'profit': profit
-        }
+    stats = await get_game_aggregates(user_id, 'football_dice')
+    
+    return {
+        'total_games': stats['games'],
+        'wins': stats['wins'],
+        'losses': stats['losses'],
+        'draws': stats['draws'],
+        'win_percentage': _win_percentage(stats['wins'], stats['games']),
+        'total_win': stats['total_win'],
+        'total_bet': stats['total_bet'],
+        'profit': stats['total_win'] - stats['total_bet']
+    }
     
 async def get_slot_machine_stats(user_id: int):
     """Получение статистики по слот-машине"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        # Общая статистика
-        total_games = await conn.fetchval(
-            "SELECT COUNT(*) FROM game_results WHERE user_id = $1 AND game_type = 'slot_machine'",
-            user_id
-        )
-        
-        wins = await conn.fetchval(
-            "SELECT COUNT(*) FROM game_results WHERE user_id = $1 AND game_type = 'slot_machine' AND win_amount > 0",
-            user_id
-        )
-        
-        jackpots = await conn.fetchval(
-            "SELECT COUNT(*) FROM game_results WHERE user_id = $1 AND game_type = 'slot_machine' AND result = 'jackpot'",
-            user_id
-        )
-        
-        # Финансовая статистика
-        total_win = await conn.fetchval(
-            "SELECT COALESCE(SUM(win_amount), 0) FROM game_results WHERE user_id = $1 AND game_type = 'slot_machine'",
-            user_id
-        )
-        
-        total_bet = await conn.fetchval(
-            "SELECT COALESCE(SUM(bet_amount), 0) FROM game_results WHERE user_id = $1 AND game_type = 'slot_machine'",
-            user_id
-        )
-        
-        profit = total_win - total_bet
-        
-        # Процент побед
-        win_percentage = (wins / total_games * 100) if total_games > 0 else 0
-        
-        return {
-            'total_games': total_games,
-            'wins': wins,
-            'jackpots': jackpots,
-            'win_percentage': round(win_percentage, 1),
-            'total_win': total_win,
-            'total_bet': total_bet,
-            'profit': profit,
-            'biggest_win': await conn.fetchval(
-                "SELECT COALESCE(MAX(win_amount), 0) FROM game_results WHERE user_id = $1 AND game_type = 'slot_machine'",
-                user_id
-            )
-        }
+    stats = await get_game_aggregates(user_id, 'slot_machine')
+    
+    # Выигрышным спином считается любой спин с ненулевым выигрышем
+    return {
+        'total_games': stats['games'],
+        'wins': stats['paid_games'],
+        'jackpots': stats['jackpots'],
+        'win_percentage': _win_percentage(stats['paid_games'], stats['games']),
+        'total_win': stats['total_win'],
+        'total_bet': stats['total_bet'],
+        'profit': stats['total_win'] - stats['total_bet'],
+        'biggest_win': stats['biggest_win']
+    }
     
 async def get_football_roulette_stats(user_id: int):
     """Получает статистику игрока в футбольной рулетке"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        query = """
-        SELECT 
-            COUNT(*) as total_games,
-            SUM(CASE WHEN result = 'win' THEN 1 ELSE 0 END) as wins,
-            SUM(CASE WHEN result = 'lose' THEN 1 ELSE 0 END) as losses,
-            SUM(CASE WHEN result = 'draw' THEN 1 ELSE 0 END) as draws,
-            COALESCE(SUM(win_amount), 0) as total_win,
-            COALESCE(SUM(bet_amount), 0) as total_bet,
-            COALESCE(SUM(win_amount - bet_amount), 0) as profit,
-            CASE 
-                WHEN COUNT(*) > 0 THEN 
-                    ROUND(SUM(CASE WHEN result = 'win' THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 1)
-                ELSE 0 
-            END as win_percentage,
-            COALESCE(MAX(win_amount), 0) as biggest_win
-        FROM game_results 
-        WHERE user_id = $1 AND game_type = 'football_roulette'
-        """
-        return await conn.fetchrow(query, user_id)
+    stats = await get_game_aggregates(user_id, 'football_roulette')
+    
+    return {
+        'total_games': stats['games'],
+        'wins': stats['wins'],
+        'losses': stats['losses'],
+        'draws': stats['draws'],
+        'total_win': stats['total_win'],
+        'total_bet': stats['total_bet'],
+        'profit': stats['total_win'] - stats['total_bet'],
+        'win_percentage': _win_percentage(stats['wins'], stats['games']),
+        'biggest_win': stats['biggest_win']
+    }
     
 async def save_training_result(user_id: int, drill_type: str, success: bool, reward_earned: int, level: int):
-    """Сохраняет результат тренировки"""
+    """Сохраняет результат тренировки и обновляет счетчики тренировок в сводке профиля"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = """
-        INSERT INTO training_results 
-        (user_id, drill_type, success, reward_earned, level, trained_at)
-        VALUES ($1, $2, $3, $4, $5, NOW())
-        """
-        await conn.execute(query, user_id, drill_type, success, reward_earned, level)
+        await conn.execute(SAVE_TRAINING_RESULT_QUERY, user_id, drill_type, success, reward_earned, level)
+    invalidate_user_stats(user_id)
 
 async def get_training_stats(user_id: int):
     """Получает статистику тренировок игрока"""
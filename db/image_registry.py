@@ -0,0 +1,63 @@
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from db.pool import get_db_pool
+
+# (bot_id, path) -> (mtime файла при загрузке, file_id)
+_file_ids: Dict[Tuple[int, str], Tuple[int, str]] = {}
+_loaded = False
+
+async def load_file_ids() -> int:
+    """Загружает реестр file_id из БД в память"""
+    global _file_ids, _loaded
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT bot_id, path, file_mtime_ns, file_id FROM card_image_file_ids")
+    _file_ids = {(row['bot_id'], row['path']): (row['file_mtime_ns'], row['file_id']) for row in rows}
+    _loaded = True
+    print(f"[{datetime.now()}] Реестр картинок загружен: {len(_file_ids)} file_id")
+    return len(_file_ids)
+
+async def get_file_id(bot_id: int, path: str, mtime_ns: int) -> Optional[str]:
+    """file_id картинки, если она уже загружалась и файл с тех пор не менялся"""
+    if not _loaded:
+        await load_file_ids()
+
+    entry = _file_ids.get((bot_id, path))
+    if entry is None:
+        # Картинку мог загрузить другой процесс бота
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT file_mtime_ns, file_id FROM card_image_file_ids WHERE bot_id = $1 AND path = $2",
+                bot_id, path
+            )
+        if not row:
+            return None
+        entry = _file_ids[(bot_id, path)] = (row['file_mtime_ns'], row['file_id'])
+
+    stored_mtime, file_id = entry
+    return file_id if stored_mtime == mtime_ns else None
+
+def is_registered(bot_id: int, path: str, mtime_ns: int) -> bool:
+    """Есть ли в памяти актуальный file_id (без запроса к БД)"""
+    entry = _file_ids.get((bot_id, path))
+    return entry is not None and entry[0] == mtime_ns
+
+async def save_file_id(bot_id: int, path: str, mtime_ns: int, file_id: str):
+    """Сохраняет file_id загруженной картинки"""
+    _file_ids[(bot_id, path)] = (mtime_ns, file_id)
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            INSERT INTO card_image_file_ids (bot_id, path, file_mtime_ns, file_id)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (bot_id, path) DO UPDATE
+            SET file_mtime_ns = EXCLUDED.file_mtime_ns,
+                file_id = EXCLUDED.file_id,
+                uploaded_at = NOW()
+        """, bot_id, path, mtime_ns, file_id)
+
+def forget_file_id(bot_id: int, path: str):
+    """Убирает file_id, который Telegram перестал принимать"""
+    _file_ids.pop((bot_id, path), None)
@@ -0,0 +1,116 @@
+import asyncio
+import bisect
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from db.pool import get_db_pool
+
+SCORE_CHANGED_CHANNEL = 'user_score_changed'
+
+# Рейтинг в памяти: отсортированный массив ключей (-score, user_id) -
+# позиция игрока ищется бисекцией, топ - срез начала массива.
+# В рейтинг попадают только игроки с очками (score > 0)
+_ranking: List[Tuple[int, int]] = []
+# user_id -> {'user_id', 'username', 'score'}
+_players: Dict[int, Dict] = {}
+_loaded = False
+_refresh_lock = asyncio.Lock()
+# Изменения очков, пришедшие во время перезагрузки: применяются к новому
+# снимку в порядке поступления, последнее значение побеждает
+_pending: Optional[List[Tuple[int, int, Optional[str]]]] = None
+
+def set_players(rows) -> None:
+    """Строит рейтинг из строк users (user_id, username, score) и атомарно подменяет текущий"""
+    global _ranking, _players, _loaded
+
+    players = {}
+    for row in rows:
+        if row['score'] > 0:
+            players[row['user_id']] = {
+                'user_id': row['user_id'],
+                'username': row['username'],
+                'score': row['score']
+            }
+
+    _ranking = sorted((-player['score'], user_id) for user_id, player in players.items())
+    _players = players
+    _loaded = True
+
+async def load_leaderboard() -> int:
+    """Загружает рейтинг игроков с очками из БД"""
+    global _pending
+    async with _refresh_lock:
+        _pending = []
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                rows = await conn.fetch("SELECT user_id, username, score FROM users WHERE score > 0")
+            set_players(rows)
+            pending = _pending
+        finally:
+            _pending = None
+        for user_id, score, username in pending:
+            apply_score(user_id, score, username)
+    print(f"[{datetime.now()}] Рейтинг загружен: {len(_ranking)} игроков")
+    return len(_ranking)
+
+async def refresh_leaderboard(payload: str = None):
+    """Обработчик NOTIFY user_score_changed: применяет новый счет игрока.
+
+    Без payload (переподключение LISTEN) перечитывает рейтинг целиком."""
+    try:
+        if payload is None:
+            await load_leaderboard()
+            return
+        data = json.loads(payload)
+        apply_score(data['user_id'], data['score'], data.get('username'))
+    except Exception as e:
+        print(f"[{datetime.now()}] ОШИБКА обновления рейтинга: {e}")
+
+async def ensure_leaderboard():
+    """Загружает рейтинг, если он еще не загружен"""
+    if not _loaded:
+        await load_leaderboard()
+
+def apply_score(user_id: int, score: int, username: str = None) -> None:
+    """Переставляет игрока в рейтинге после изменения счета (score - итоговое значение)"""
+    if _pending is not None:
+        _pending.append((user_id, score, username))
+
+    player = _players.get(user_id)
+    if player is not None:
+        if player['score'] == score and (username is None or player['username'] == username):
+            return
+        index = bisect.bisect_left(_ranking, (-player['score'], user_id))
+        if index < len(_ranking) and _ranking[index] == (-player['score'], user_id):
+            del _ranking[index]
+        if username is None:
+            username = player['username']
+
+    if score <= 0:
+        _players.pop(user_id, None)
+        return
+
+    _players[user_id] = {'user_id': user_id, 'username': username, 'score': score}
+    bisect.insort(_ranking, (-score, user_id))
+
+def get_top(limit: int = 10) -> List[Dict]:
+    """Первые limit игроков рейтинга"""
+    return [dict(_players[user_id]) for _, user_id in _ranking[:limit]]
+
+def get_rank(user_id: int) -> Optional[int]:
+    """Позиция игрока (с 1) или None, если у него нет очков"""
+    player = _players.get(user_id)
+    if player is None:
+        return None
+    return bisect.bisect_left(_ranking, (-player['score'], user_id)) + 1
+
+def get_player(user_id: int) -> Optional[Dict]:
+    """Запись игрока в рейтинге (username, score) или None"""
+    player = _players.get(user_id)
+    return dict(player) if player else None
+
+def total_players() -> int:
+    """Число игроков с очками"""
+    return len(_ranking)
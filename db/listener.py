@@ -0,0 +1,61 @@
+import asyncio
+import asyncpg
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from db.pool import DB_SETTINGS
+
+RECONNECT_DELAY = 5
+
+_connection = None
+_handlers: Dict[str, List[Callable]] = {}
+_stopping = False
+
+def add_notify_handler(channel: str, callback: Callable):
+    """Подписывает обработчик на канал LISTEN/NOTIFY (callback получает payload)"""
+    _handlers.setdefault(channel, []).append(callback)
+
+async def start_listener():
+    """Открывает отдельное соединение для LISTEN и подписывается на все каналы"""
+    global _connection, _stopping
+    _stopping = False
+    _connection = await asyncpg.connect(**DB_SETTINGS)
+    _connection.add_termination_listener(_on_terminated)
+    for channel in _handlers:
+        await _connection.add_listener(channel, _dispatch)
+    print(f"[{datetime.now()}] LISTEN запущен для каналов: {', '.join(_handlers)}")
+
+async def stop_listener():
+    """Закрывает соединение LISTEN"""
+    global _connection, _stopping
+    _stopping = True
+    if _connection and not _connection.is_closed():
+        await _connection.close()
+    _connection = None
+
+def _run_handlers(channel: str, payload: str):
+    for callback in _handlers.get(channel, []):
+        result = callback(payload)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+def _dispatch(conn, pid, channel, payload):
+    _run_handlers(channel, payload)
+
+def _on_terminated(conn):
+    if not _stopping:
+        print(f"[{datetime.now()}] Соединение LISTEN потеряно, переподключение")
+        asyncio.ensure_future(_reconnect())
+
+async def _reconnect():
+    while not _stopping:
+        await asyncio.sleep(RECONNECT_DELAY)
+        try:
+            await start_listener()
+        except Exception as e:
+            print(f"[{datetime.now()}] Не удалось переподключить LISTEN: {e}")
+            continue
+        # Пока соединения не было, уведомления могли потеряться - сбрасываем все кэши
+        for channel in list(_handlers):
+            _run_handlers(channel, None)
+        return
@@ -0,0 +1,95 @@
+import bisect
+from typing import Dict, List
+
+# Границы корзин гистограмм в миллисекундах (последняя корзина - все, что больше)
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def quantile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль q (оценка сверху)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def summary(self) -> str:
+        if not self.count:
+            return "n=0"
+        return (
+            f"n={self.count} avg={self.total_ms / self.count:.1f}ms "
+            f"p50<={self.quantile(0.5):g}ms p95<={self.quantile(0.95):g}ms "
+            f"p99<={self.quantile(0.99):g}ms max={self.max_ms:.1f}ms"
+        )
+
+class QueryStats:
+    """Задержка, число строк и ошибки запросов одной функции"""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.errors = 0
+
+# Ожидание свободного соединения и время, на которое соединение занято
+pool_wait = Histogram()
+pool_checkout = Histogram()
+pool_timeouts = 0
+
+_queries: Dict[str, QueryStats] = {}
+
+def record_pool_timeout():
+    global pool_timeouts
+    pool_timeouts += 1
+
+def record_query(name: str, seconds: float, rows: int, failed: bool = False):
+    """Учитывает один запрос функции name"""
+    stats = _queries.get(name)
+    if stats is None:
+        stats = _queries[name] = QueryStats()
+    stats.latency.observe(seconds)
+    stats.rows += rows
+    if failed:
+        stats.errors += 1
+
+def reset_metrics():
+    """Сбрасывает все накопленные метрики"""
+    global pool_wait, pool_checkout, pool_timeouts, _queries
+    pool_wait = Histogram()
+    pool_checkout = Histogram()
+    pool_timeouts = 0
+    _queries = {}
+
+def dump_metrics(pool=None, top: int = 20) -> str:
+    """Текстовый отчет: пул соединений и самые нагруженные функции по суммарному времени"""
+    lines: List[str] = []
+    if pool is not None:
+        lines.append(f"pool: size={pool.get_size()} idle={pool.get_idle_size()} "
+                     f"min={pool.get_min_size()} max={pool.get_max_size()}")
+    lines.append(f"wait: {pool_wait.summary()} timeouts={pool_timeouts}")
+    lines.append(f"checkout: {pool_checkout.summary()}")
+
+    ranked = sorted(_queries.items(), key=lambda item: item[1].latency.total_ms, reverse=True)
+    for name, stats in ranked[:top]:
+        rows_avg = stats.rows / stats.latency.count if stats.latency.count else 0
+        lines.append(f"{name}: {stats.latency.summary()} rows/q={rows_avg:.1f} errors={stats.errors}")
+    return "\n".join(lines)
@@ -0,0 +1,12 @@
+-- Уведомления об изменении таблиц для сброса кэшей в памяти процесса
+CREATE OR REPLACE FUNCTION notify_table_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(TG_ARGV[0], TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS cards_changed_notify ON cards;
+CREATE TRIGGER cards_changed_notify
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON cards
+FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed('cards_changed');
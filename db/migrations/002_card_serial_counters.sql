@@ -0,0 +1,15 @@
+-- Счетчик порядковых номеров по каждой карте вместо COUNT(*) по user_cards
+DO $$
+BEGIN
+    IF to_regclass('card_serial_counters') IS NULL THEN
+        CREATE TABLE card_serial_counters (
+            card_id INTEGER PRIMARY KEY REFERENCES cards(id) ON DELETE CASCADE,
+            last_serial INTEGER NOT NULL DEFAULT 0
+        );
+
+        INSERT INTO card_serial_counters (card_id, last_serial)
+        SELECT card_id, MAX(serial_number)
+        FROM user_cards
+        GROUP BY card_id;
+    END IF;
+END $$;
@@ -0,0 +1,2 @@
+-- Сид потока случайных чисел открытия: позволяет воспроизвести открытие при аудите
+ALTER TABLE pack_openings ADD COLUMN IF NOT EXISTS rng_seed BIGINT;
@@ -0,0 +1,12 @@
+-- Уведомления для кэша каталога паков. Счетчик cards_opened меняется при каждом
+-- открытии коллекционного пака, поэтому для collections слушаем только те
+-- колонки, от которых зависит сам каталог
+DROP TRIGGER IF EXISTS packs_changed_notify ON packs;
+CREATE TRIGGER packs_changed_notify
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON packs
+FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed('packs_changed');
+
+DROP TRIGGER IF EXISTS collections_changed_notify ON collections;
+CREATE TRIGGER collections_changed_notify
+AFTER INSERT OR DELETE OR TRUNCATE OR UPDATE OF name, description, is_active, end_date, total_cards ON collections
+FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed('packs_changed');
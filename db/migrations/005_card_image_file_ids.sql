@@ -0,0 +1,10 @@
+-- file_id загруженных в Telegram картинок карт: файл отправляется один раз,
+-- дальше переиспользуется file_id. file_id действителен только для загрузившего бота
+CREATE TABLE IF NOT EXISTS card_image_file_ids (
+    bot_id BIGINT NOT NULL,
+    path TEXT NOT NULL,
+    file_mtime_ns BIGINT NOT NULL,
+    file_id TEXT NOT NULL,
+    uploaded_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (bot_id, path)
+);
@@ -0,0 +1,42 @@
+-- Итоги игр по пользователю и типу игры: статистика читается одной строкой
+-- по первичному ключу, а не сканированием всей истории game_results
+DO $$
+BEGIN
+    IF to_regclass('user_game_aggregates') IS NULL THEN
+        CREATE TABLE user_game_aggregates (
+            user_id BIGINT NOT NULL,
+            game_type VARCHAR(50) NOT NULL,
+            games INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            losses INTEGER NOT NULL DEFAULT 0,
+            draws INTEGER NOT NULL DEFAULT 0,
+            jackpots INTEGER NOT NULL DEFAULT 0,
+            -- Игры с ненулевым выигрышем (для слотов выигрышем считается любой win_amount > 0)
+            paid_games INTEGER NOT NULL DEFAULT 0,
+            total_bet BIGINT NOT NULL DEFAULT 0,
+            total_win BIGINT NOT NULL DEFAULT 0,
+            biggest_win BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (user_id, game_type)
+        );
+
+        INSERT INTO user_game_aggregates (
+            user_id, game_type, games, wins, losses, draws, jackpots, paid_games,
+            total_bet, total_win, biggest_win
+        )
+        SELECT
+            user_id,
+            game_type,
+            COUNT(*),
+            COUNT(*) FILTER (WHERE result = 'win'),
+            COUNT(*) FILTER (WHERE result = 'lose'),
+            COUNT(*) FILTER (WHERE result = 'draw'),
+            COUNT(*) FILTER (WHERE result = 'jackpot'),
+            COUNT(*) FILTER (WHERE win_amount > 0),
+            COALESCE(SUM(bet_amount), 0),
+            COALESCE(SUM(win_amount), 0),
+            COALESCE(MAX(win_amount), 0)
+        FROM game_results
+        GROUP BY user_id, game_type;
+    END IF;
+END $$;
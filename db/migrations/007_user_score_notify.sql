@@ -0,0 +1,19 @@
+-- Уведомления для рейтинга в памяти: при изменении очков игрока процессы
+-- получают его итоговый счет и переставляют его в рейтинге без запросов к БД
+CREATE OR REPLACE FUNCTION notify_user_score_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('user_score_changed', json_build_object(
+        'user_id', NEW.user_id,
+        'username', NEW.username,
+        'score', NEW.score
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_score_changed_notify ON users;
+CREATE TRIGGER user_score_changed_notify
+AFTER UPDATE OF score ON users
+FOR EACH ROW
+WHEN (OLD.score IS DISTINCT FROM NEW.score)
+EXECUTE FUNCTION notify_user_score_changed();
@@ -0,0 +1,28 @@
+-- Постраничный обзор маркета по ключу (created_at, id): страница читается
+-- из индекса с нужного места, а не через OFFSET с начала выборки
+CREATE INDEX IF NOT EXISTS market_listings_active_created_idx
+    ON market_listings (created_at DESC, id DESC) WHERE is_sold = FALSE;
+CREATE INDEX IF NOT EXISTS market_listings_active_user_idx
+    ON market_listings (user_id) WHERE is_sold = FALSE;
+CREATE INDEX IF NOT EXISTS market_listings_active_card_idx
+    ON market_listings (card_id) WHERE is_sold = FALSE;
+
+-- Число активных объявлений по редкостям вместо COUNT по join на каждой странице.
+-- Счетчики меняются теми же запросами, что выставляют, продают и снимают объявления
+DO $$
+BEGIN
+    IF to_regclass('market_listing_counts') IS NULL THEN
+        CREATE TABLE market_listing_counts (
+            rarity VARCHAR(20) PRIMARY KEY,
+            active INTEGER NOT NULL DEFAULT 0
+        );
+
+        INSERT INTO market_listing_counts (rarity, active)
+        SELECT c.rarity, COUNT(*)
+        FROM market_listings ml
+        JOIN user_cards uc ON ml.card_id = uc.id
+        JOIN cards c ON uc.card_id = c.id
+        WHERE ml.is_sold = FALSE
+        GROUP BY c.rarity;
+    END IF;
+END $$;
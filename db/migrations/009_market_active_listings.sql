@@ -0,0 +1,42 @@
+-- Витрина активных объявлений: все, что показывает маркет (игрок, редкость,
+-- рейтинг, номер, продавец, коллекция), лежит в одной узкой таблице.
+-- Строки пишут те же запросы, что выставляют, продают, снимают объявления
+-- и меняют цену, поэтому чтения маркета обходятся без пяти join
+DO $$
+BEGIN
+    IF to_regclass('market_active_listings') IS NULL THEN
+        CREATE TABLE market_active_listings AS
+        SELECT
+            ml.id,
+            ml.user_id,
+            ml.card_id,
+            ml.price,
+            ml.created_at,
+            c.id as base_card_id,
+            c.player_name,
+            c.rarity,
+            c.uniq_name,
+            c.weight,
+            uc.serial_number,
+            u.username as seller_name,
+            col.name as collection_name
+        FROM market_listings ml
+        JOIN user_cards uc ON ml.card_id = uc.id
+        JOIN cards c ON uc.card_id = c.id
+        JOIN users u ON ml.user_id = u.user_id
+        LEFT JOIN collections col ON c.collection_id = col.id
+        WHERE ml.is_sold = FALSE;
+
+        ALTER TABLE market_active_listings ADD PRIMARY KEY (id);
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS market_active_listings_created_idx
+    ON market_active_listings (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS market_active_listings_rarity_created_idx
+    ON market_active_listings (rarity, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS market_active_listings_user_idx
+    ON market_active_listings (user_id, created_at DESC);
+-- Карточка выставлена не более чем одним активным объявлением
+CREATE UNIQUE INDEX IF NOT EXISTS market_active_listings_card_idx
+    ON market_active_listings (card_id);
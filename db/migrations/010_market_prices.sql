@@ -0,0 +1,83 @@
+-- Ценовые индексы витрины маркета: самые дешевые предложения карты или
+-- игрока и обзор в диапазоне цен читаются из индекса по возрастанию цены
+CREATE INDEX IF NOT EXISTS market_active_listings_card_price_idx
+    ON market_active_listings (base_card_id, price, id);
+CREATE INDEX IF NOT EXISTS market_active_listings_player_price_idx
+    ON market_active_listings (lower(player_name), price, id);
+CREATE INDEX IF NOT EXISTS market_active_listings_price_idx
+    ON market_active_listings (price, id);
+CREATE INDEX IF NOT EXISTS market_active_listings_rarity_price_idx
+    ON market_active_listings (rarity, price, id);
+
+-- Лучшая цена по каждой карте. Строка карты не удаляется, когда предложений
+-- не осталось (listings = 0): на ней сериализуются пересчеты одной карты
+DO $$
+BEGIN
+    IF to_regclass('market_best_prices') IS NULL THEN
+        CREATE TABLE market_best_prices (
+            base_card_id INTEGER PRIMARY KEY,
+            best_price INTEGER,
+            best_listing_id INTEGER,
+            listings INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+
+        INSERT INTO market_best_prices (base_card_id, best_price, best_listing_id, listings)
+        SELECT DISTINCT ON (base_card_id)
+            base_card_id,
+            price,
+            id,
+            COUNT(*) OVER (PARTITION BY base_card_id)
+        FROM market_active_listings
+        ORDER BY base_card_id, price, id;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS market_best_prices_price_idx
+    ON market_best_prices (best_price, base_card_id) WHERE listings > 0;
+
+-- Пересчет лучшей цены карты по индексу (base_card_id, price, id).
+-- Строка карты блокируется до чтения витрины, поэтому параллельные
+-- изменения предложений одной карты пересчитываются по очереди
+CREATE OR REPLACE FUNCTION refresh_market_best_price(card INTEGER) RETURNS void AS $$
+DECLARE
+    cheapest_id INTEGER;
+    cheapest_price INTEGER;
+    total INTEGER;
+BEGIN
+    INSERT INTO market_best_prices (base_card_id) VALUES (card)
+    ON CONFLICT (base_card_id) DO NOTHING;
+    PERFORM 1 FROM market_best_prices WHERE base_card_id = card FOR UPDATE;
+
+    SELECT id, price INTO cheapest_id, cheapest_price
+    FROM market_active_listings
+    WHERE base_card_id = card
+    ORDER BY price, id
+    LIMIT 1;
+
+    SELECT COUNT(*) INTO total FROM market_active_listings WHERE base_card_id = card;
+
+    UPDATE market_best_prices
+    SET best_price = cheapest_price,
+        best_listing_id = cheapest_id,
+        listings = total,
+        updated_at = NOW()
+    WHERE base_card_id = card;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION market_listing_price_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM refresh_market_best_price(OLD.base_card_id);
+    ELSE
+        PERFORM refresh_market_best_price(NEW.base_card_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS market_best_price_refresh ON market_active_listings;
+CREATE TRIGGER market_best_price_refresh
+AFTER INSERT OR DELETE OR UPDATE OF price ON market_active_listings
+FOR EACH ROW EXECUTE FUNCTION market_listing_price_changed();
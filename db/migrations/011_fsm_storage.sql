@@ -0,0 +1,11 @@
+-- Состояния FSM (aiogram): переживают перезапуск и доступны нескольким процессам бота.
+-- data - сжатый pickle словаря данных, expires_at продлевается при каждой записи,
+-- брошенные сессии удаляются по истечении срока
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data BYTEA,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_fsm_states_expires ON fsm_states (expires_at);
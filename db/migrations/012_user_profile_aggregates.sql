@@ -0,0 +1,202 @@
+-- Сводка профиля одной строкой по первичному ключу вместо COUNT по user_cards
+-- и training_results при каждом открытии профиля.
+-- Карточные счетчики ведут триггеры user_cards (карты пишут и выдача в паках,
+-- и сделки маркета), тренировочные - запрос, сохраняющий результат тренировки.
+-- user_card_copies - копии каждой карты у игрока: по переходу 0 <-> 1
+-- считается число уникальных карт
+DO $$
+BEGIN
+    IF to_regclass('user_profile_aggregates') IS NULL THEN
+        -- Пока строим таблицы, карты и тренировки не меняются
+        LOCK TABLE user_cards, training_results IN SHARE ROW EXCLUSIVE MODE;
+
+        CREATE TABLE user_card_copies (
+            user_id BIGINT NOT NULL,
+            card_id INTEGER NOT NULL,
+            copies INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, card_id)
+        );
+
+        INSERT INTO user_card_copies (user_id, card_id, copies)
+        SELECT user_id, card_id, COUNT(*)
+        FROM user_cards
+        GROUP BY user_id, card_id;
+
+        CREATE TABLE user_profile_aggregates (
+            user_id BIGINT PRIMARY KEY,
+            total_cards INTEGER NOT NULL DEFAULT 0,
+            unique_cards INTEGER NOT NULL DEFAULT 0,
+            favorite_cards INTEGER NOT NULL DEFAULT 0,
+            total_trainings INTEGER NOT NULL DEFAULT 0,
+            successful_trainings INTEGER NOT NULL DEFAULT 0,
+            training_rewards BIGINT NOT NULL DEFAULT 0,
+            -- NULL - тренировок не было
+            max_training_level INTEGER,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+
+        INSERT INTO user_profile_aggregates (
+            user_id, total_cards, unique_cards, favorite_cards,
+            total_trainings, successful_trainings, training_rewards, max_training_level
+        )
+        SELECT
+            COALESCE(c.user_id, t.user_id),
+            COALESCE(c.total_cards, 0),
+            COALESCE(c.unique_cards, 0),
+            COALESCE(c.favorite_cards, 0),
+            COALESCE(t.total_trainings, 0),
+            COALESCE(t.successful_trainings, 0),
+            COALESCE(t.training_rewards, 0),
+            t.max_training_level
+        FROM (
+            SELECT
+                user_id,
+                COUNT(*) AS total_cards,
+                COUNT(DISTINCT card_id) AS unique_cards,
+                COUNT(*) FILTER (WHERE is_favorite = true) AS favorite_cards
+            FROM user_cards
+            GROUP BY user_id
+        ) c
+        FULL JOIN (
+            SELECT
+                user_id,
+                COUNT(*) AS total_trainings,
+                COUNT(*) FILTER (WHERE success = true) AS successful_trainings,
+                COALESCE(SUM(reward_earned), 0) AS training_rewards,
+                MAX(level) AS max_training_level
+            FROM training_results
+            GROUP BY user_id
+        ) t ON t.user_id = c.user_id;
+    END IF;
+END $$;
+
+-- Применяет изменения карт (строка со знаком +1 добавлена, -1 убрана) к копиям
+-- и сводке. Строки блокируются по возрастанию ключей, чтобы параллельные
+-- выдачи с общими картами не уходили в deadlock
+CREATE OR REPLACE FUNCTION apply_user_card_changes(
+    p_user_ids BIGINT[], p_card_ids INTEGER[], p_favorites INTEGER[], p_signs INTEGER[]
+) RETURNS void AS $$
+BEGIN
+    WITH changes AS (
+        SELECT *
+        FROM unnest(p_user_ids, p_card_ids, p_favorites, p_signs) AS t(user_id, card_id, favorite, sign)
+    ),
+    per_card AS (
+        SELECT user_id, card_id, SUM(sign)::int AS delta
+        FROM changes
+        GROUP BY user_id, card_id
+        HAVING SUM(sign) <> 0
+    ),
+    copies AS (
+        INSERT INTO user_card_copies AS ucc (user_id, card_id, copies)
+        SELECT user_id, card_id, delta FROM per_card
+        ORDER BY user_id, card_id
+        ON CONFLICT (user_id, card_id) DO UPDATE
+        SET copies = ucc.copies + EXCLUDED.copies
+        RETURNING user_id, card_id, copies
+    ),
+    per_user AS (
+        SELECT user_id, SUM(sign)::int AS cards, SUM(sign * favorite)::int AS favorites
+        FROM changes
+        GROUP BY user_id
+    ),
+    uniques AS (
+        -- Карта появилась (копий было 0) или пропала (копий стало 0)
+        SELECT c.user_id, SUM((c.copies > 0)::int - (c.copies - p.delta > 0)::int)::int AS delta
+        FROM copies c
+        JOIN per_card p USING (user_id, card_id)
+        GROUP BY c.user_id
+    )
+    INSERT INTO user_profile_aggregates AS a (user_id, total_cards, unique_cards, favorite_cards)
+    SELECT pu.user_id, pu.cards, COALESCE(u.delta, 0), pu.favorites
+    FROM per_user pu
+    LEFT JOIN uniques u USING (user_id)
+    WHERE pu.cards <> 0 OR pu.favorites <> 0 OR COALESCE(u.delta, 0) <> 0
+    ORDER BY pu.user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET total_cards = a.total_cards + EXCLUDED.total_cards,
+        unique_cards = a.unique_cards + EXCLUDED.unique_cards,
+        favorite_cards = a.favorite_cards + EXCLUDED.favorite_cards,
+        updated_at = NOW();
+
+    DELETE FROM user_card_copies ucc
+    USING unnest(p_user_ids, p_card_ids) AS t(user_id, card_id)
+    WHERE ucc.user_id = t.user_id AND ucc.card_id = t.card_id AND ucc.copies = 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Один вызов на запрос: выдача пака или сделка маркета пишут сводку одной командой
+CREATE OR REPLACE FUNCTION user_cards_profile_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM apply_user_card_changes(
+            array_agg(user_id), array_agg(card_id), array_agg(COALESCE(is_favorite, false)::int), array_agg(1)
+        ) FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM apply_user_card_changes(
+            array_agg(user_id), array_agg(card_id), array_agg(COALESCE(is_favorite, false)::int), array_agg(-1)
+        ) FROM old_rows;
+    ELSE
+        -- Изменения, не касающиеся владельца, карты и избранного, взаимно сокращаются
+        PERFORM apply_user_card_changes(
+            array_agg(user_id), array_agg(card_id), array_agg(favorite), array_agg(sign)
+        ) FROM (
+            SELECT user_id, card_id, COALESCE(is_favorite, false)::int AS favorite, -1 AS sign FROM old_rows
+            UNION ALL
+            SELECT user_id, card_id, COALESCE(is_favorite, false)::int, 1 FROM new_rows
+        ) changes;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_cards_profile_insert ON user_cards;
+CREATE TRIGGER user_cards_profile_insert
+AFTER INSERT ON user_cards
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION user_cards_profile_changed();
+
+DROP TRIGGER IF EXISTS user_cards_profile_update ON user_cards;
+CREATE TRIGGER user_cards_profile_update
+AFTER UPDATE ON user_cards
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION user_cards_profile_changed();
+
+DROP TRIGGER IF EXISTS user_cards_profile_delete ON user_cards;
+CREATE TRIGGER user_cards_profile_delete
+AFTER DELETE ON user_cards
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION user_cards_profile_changed();
+
+-- Уведомления для сводки профиля в памяти: процессы сбрасывают сводку игрока,
+-- даже если запись прошла в другом процессе (воркеры runner.py)
+CREATE OR REPLACE FUNCTION notify_user_stats_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('user_stats_changed', NEW.user_id::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_stats_changed_notify ON users;
+CREATE TRIGGER user_stats_changed_notify
+AFTER UPDATE OF username, balance, score ON users
+FOR EACH ROW
+WHEN (OLD.username IS DISTINCT FROM NEW.username
+      OR OLD.balance IS DISTINCT FROM NEW.balance
+      OR OLD.score IS DISTINCT FROM NEW.score)
+EXECUTE FUNCTION notify_user_stats_changed();
+
+DROP TRIGGER IF EXISTS user_profile_aggregates_notify ON user_profile_aggregates;
+CREATE TRIGGER user_profile_aggregates_notify
+AFTER INSERT OR UPDATE ON user_profile_aggregates
+FOR EACH ROW
+EXECUTE FUNCTION notify_user_stats_changed();
+
+DROP TRIGGER IF EXISTS user_game_aggregates_notify ON user_game_aggregates;
+CREATE TRIGGER user_game_aggregates_notify
+AFTER INSERT OR UPDATE ON user_game_aggregates
+FOR EACH ROW
+EXECUTE FUNCTION notify_user_stats_changed();
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from db.pool import get_db_pool
+from db.card_pool import ensure_card_pool, collection_has_cards
+from db.pack_queries import fetch_catalogue, get_collection_name
+
+PACKS_CHANGED_CHANNEL = 'packs_changed'
+
+# Каталог меняется редко: основное обновление - по NOTIFY packs_changed,
+# TTL страхует от потерянных уведомлений и от истечения end_date коллекций
+CATALOGUE_TTL = 300
+# После неудачного обновления по TTL следующая попытка - не раньше чем через столько секунд
+CATALOGUE_RETRY_DELAY = 30
+
+# Паки по str(id) (обычные и коллекционные 'collection_<id>'),
+# состояние тиража коллекций по collection_id
+_packs_by_id: Dict[str, Dict] = {}
+_standard_pack_ids: List[str] = []
+_collection_pack_ids: List[str] = []
+_collections: Dict[int, Dict] = {}
+_loaded_at: Optional[float] = None
+_refresh_lock = asyncio.Lock()
+
+def set_catalogue(pack_rows, collection_rows) -> None:
+    """Строит каталог из строк packs и коллекционных паков и атомарно подменяет текущий"""
+    global _packs_by_id, _standard_pack_ids, _collection_pack_ids, _collections, _loaded_at
+
+    now = time.monotonic()
+    packs_by_id = {}
+    standard_ids = []
+    collection_ids = []
+    collections = {}
+
+    for row in pack_rows:
+        pack = dict(row)
+        packs_by_id[str(pack['id'])] = pack
+        if pack.get('is_always_available'):
+            standard_ids.append(str(pack['id']))
+
+    for row in collection_rows:
+        pack = dict(row)
+        # Время жизни коллекции считается в БД, здесь - срок по monotonic-часам
+        collections[pack['collection_id']] = {
+            'expires_at': now + float(pack.pop('seconds_left')),
+            'total_cards': pack.pop('total_cards'),
+            'cards_opened': pack.pop('cards_opened')
+        }
+        packs_by_id[pack['id']] = pack
+        collection_ids.append(pack['id'])
+
+    _packs_by_id, _collections = packs_by_id, collections
+    _standard_pack_ids, _collection_pack_ids = standard_ids, collection_ids
+    _loaded_at = now
+
+def _is_fresh(max_age: float) -> bool:
+    return _loaded_at is not None and time.monotonic() - _loaded_at < max_age
+
+async def load_pack_catalogue(max_age: float = None) -> int:
+    """Загружает каталог паков из БД в память.
+
+    max_age - не перечитывать, если каталог моложе (его уже обновил тот,
+    кто держал блокировку до нас); без него каталог читается всегда"""
+    global _loaded_at
+    async with _refresh_lock:
+        if max_age is not None and _is_fresh(max_age):
+            return len(_packs_by_id)
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                pack_rows, collection_rows = await fetch_catalogue(conn)
+        except Exception:
+            if _loaded_at is not None:
+                # Старый каталог служит еще CATALOGUE_RETRY_DELAY секунд: ожидающие
+                # блокировку и следующие запросы не повторяют чтение друг за другом
+                _loaded_at = time.monotonic() - CATALOGUE_TTL + CATALOGUE_RETRY_DELAY
+            raise
+        set_catalogue(pack_rows, collection_rows)
+    print(f"[{datetime.now()}] Каталог паков загружен: {len(_packs_by_id)} паков")
+    return len(_packs_by_id)
+
+async def refresh_pack_catalogue(payload: str = None, max_age: float = None):
+    """Обработчик NOTIFY packs_changed: перечитывает каталог"""
+    try:
+        await load_pack_catalogue(max_age)
+    except Exception as e:
+        print(f"[{datetime.now()}] ОШИБКА обновления каталога паков: {e}")
+
+async def ensure_pack_catalogue():
+    """Загружает каталог, если он не загружен или устарел (при ошибке отдается старый)"""
+    if _is_fresh(CATALOGUE_TTL):
+        return
+    if _loaded_at is None:
+        await load_pack_catalogue(CATALOGUE_TTL)
+    else:
+        await refresh_pack_catalogue(max_age=CATALOGUE_TTL)
+
+def note_collection_opened(collection_id: int, cards_opened: int):
+    """Обновляет счетчик тиража коллекции после успешного резерва"""
+    state = _collections.get(collection_id)
+    if state is not None:
+        state['cards_opened'] = cards_opened
+
+def _is_collection_open(collection_id: int) -> bool:
+    state = _collections.get(collection_id)
+    return (
+        state is not None
+        and state['expires_at'] > time.monotonic()
+        and state['cards_opened'] < state['total_cards']
+    )
+
+async def get_available_packs(user_id: int) -> List[Dict]:
+    """Получает все доступные паки для пользователя (из каталога в памяти)"""
+    await ensure_pack_catalogue()
+    await ensure_card_pool()
+
+    packs = [dict(_packs_by_id[pack_id]) for pack_id in _standard_pack_ids]
+    for pack_id in _collection_pack_ids:
+        pack = _packs_by_id[pack_id]
+        # Коллекция активна, тираж не исчерпан и в ней есть карты
+        if _is_collection_open(pack['collection_id']) and collection_has_cards(pack['collection_id']):
+            packs.append(dict(pack))
+    return packs
+
+async def get_pack_by_id(pack_id) -> Optional[Dict]:
+    """Получает пак по ID из каталога (обрабатывает как числовые, так и строковые ID коллекций)"""
+    await ensure_pack_catalogue()
+
+    pack = _packs_by_id.get(str(pack_id))
+    if not pack:
+        return None
+    if pack.get('collection_id') is not None and not _is_collection_open(pack['collection_id']):
+        return None
+    return dict(pack)
+
+async def get_pack_name(pack_id) -> Optional[str]:
+    """Название пака по ID. В каталоге только действующие коллекции,
+    название закончившейся коллекции берется из БД"""
+    await ensure_pack_catalogue()
+    pack = _packs_by_id.get(str(pack_id))
+    if pack:
+        return pack['name']
+    if str(pack_id).startswith('collection_'):
+        return await get_collection_name(int(str(pack_id).replace('collection_', '')))
+    return None
+
+async def resolve_collection_name(collection_id: int) -> Optional[str]:
+    """Название коллекции: из каталога, для неактивных коллекций - из БД"""
+    if collection_id is None:
+        return None
+    await ensure_pack_catalogue()
+    pack = _packs_by_id.get(f"collection_{collection_id}")
+    if pack:
+        return pack['name']
+    return await get_collection_name(collection_id)
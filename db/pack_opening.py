@@ -0,0 +1,279 @@
+from db.pool import get_db_pool
+from db.statements import statement
+from db.profile_stats import invalidate_user_stats
+from db.leaderboard import apply_score
+from db.card_queries import GRANT_CARDS_CTE, build_grant_result
+from db.card_pool import ensure_card_pool
+from db.pack_queries import fetch_pack, draw_pack_cards
+from db.pack_catalogue import get_pack_by_id, note_collection_opened
+from db.rarity_roll import make_rng, new_seed, spawn_seeds
+from db.user_queries import FREE_PACK_COOLDOWN, MOSCOW_TZ, can_open_free_pack
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+import random
+
+RARITY_ORDER = {'common': 1, 'rare': 2, 'epic': 3, 'legendary': 4}
+
+# Строго определенные диапазоны очков по редкостям
+SCORE_RANGES = {
+    'common': (5, 10),
+    'rare': (10, 15),
+    'epic': (15, 20),
+    'legendary': (20, 25)
+}
+
+# Списание стоимости и начисление очков одним условным UPDATE:
+# если денег не хватает, строка не обновляется и транзакция откатывается
+DEBIT_PAID_PACK_QUERY = statement('debit_paid_pack', """
+UPDATE users
+SET balance = balance - $2, score = score + $3
+WHERE user_id = $1 AND balance >= $2
+RETURNING balance, score
+""")
+
+DEBIT_FREE_PACK_QUERY = statement('debit_free_pack', """
+UPDATE users
+SET last_free_pack = $2, score = score + $3
+WHERE user_id = $1 AND (last_free_pack IS NULL OR last_free_pack <= $4)
+RETURNING balance, score
+""")
+
+# Резерв тиража коллекции: выполняется, только если после открытия
+# не будет превышен total_cards, иначе строка не возвращается
+RESERVE_COLLECTION_QUERY = statement('reserve_collection', """
+UPDATE collections
+SET cards_opened = cards_opened + $2
+WHERE id = $1
+AND is_active = true
+AND end_date > NOW()
+AND cards_opened + $2 <= total_cards
+RETURNING cards_opened, total_cards
+""")
+
+# Выдача карт, лог открытий и статистика коллекций - один запрос.
+# $5 - номер пака для каждой карты, чтобы связать карты со своим открытием,
+# $6 - сиды паков (по одному на открытие)
+OPEN_PACK_QUERY = statement('open_packs', "WITH " + GRANT_CARDS_CTE + """,
+openings AS (
+    INSERT INTO pack_openings (user_id, pack_id, opened_at, rng_seed)
+    SELECT $1, $3, NOW(), s.seed
+    FROM unnest($6::bigint[]) WITH ORDINALITY AS s(seed, opening_no)
+    ORDER BY s.opening_no
+    RETURNING id
+),
+numbered_openings AS (
+    SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS opening_no
+    FROM openings
+),
+opening_cards AS (
+    INSERT INTO pack_opening_cards (pack_opening_id, card_id)
+    SELECT DISTINCT o.id, t.card_id
+    FROM unnest($2::int[], $5::int[]) AS t(card_id, opening_no)
+    JOIN numbered_openings o USING (opening_no)
+),
+collection_stats AS (
+    UPDATE collections col
+    SET cards_opened = LEAST(col.cards_opened + s.amount, col.total_cards)
+    FROM (
+        SELECT collection_id, COUNT(*) AS amount
+        FROM unnest($4::int[]) AS t(collection_id)
+        WHERE collection_id IS NOT NULL
+        GROUP BY collection_id
+    ) s
+    WHERE col.id = s.collection_id
+)
+SELECT
+    i.id AS user_card_id,
+    i.card_id,
+    i.serial_number,
+    c.last_serial AS total_copies,
+    (SELECT array_agg(id ORDER BY id) FROM openings) AS opening_ids,
+    col.name AS collection_name
+FROM inserted i
+JOIN counters c USING (card_id)
+JOIN cards cd ON cd.id = i.card_id
+LEFT JOIN collections col ON col.id = cd.collection_id
+""")
+
+def calculate_score_for_card(card: Dict, rng: random.Random = None) -> int:
+    """Рассчитывает количество очков за карту в зависимости от редкости"""
+    rarity = card.get('rarity', 'common')
+
+    if rarity not in SCORE_RANGES:
+        print(f"[{datetime.now()}] ВНИМАНИЕ: неизвестная редкость '{rarity}', используем common")
+        rarity = 'common'
+
+    min_score, max_score = SCORE_RANGES[rarity]
+    return (rng or random).randint(min_score, max_score)
+
+def roll_opening(pack: Dict, seed: int) -> List[Tuple[Dict, int]]:
+    """Разыгрывает одно открытие пака из сида: карты (по возрастанию редкости) и очки за них.
+
+    Вся случайность берется из потока make_rng(seed), поэтому при неизменном
+    составе таблицы cards открытие воспроизводится один в один."""
+    rng = make_rng(seed)
+    cards = sorted(draw_pack_cards(pack, rng), key=lambda card: RARITY_ORDER.get(card['rarity'], 0))
+    return [(card, calculate_score_for_card(card, rng)) for card in cards]
+
+class PackOpeningError(Exception):
+    """Открытие невозможно: транзакция откатывается, пользователю показывается message"""
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+class FreePackCooldown(PackOpeningError):
+    """Бесплатный пак еще на перезарядке"""
+
+async def open_pack(user_id: int, pack_id) -> Dict:
+    """Открывает один пак (см. open_packs)"""
+    return await open_packs(user_id, pack_id, 1)
+
+async def _open_packs_in_transaction(conn, user_id: int, pack: Dict, count: int, seed: int):
+    """Все шаги открытия на соединении транзакции; при ошибке бросает PackOpeningError"""
+    if pack['cost'] == 0 and count > 1:
+        raise PackOpeningError("❌ Бесплатный пак открывается только по одному")
+
+    # Карты всех паков выбираются в памяти за один проход,
+    # поэтому до списания не нужно обращаться к БД.
+    # У каждого пака свой поток случайных чисел с сидом, который пишется в лог
+    await ensure_card_pool()
+    pack_seeds = spawn_seeds(new_seed() if seed is None else seed, count)
+    rolled = [roll_opening(pack, pack_seed) for pack_seed in pack_seeds]
+
+    if not all(rolled):
+        raise PackOpeningError("❌ Ошибка генерации карт")
+
+    cards = []
+    scores = []
+    for pack_no, pack_cards in enumerate(rolled, start=1):
+        for card, score in pack_cards:
+            cards.append((pack_no, card))
+            scores.append(score)
+    total_score = sum(scores)
+
+    if pack['cost'] > 0:
+        user = await conn.fetchrow(DEBIT_PAID_PACK_QUERY, user_id, pack['cost'] * count, total_score)
+        if not user:
+            raise PackOpeningError("❌ Недостаточно монет")
+    else:
+        now_moscow = datetime.now(MOSCOW_TZ)
+        user = await conn.fetchrow(
+            DEBIT_FREE_PACK_QUERY, user_id, now_moscow, total_score,
+            now_moscow - timedelta(hours=FREE_PACK_COOLDOWN)
+        )
+        if not user:
+            raise FreePackCooldown("⏳ Бесплатный пак еще недоступен")
+
+    if pack.get('collection_id') is not None:
+        # Тираж коллекции резервируется одним условным UPDATE (блокируется одна строка
+        # коллекции, а не каждая карта). Все карты пака из этой коллекции, поэтому
+        # в общую статистику коллекций их больше не передаем
+        reserved = await conn.fetchrow(RESERVE_COLLECTION_QUERY, pack['collection_id'], len(cards))
+        if not reserved:
+            left = await conn.fetchval(
+                "SELECT GREATEST(total_cards - cards_opened, 0) FROM collections WHERE id = $1",
+                pack['collection_id']
+            )
+            raise PackOpeningError(f"❌ В коллекции осталось карт: {left or 0}, нужно {len(cards)}")
+        collection_ids = [None] * len(cards)
+    else:
+        reserved = None
+        collection_ids = [card.get('collection_id') for _, card in cards]
+
+    card_ids = [card['id'] for _, card in cards]
+    pack_numbers = [pack_no for pack_no, _ in cards]
+    rows = await conn.fetch(
+        OPEN_PACK_QUERY, user_id, card_ids, str(pack['id']),
+        collection_ids, pack_numbers, pack_seeds
+    )
+    return cards, scores, user, rows, reserved
+
+async def open_packs(user_id: int, pack_id, count: int = 1, seed: int = None) -> Dict:
+    """Открывает count одинаковых паков в одной транзакции: списание, выдача карт, очки, лог и статистика коллекций"""
+    # Пак проверяется по каталогу в памяти; актуальность тиража коллекции
+    # гарантирует резерв внутри транзакции
+    pack = await get_pack_by_id(pack_id)
+    if not pack:
+        return {'success': False, 'message': "❌ Пак не найден"}
+
+    pool = await get_db_pool()
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                cards, scores, user, rows, reserved = await _open_packs_in_transaction(
+                    conn, user_id, pack, count, seed
+                )
+    except FreePackCooldown:
+        # Время до бесплатного пака считаем уже вне транзакции
+        _, time_left = await can_open_free_pack(user_id)
+        hours = int(time_left // 3600)
+        mins = int((time_left % 3600) // 60)
+        return {'success': False, 'message': f"⏳ Доступно через {hours}ч {mins}м"}
+    except PackOpeningError as e:
+        return {'success': False, 'message': e.message}
+
+    if reserved:
+        note_collection_opened(pack['collection_id'], reserved['cards_opened'])
+    invalidate_user_stats(user_id)
+    apply_score(user_id, user['score'])
+
+    card_ids = [card['id'] for _, card in cards]
+    total_score = sum(scores)
+    grant = build_grant_result(rows, card_ids)
+    collection_names = {row['card_id']: row['collection_name'] for row in rows}
+
+    opened_cards = []
+    for (pack_no, card), granted, score in zip(cards, grant['granted'], scores):
+        opened_cards.append({
+            'card': card,
+            'pack_no': pack_no,
+            'serial_number': granted['serial_number'],
+            'collection_name': collection_names.get(card['id']),
+            'score': score
+        })
+
+    return {
+        'success': True,
+        'pack': pack,
+        'packs_count': count,
+        'opening_ids': rows[0]['opening_ids'],
+        'cards': opened_cards,
+        'total_score': total_score,
+        'total_cost': pack['cost'] * count,
+        'balance': user['balance'],
+        'score': user['score']
+    }
+
+async def replay_opening(opening_id: int) -> Dict:
+    """Воспроизводит записанное открытие по его сиду (для аудита шансов выпадения)"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        opening = await conn.fetchrow(
+            "SELECT id, user_id, pack_id, rng_seed FROM pack_openings WHERE id = $1",
+            opening_id
+        )
+        if not opening or opening['rng_seed'] is None:
+            return None
+
+        # Коллекция могла закончиться после открытия - берем пак без проверки доступности
+        pack = await fetch_pack(conn, opening['pack_id'], available_only=False)
+        logged_card_ids = await conn.fetch(
+            "SELECT card_id FROM pack_opening_cards WHERE pack_opening_id = $1",
+            opening_id
+        )
+
+    if not pack:
+        return None
+
+    await ensure_card_pool()
+    rolled = roll_opening(pack, opening['rng_seed'])
+    replayed_ids = {card['id'] for card, _ in rolled}
+
+    return {
+        'opening_id': opening_id,
+        'user_id': opening['user_id'],
+        'pack': pack,
+        'cards': [{'card': card, 'score': score} for card, score in rolled],
+        'matches_log': replayed_ids == {row['card_id'] for row in logged_card_ids}
+    }
@@ -1,140 +1,108 @@
 from db.pool import get_db_pool
+from db.statements import statement
+from db.profile_stats import invalidate_user_stats
+from db.leaderboard import apply_score
+from db.card_pool import ensure_card_pool, draw_card, draw_card_nearest
+from db.rarity_roll import get_roller, make_rng, new_seed, spawn_seeds
 from typing import List, Dict, Any, Tuple
 import random
 import math
 
-async def generate_pack_cards(pack: Dict) -> List[Dict]:
-    """Генерирует карты для пака на основе его настроек БЕЗ ДУБЛИКАТОВ"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        cards_count = pack['cards_amount']
+# Параметры коллекционных паков (одинаковые для всех коллекций)
+COLLECTION_PACK_SETTINGS = {
+    'cost': 500,
+    'cards_amount': 3,
+    'common_chance': 30,
+    'rare_chance': 40,
+    'epic_chance': 20,
+    'legendary_chance': 10
+}
 
-        print(pack)
-        common_chance = pack['common_chance']
-        rare_chance = pack['rare_chance']
-        epic_chance = pack['epic_chance']
-        legendary_chance = pack['legendary_chance']
+COLLECTION_PACK_COLUMNS = """
+    'collection_' || c.id as id,
+    c.name as name,
+    c.description as description,
+    {cost} as cost,
+    {cards_amount} as cards_amount,
+    null as cooldown_hours,
+    'collection' as pack_type,
+    false as is_always_available,
+    {common_chance} as common_chance,
+    {rare_chance} as rare_chance,
+    {epic_chance} as epic_chance,
+    {legendary_chance} as legendary_chance,
+    c.id as collection_id
+""".format(**COLLECTION_PACK_SETTINGS)
 
-        print(common_chance, rare_chance, epic_chance, legendary_chance)
+def draw_pack_cards(pack: Dict, rng: random.Random = None) -> List[Dict]:
+    """Выбирает карты одного пака из пула в памяти (редкости - одной таблицей псевдонимов).
 
-        # Собираем все карты в список
-        selected_cards = []
-        
-        for i in range(cards_count):
-            number = random.randint(0, 99)
-            print(number)
-            
-            if number < common_chance:
-                card = await getCard(conn, 'common')  # Передаем connection и получаем карту
-                print("generate common")
-            elif number < common_chance + rare_chance:
-                card = await getCard(conn, 'rare')
-                print("generate rare")
-            elif number < common_chance + rare_chance + epic_chance:
-                card = await getCard(conn, 'epic')
-                print("generate epic")
-            else:
-                card = await getCard(conn, 'legendary')
-                print("generate legendary")
-            
-            # Добавляем карту в список, если она найдена
-            if card:
-                selected_cards.append(dict(card))
+    Коллекционный пак тянет карты только из своей коллекции; если в ней нет
+    карт выпавшей редкости, берется ближайшая доступная редкость коллекции."""
+    cards_count = pack['cards_amount']
+    rarities = get_roller(pack).roll_many(cards_count, rng)
+    collection_id = pack.get('collection_id')
 
-        # Если карт меньше чем нужно, возвращаем что есть
-        if len(selected_cards) < cards_count:
-            print(f"Warning: Only {len(selected_cards)} cards available, but need {cards_count}")
-        
-        return selected_cards
+    selected_cards = []
+    for rarity in rarities:
+        if collection_id is not None:
+            card = draw_card_nearest(rarity, collection_id, rng=rng)
+        else:
+            card = draw_card(rarity, rng=rng)
+        # Добавляем карту в список, если она найдена
+        if card:
+            selected_cards.append(card)
 
-async def getCard(conn, rarity):
-    """Получает одну случайную карту указанной редкости"""
-    query = """
-    SELECT c.* FROM cards c
-    WHERE (c.rarity = $1)
-    ORDER BY RANDOM()
-    LIMIT 1
-    """
-    return await conn.fetchrow(query, rarity)
+    # Если карт меньше чем нужно, возвращаем что есть
+    if len(selected_cards) < cards_count:
+        print(f"Warning: Only {len(selected_cards)} cards available, but need {cards_count}")
 
-def select_rarity(probabilities: Dict[str, float]) -> str:
-    """Выбирает редкость на основе вероятностей"""
-    roll = random.random() * 100
-    cumulative = 0
-    
-    for rarity, prob in probabilities.items():
-        cumulative += prob
-        if roll <= cumulative:
-            return rarity
-    
-    return 'common'  # Fallback
+    return selected_cards
 
-# Остальные функции остаются без изменений
-async def get_available_packs(user_id: int) -> List[Dict]:
-    """Получает все доступные паки для пользователя"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        # Базовые паки (всегда доступные)
-        base_packs = await conn.fetch("""
-            SELECT * FROM packs 
-            WHERE is_always_available = true
-            ORDER BY cost, id
-        """)
-        
-        # Коллекционные паки (активные коллекции с доступными картами)
-        collection_packs = await conn.fetch("""
-            SELECT 
-                'collection_' || c.id as id,
-                c.name as name,
-                c.description as description,
-                500 as cost,  -- Фиксированная цена 500 монет
-                3 as cards_amount,  -- Фиксированно 3 карты
-                null as cooldown_hours,
-                'collection' as pack_type,
-                false as is_always_available,
-                30 as common_chance,
-                40 as rare_chance,
-                20 as epic_chance,
-                10 as legendary_chance,
-                c.id as collection_id
-            FROM collections c
-            WHERE c.is_active = true 
-            AND c.end_date > NOW()
-            AND c.cards_opened < c.total_cards  -- Есть доступные карты
-            AND EXISTS (
-                SELECT 1 FROM cards 
-                WHERE collection_id = c.id 
-                LIMIT 1
-            )
-            ORDER BY c.id
-        """)
-        
-        all_packs = [dict(pack) for pack in base_packs] + [dict(pack) for pack in collection_packs]
-        return all_packs
+async def generate_pack_cards(pack: Dict, packs_count: int = None, seed: int = None) -> List:
+    """Генерирует карты для пака на основе его настроек (карты берутся из пула в памяти).
 
+    Если передан packs_count, за один проход генерируются карты для packs_count
+    паков и возвращается список списков карт (по одному на пак). С одинаковым
+    seed результат воспроизводится."""
+    await ensure_card_pool()
 
-async def get_pack_by_id(pack_id) -> Dict:
-    """Получает пак по ID (обрабатывает как числовые, так и строковые ID коллекций)"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        if isinstance(pack_id, str) and pack_id.startswith('collection_'):
-            # Это коллекционный пак
-            collection_id = pack_id.replace('collection_', '')
-            pack = await conn.fetchrow("""
-                SELECT 
-                    'collection_' || c.id as id,
-                    c.name as name,
-                    c.description as description,
-                    500 as cost,
-                    3 as cards_amount,
-                    null as cooldown_hours,
-                    'collection' as pack_type,
-                    false as is_always_available,
-                    30 as common_chance,
-                    40 as rare_chance,
-                    20 as epic_chance,
-                    10 as legendary_chance,
-                    c.id as collection_id
+    seeds = spawn_seeds(new_seed() if seed is None else seed, packs_count or 1)
+    packs = [draw_pack_cards(pack, make_rng(pack_seed)) for pack_seed in seeds]
+
+    if packs_count is None:
+        return packs[0]
+    # Пак без единой карты не открываем
+    return packs if all(packs) else []
+
+async def fetch_catalogue(conn) -> Tuple[List, List]:
+    """Читает каталог паков: все обычные паки и коллекционные паки активных коллекций
+    (с остатком времени и тиража, чтобы проверять доступность в памяти)"""
+    pack_rows = await conn.fetch("SELECT * FROM packs ORDER BY cost, id")
+    collection_rows = await conn.fetch(f"""
+        SELECT {COLLECTION_PACK_COLUMNS},
+            EXTRACT(EPOCH FROM c.end_date - NOW()) as seconds_left,
+            c.total_cards,
+            c.cards_opened
+        FROM collections c
+        WHERE c.is_active = true
+        AND c.end_date > NOW()
+        ORDER BY c.id
+    """)
+    return pack_rows, collection_rows
+
+async def fetch_pack(conn, pack_id, available_only: bool = True) -> Dict:
+    """Получает пак по ID на переданном соединении.
+
+    available_only=False - определение пака независимо от того, можно ли его
+    сейчас открыть (коллекция закончилась или распродана): для воспроизведения
+    прошлых открытий"""
+    if isinstance(pack_id, str) and pack_id.startswith('collection_'):
+        # Это коллекционный пак
+        collection_id = pack_id.replace('collection_', '')
+        if available_only:
+            pack = await conn.fetchrow(f"""
+                SELECT {COLLECTION_PACK_COLUMNS}
                 FROM collections c
                 WHERE c.id = $1 
                 AND c.is_active = true 
@@ -142,15 +110,21 @@ async def get_pack_by_id(pack_id) -> Dict:
                 AND c.cards_opened < c.total_cards
             """, int(collection_id))
         else:
-            # Это обычный пак
-            try:
-                pack_id_int = int(pack_id)
-                pack = await conn.fetchrow("SELECT * FROM packs WHERE id = $1", pack_id_int)
-            except (ValueError, TypeError):
-                # Если pack_id нельзя преобразовать в int, пробуем как строку
-                pack = await conn.fetchrow("SELECT * FROM packs WHERE id = $1", str(pack_id))
-        
-        return dict(pack) if pack else None
+            pack = await conn.fetchrow(f"""
+                SELECT {COLLECTION_PACK_COLUMNS}
+                FROM collections c
+                WHERE c.id = $1
+            """, int(collection_id))
+    else:
+        # Это обычный пак
+        try:
+            pack_id_int = int(pack_id)
+            pack = await conn.fetchrow("SELECT * FROM packs WHERE id = $1", pack_id_int)
+        except (ValueError, TypeError):
+            # Если pack_id нельзя преобразовать в int, пробуем как строку
+            pack = await conn.fetchrow("SELECT * FROM packs WHERE id = $1", str(pack_id))
+    
+    return dict(pack) if pack else None
 
 async def update_collection_stats(collection_id: int, cards_opened: int):
     """Обновляет статистику коллекции после открытия карт"""
@@ -172,40 +146,26 @@ async def get_collection_name(collection_id: int) -> str:
         return await conn.fetchval(query, collection_id)
 
 async def update_collection_stats_by_cards(card_ids: List[int]) -> int:
-    """Обновляет статистику коллекций на основе выпавших карт"""
+    """Обновляет статистику коллекций на основе выпавших карт (одним запросом, дубликаты считаются)"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # Получаем collection_id всех выпавших карт
         query = """
-        SELECT DISTINCT collection_id 
-        FROM cards 
-        WHERE id = ANY($1) AND collection_id IS NOT NULL
+        WITH updated AS (
+            UPDATE collections col
+            SET cards_opened = LEAST(col.cards_opened + s.amount, col.total_cards)
+            FROM (
+                SELECT c.collection_id, COUNT(*) AS amount
+                FROM unnest($1::int[]) AS t(card_id)
+                JOIN cards c ON c.id = t.card_id
+                WHERE c.collection_id IS NOT NULL
+                GROUP BY c.collection_id
+            ) s
+            WHERE col.id = s.collection_id
+            RETURNING col.id
+        )
+        SELECT COUNT(*) FROM updated
         """
-        collections = await conn.fetch(query, card_ids)
-        
-        updated_count = 0
-        for collection in collections:
-            collection_id = collection['collection_id']
-            # Считаем сколько карт этой коллекции выпало
-            count_query = """
-            SELECT COUNT(*) 
-            FROM cards 
-            WHERE id = ANY($1) AND collection_id = $2
-            """
-            cards_count = await conn.fetchval(count_query, card_ids, collection_id)
-            
-            # Обновляем статистику коллекции (не превышая лимит)
-            update_query = """
-            UPDATE collections 
-            SET cards_opened = LEAST(cards_opened + $2, total_cards)
-            WHERE id = $1 
-            RETURNING id
-            """
-            result = await conn.fetchval(update_query, collection_id, cards_count)
-            if result:
-                updated_count += 1
-        
-        return updated_count
+        return await conn.fetchval(query, card_ids)
 
 async def log_pack_opening(user_id: int, pack_id: int, card_ids: List[int]):
     """Логирует открытие пака с обработкой дубликатов карт"""
@@ -240,23 +200,28 @@ async def log_pack_opening(user_id: int, pack_id: int, card_ids: List[int]):
                 print(f"Duplicate card {card_id} in pack opening {pack_opening_id}, skipping")
                 continue
 
+ADD_USER_SCORE_QUERY = statement('add_user_score', """
+UPDATE users 
+SET score = score + $1 
+WHERE user_id = $2 
+RETURNING user_id, score
+""")
+
 async def update_user_score(user_id: int, score_to_add: int) -> Dict:
     """Обновляет счет пользователя (добавляет очки)"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = """
-        UPDATE users 
-        SET score = score + $1 
-        WHERE user_id = $2 
-        RETURNING user_id, score
-        """
-        result = await conn.fetchrow(query, score_to_add, user_id)
-        return dict(result) if result else None
+        result = await conn.fetchrow(ADD_USER_SCORE_QUERY, score_to_add, user_id)
+    invalidate_user_stats(user_id)
+    if result:
+        apply_score(user_id, result['score'])
+    return dict(result) if result else None
     
+USER_SCORE_QUERY = statement('get_user_score', "SELECT score FROM users WHERE user_id = $1")
+
 async def get_user_score(user_id: int) -> int:
     """Получает текущий счет пользователя"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = "SELECT score FROM users WHERE user_id = $1"
-        result = await conn.fetchval(query, user_id)
+        result = await conn.fetchval(USER_SCORE_QUERY, user_id)
         return result or 0
\ No newline at end of file
@@ -1,16 +1,149 @@
+import asyncio
 import asyncpg
+import os
+import sys
+import time
+
+from db.settings import db_settings
+from db import metrics
+from db.statements import Statement
 
 pool = None
 
-async def create_db_pool():
+DB_SETTINGS = {
+    'user': db_settings.DB_USER,
+    'password': db_settings.DB_PASSWORD.get_secret_value(),
+    'database': db_settings.DB_NAME,
+    'host': db_settings.DB_HOST,
+    'port': db_settings.DB_PORT
+}
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+# Кэш подготовленных запросов на соединение: с запасом на все запросы реестра
+# (вместе с комбинациями фильтров маркета) и разовые запросы
+STATEMENT_CACHE_SIZE = 256
+
+def _rows_count(method: str, result) -> int:
+    """Число строк в результате запроса (для execute - из статуса вида 'UPDATE 3')"""
+    if method == 'fetch':
+        return len(result)
+    if method == 'execute':
+        last = result.rsplit(' ', 1)[-1] if result else ''
+        return int(last) if last.isdigit() else 0
+    return 0 if result is None else 1
+
+class InstrumentedConnection:
+    """Обертка над соединением: замеряет каждый запрос и относит его к вызвавшей функции"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    async def _timed(self, name: str, method: str, query, *args, **kwargs):
+        # Запрос из реестра учитывается под своим именем, остальные - под именем функции
+        if isinstance(query, Statement):
+            name = query.name
+        started = time.perf_counter()
+        try:
+            result = await getattr(self._conn, method)(query, *args, **kwargs)
+        except Exception:
+            metrics.record_query(name, time.perf_counter() - started, 0, failed=True)
+            raise
+        metrics.record_query(name, time.perf_counter() - started, _rows_count(method, result))
+        return result
+
+    # Имя вызывающей функции берется из стека в момент вызова, до await
+    def fetch(self, *args, **kwargs):
+        return self._timed(sys._getframe(1).f_code.co_name, 'fetch', *args, **kwargs)
+
+    def fetchrow(self, *args, **kwargs):
+        return self._timed(sys._getframe(1).f_code.co_name, 'fetchrow', *args, **kwargs)
+
+    def fetchval(self, *args, **kwargs):
+        return self._timed(sys._getframe(1).f_code.co_name, 'fetchval', *args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        return self._timed(sys._getframe(1).f_code.co_name, 'execute', *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._timed(sys._getframe(1).f_code.co_name, 'executemany', *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+class _AcquireContext:
+    def __init__(self, instrumented_pool, timeout):
+        self._pool = instrumented_pool
+        self._timeout = timeout
+        self._conn = None
+        self._acquired_at = None
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        try:
+            self._conn = await self._pool.raw.acquire(timeout=self._timeout)
+        except asyncio.TimeoutError:
+            metrics.record_pool_timeout()
+            raise
+        self._acquired_at = time.perf_counter()
+        metrics.pool_wait.observe(self._acquired_at - started)
+        return InstrumentedConnection(self._conn)
+
+    async def __aexit__(self, *exc):
+        try:
+            await self._pool.raw.release(self._conn)
+        finally:
+            metrics.pool_checkout.observe(time.perf_counter() - self._acquired_at)
+
+class InstrumentedPool:
+    """Пул asyncpg с метриками ожидания, удержания соединений и запросов"""
+
+    def __init__(self, raw_pool, acquire_timeout: float):
+        self.raw = raw_pool
+        self.acquire_timeout = acquire_timeout
+
+    def acquire(self, timeout: float = None):
+        return _AcquireContext(self, timeout if timeout is not None else self.acquire_timeout)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+async def run_migrations(conn):
+    """Применяет SQL-миграции из db/migrations (все файлы идемпотентны)"""
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not filename.endswith('.sql'):
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename), encoding='utf-8') as f:
+            await conn.execute(f.read())
+
+async def apply_migrations():
+    """Применяет миграции на отдельном соединении"""
+    conn = await asyncpg.connect(**DB_SETTINGS)
+    try:
+        await run_migrations(conn)
+    finally:
+        await conn.close()
+
+async def create_db_pool(min_size: int = None, max_size: int = None, migrate: bool = True):
+    """Создает пул; размеры по умолчанию из конфига.
+
+    migrate=False - миграции уже применил другой процесс (воркеры многопроцессного запуска)"""
     global pool
-    pool = await asyncpg.create_pool(
-        user='postgres',
-        password='root',
-        database='footycards2',
-        host='localhost',
-        port=5432
+    if migrate:
+        await apply_migrations()
+
+    server_settings = {}
+    if db_settings.DB_STATEMENT_TIMEOUT:
+        # Таймаут на стороне сервера: зависший запрос отменяется и не держит соединение
+        server_settings['statement_timeout'] = str(int(db_settings.DB_STATEMENT_TIMEOUT * 1000))
+
+    raw_pool = await asyncpg.create_pool(
+        **DB_SETTINGS,
+        min_size=min_size if min_size is not None else db_settings.DB_POOL_MIN_SIZE,
+        max_size=max_size if max_size is not None else db_settings.DB_POOL_MAX_SIZE,
+        server_settings=server_settings,
+        statement_cache_size=STATEMENT_CACHE_SIZE
     )
+    pool = InstrumentedPool(raw_pool, db_settings.DB_ACQUIRE_TIMEOUT)
     return pool
 
 
@@ -19,4 +152,4 @@ async def get_db_pool():
 
 async def close_db_pool():
     if pool:
-        await pool.close()
\ No newline at end of file
+        await pool.close()
@@ -0,0 +1,103 @@
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from db.pool import get_db_pool
+from db.statements import statement
+
+STATS_CHANGED_CHANNEL = 'user_stats_changed'
+
+# Сводка профиля живет в памяти до первой записи, которая ее меняет
+# (карты, игры, тренировки, баланс, очки). Записи в своем процессе сбрасывают
+# ее сразу, в других процессах - по NOTIFY user_stats_changed; TTL ограничивает
+# устаревание, если уведомление потерялось
+PROFILE_CACHE_TTL = 120
+PROFILE_CACHE_MAX_SIZE = 10000
+
+# user_id -> (момент устаревания по monotonic, сводка)
+_cache: Dict[int, Tuple[float, Dict]] = {}
+# Счетчик сбросов: сводку, прочитанную во время сброса, в кэш не кладем
+_invalidations = 0
+
+# Вся сводка - один запрос: строка users, готовые счетчики карт и тренировок
+# из user_profile_aggregates и итоги игр из user_game_aggregates
+PROFILE_STATS_QUERY = statement('get_profile_stats', """
+SELECT
+    u.username,
+    u.balance,
+    u.score,
+    u.created_at,
+    COALESCE(p.total_cards, 0) as total_cards,
+    COALESCE(p.unique_cards, 0) as unique_cards,
+    COALESCE(p.favorite_cards, 0) as favorite_cards,
+    COALESCE(p.total_trainings, 0) as total_trainings,
+    COALESCE(p.successful_trainings, 0) as successful_trainings,
+    COALESCE(p.training_rewards, 0) as training_rewards,
+    COALESCE(p.max_training_level, 1) as max_training_level,
+    g.total_games,
+    g.wins,
+    g.losses,
+    g.draws,
+    g.total_winnings,
+    g.total_bets
+FROM users u
+LEFT JOIN user_profile_aggregates p ON p.user_id = u.user_id
+CROSS JOIN LATERAL (
+    SELECT
+        COALESCE(SUM(games), 0) as total_games,
+        COALESCE(SUM(wins), 0) as wins,
+        COALESCE(SUM(losses), 0) as losses,
+        COALESCE(SUM(draws), 0) as draws,
+        COALESCE(SUM(total_win), 0) as total_winnings,
+        COALESCE(SUM(total_bet), 0) as total_bets
+    FROM user_game_aggregates
+    WHERE user_id = u.user_id
+) g
+WHERE u.user_id = $1
+""")
+
+async def get_user_stats(user_id: int) -> Optional[Dict]:
+    """Получает полную статистику пользователя (из кэша или одним запросом)"""
+    cached = _cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return dict(cached[1])
+
+    invalidations = _invalidations
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(PROFILE_STATS_QUERY, user_id)
+
+    if not row:
+        return None
+
+    stats = dict(row)
+    if invalidations != _invalidations:
+        return dict(stats)
+
+    _cache.pop(user_id, None)
+    if len(_cache) >= PROFILE_CACHE_MAX_SIZE:
+        # Вытесняем самую старую запись
+        _cache.pop(next(iter(_cache)))
+    _cache[user_id] = (time.monotonic() + PROFILE_CACHE_TTL, stats)
+    return dict(stats)
+
+def invalidate_user_stats(*user_ids: int):
+    """Сбрасывает сводку пользователей после записи, которая ее меняет"""
+    global _invalidations
+    _invalidations += 1
+    for user_id in user_ids:
+        _cache.pop(user_id, None)
+
+def refresh_user_stats(payload: str = None):
+    """Обработчик NOTIFY user_stats_changed: сбрасывает сводку игрока.
+
+    Без payload (переподключение LISTEN) сбрасывает все сводки."""
+    global _invalidations
+    try:
+        if payload is None:
+            _invalidations += 1
+            _cache.clear()
+            return
+        invalidate_user_stats(int(payload))
+    except Exception as e:
+        print(f"[{datetime.now()}] ОШИБКА сброса сводки профиля: {e}")
@@ -0,0 +1,100 @@
+import random
+import secrets
+from typing import Dict, List, Sequence, Tuple
+
+RARITIES = ('common', 'rare', 'epic', 'legendary')
+
+# Сиды хранятся в pack_openings.rng_seed (BIGINT), поэтому 63 бита
+SEED_BITS = 63
+
+class RarityRoller:
+    """Таблица псевдонимов (метод Уолкера) для розыгрыша редкостей за O(1) на карту"""
+
+    def __init__(self, weights: Sequence[Tuple[str, float]]):
+        items = [(rarity, weight) for rarity, weight in weights if weight > 0]
+        if not items:
+            items = [('common', 1)]
+
+        total = sum(weight for _, weight in items)
+        n = len(items)
+        scaled = [weight * n / total for _, weight in items]
+
+        self.outcomes = [rarity for rarity, _ in items]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1
+            (small if scaled[l] < 1 else large).append(l)
+
+    def roll(self, rng: random.Random = None) -> str:
+        """Разыгрывает одну редкость (один вызов rng.random())"""
+        u = (rng or random).random() * len(self.outcomes)
+        i = int(u)
+        return self.outcomes[i] if u - i < self.prob[i] else self.outcomes[self.alias[i]]
+
+    def roll_many(self, count: int, rng: random.Random = None) -> List[str]:
+        """Разыгрывает count редкостей за один проход"""
+        rand = (rng or random).random
+        outcomes, prob, alias = self.outcomes, self.prob, self.alias
+        n = len(outcomes)
+        result = []
+        append = result.append
+        for _ in range(count):
+            u = rand() * n
+            i = int(u)
+            append(outcomes[i] if u - i < prob[i] else outcomes[alias[i]])
+        return result
+
+    def probabilities(self) -> Dict[str, float]:
+        """Итоговые вероятности редкостей (для проверки таблицы)"""
+        n = len(self.outcomes)
+        result = {rarity: 0.0 for rarity in self.outcomes}
+        for i, rarity in enumerate(self.outcomes):
+            result[rarity] += self.prob[i] / n
+            result[self.outcomes[self.alias[i]]] += (1 - self.prob[i]) / n
+        return result
+
+def pack_chances(pack: Dict) -> Tuple[Tuple[str, float], ...]:
+    """Таблица шансов пака в процентах.
+
+    Семантика как у прежнего броска random.randint(0, 99): пороги идут по
+    порядку common -> rare -> epic, всё, что выше, - legendary."""
+    common = min(pack['common_chance'], 100)
+    rare = min(common + pack['rare_chance'], 100)
+    epic = min(rare + pack['epic_chance'], 100)
+    return (
+        ('common', common),
+        ('rare', rare - common),
+        ('epic', epic - rare),
+        ('legendary', 100 - epic)
+    )
+
+_rollers: Dict[Tuple, RarityRoller] = {}
+
+def get_roller(pack: Dict) -> RarityRoller:
+    """Возвращает таблицу псевдонимов для шансов пака (кэшируется по таблице шансов)"""
+    chances = pack_chances(pack)
+    roller = _rollers.get(chances)
+    if roller is None:
+        roller = _rollers[chances] = RarityRoller(chances)
+    return roller
+
+def new_seed() -> int:
+    """Случайный сид для нового запроса на открытие"""
+    return secrets.randbits(SEED_BITS)
+
+def spawn_seeds(seed: int, count: int) -> List[int]:
+    """Детерминированно порождает count независимых сидов (по одному на пак) из сида запроса"""
+    parent = random.Random(seed)
+    return [parent.getrandbits(SEED_BITS) for _ in range(count)]
+
+def make_rng(seed: int) -> random.Random:
+    """Отдельный поток случайных чисел для одного открытия"""
+    return random.Random(seed)
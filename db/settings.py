@@ -0,0 +1,23 @@
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic import SecretStr
+
+class DatabaseSettings(BaseSettings):
+    """Настройки БД отдельно от конфига бота: модулям db/ и бенчмаркам
+    не нужен BOT_TOKEN. Остальные переменные .env здесь игнорируются"""
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    # Подключение к PostgreSQL
+    DB_USER: str = 'postgres'
+    DB_PASSWORD: SecretStr = 'root'
+    DB_NAME: str = 'footycards2'
+    DB_HOST: str = 'localhost'
+    DB_PORT: int = 5432
+
+    # Пул соединений: размеры, ожидание свободного соединения и таймаут запроса (секунды, 0 - без таймаута)
+    DB_POOL_MIN_SIZE: int = 2
+    DB_POOL_MAX_SIZE: int = 10
+    DB_ACQUIRE_TIMEOUT: float = 10.0
+    DB_STATEMENT_TIMEOUT: float = 30.0
+
+db_settings = DatabaseSettings()
@@ -0,0 +1,26 @@
+from typing import Dict
+
+# Имена запросов для метрик: имя -> запрос (одно имя - один текст)
+_statements: Dict[str, 'Statement'] = {}
+
+class Statement(str):
+    """Текст запроса из реестра с именем для метрик.
+
+    Выполняется как обычная строка SQL: asyncpg сам держит подготовленные
+    запросы в кэше соединения по тексту (Parse - один раз за жизнь соединения)
+    и переподготавливает их, если миграция изменила таблицы."""
+
+    name: str
+
+    def __new__(cls, name: str, sql: str):
+        obj = super().__new__(cls, sql)
+        obj.name = name
+        return obj
+
+def statement(name: str, sql: str) -> Statement:
+    """Дает запросу имя для метрик (вызывается при импорте модулей с запросами)"""
+    existing = _statements.get(name)
+    if existing is not None and str(existing) != sql:
+        raise ValueError(f"Запрос {name} уже зарегистрирован с другим текстом")
+    stmt = _statements[name] = Statement(name, sql)
+    return stmt
@@ -1,25 +1,32 @@
 from db.pool import get_db_pool
+from db.statements import statement
+# Результаты игр пишутся вместе с итогами по играм (user_game_aggregates)
+from db.game_queries import save_game_result
+from db.profile_stats import get_user_stats, invalidate_user_stats
+from db.leaderboard import ensure_leaderboard, get_player, get_rank, get_top, total_players
 from datetime import *
+import itertools
 import pytz
 
 FREE_PACK_COOLDOWN = 3
 MOSCOW_TZ = pytz.timezone('Europe/Moscow')
 
+USER_BY_ID_QUERY = statement('get_user_by_id', """
+SELECT 
+    u.*,
+    COUNT(uc.id) as cards_count,
+    COUNT(DISTINCT uc.card_id) as unique_cards
+FROM users u
+LEFT JOIN user_cards uc ON u.user_id = uc.user_id
+WHERE u.user_id = $1
+GROUP BY u.user_id
+""")
+
 async def get_user_by_id(user_id: int):
     """Получаем пользователя по ID со статистикой"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = """
-        SELECT 
-            u.*,
-            COUNT(uc.id) as cards_count,
-            COUNT(DISTINCT uc.card_id) as unique_cards
-        FROM users u
-        LEFT JOIN user_cards uc ON u.user_id = uc.user_id
-        WHERE u.user_id = $1
-        GROUP BY u.user_id
-        """
-        return await conn.fetchrow(query, user_id)
+        return await conn.fetchrow(USER_BY_ID_QUERY, user_id)
 
 async def create_user(user_id: int, username: str, balance: int = 100):
     """Создаем нового пользователя"""
@@ -44,27 +51,6 @@ async def update_user_balance(user_id: int, balance_change: int):
         """
         return await conn.fetchval(query, user_id, balance_change)
 
-async def get_user_stats(user_id: int):
-    """Получаем полную статистику пользователя"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        query = """
-        SELECT 
-            u.user_id,
-            u.username,
-            u.balance,
-            COUNT(uc.id) as total_cards,
-            COUNT(DISTINCT uc.card_id) as unique_cards,
-            COUNT(DISTINCT CASE WHEN c.rarity = 'legendary' THEN uc.card_id END) as legendary_cards,
-            COUNT(DISTINCT CASE WHEN c.rarity = 'epic' THEN uc.card_id END) as epic_cards
-        FROM users u
-        LEFT JOIN user_cards uc ON u.user_id = uc.user_id
-        LEFT JOIN cards c ON uc.card_id = c.id
-        WHERE u.user_id = $1
-        GROUP BY u.user_id
-        """
-        return await conn.fetchrow(query, user_id)
-
 async def check_user_can_open_pack(user_id: int, pack_cost: int) -> bool:
     """Проверяет, может ли пользователь открыть пак"""
     user = await get_user_by_id(user_id)
@@ -79,12 +65,13 @@ async def update_last_pack_time(user_id: int):
         query = "UPDATE users SET last_free_pack = $1 WHERE user_id = $2"
         await conn.execute(query, moscow_time, user_id)
 
+LAST_FREE_PACK_QUERY = statement('get_last_free_pack', "SELECT last_free_pack FROM users WHERE user_id = $1")
+
 async def can_open_free_pack(user_id: int):
     """Проверяет, можно ли открыть бесплатный пак по московскому времени"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = "SELECT last_free_pack FROM users WHERE user_id = $1"
-        last_pack_time = await conn.fetchval(query, user_id)
+        last_pack_time = await conn.fetchval(LAST_FREE_PACK_QUERY, user_id)
         
         if not last_pack_time:
             return True, 0
@@ -111,66 +98,69 @@ async def can_open_free_pack(user_id: int):
             minutes_left = int((time_left % 3600) // 60)
             return False, time_left
         
+ADD_BALANCE_QUERY = statement('add_user_balance', "UPDATE users SET balance = balance + $1 WHERE user_id = $2")
+ADD_TROPHIES_QUERY = statement('add_user_trophies', "UPDATE users SET trophies = trophies + $1 WHERE user_id = $2")
+USER_BALANCE_QUERY = statement('get_user_balance', "SELECT balance FROM users WHERE user_id = $1")
+
 async def update_user_balance(user_id: int, amount: int):
     """Обновляет баланс пользователя"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        await conn.execute(
-            "UPDATE users SET balance = balance + $1 WHERE user_id = $2",
-            amount, user_id
-        )
+        await conn.execute(ADD_BALANCE_QUERY, amount, user_id)
+    invalidate_user_stats(user_id)
 
 async def update_user_trophies(user_id: int, amount: int):
     """Обновляет трофеи пользователя"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        await conn.execute(
-            "UPDATE users SET trophies = trophies + $1 WHERE user_id = $2",
-            amount, user_id
-        )
+        await conn.execute(ADD_TROPHIES_QUERY, amount, user_id)
 
 async def get_user_balance(user_id: int):
     """Получает баланс пользователя"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        return await conn.fetchval(
-            "SELECT balance FROM users WHERE user_id = $1",
-            user_id
-        )
+        return await conn.fetchval(USER_BALANCE_QUERY, user_id)
 
-async def save_game_result(user_id: int, game_type: str, result: str, 
-                          bet_amount: int, win_amount: int, 
-                          player_score: int, opponent_score: int):
-    """Сохраняет результат игры"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO game_results 
-            (user_id, game_type, result, bet_amount, win_amount, 
-             player_score, opponent_score, created_at)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, NOW())
-        """, user_id, game_type, result, bet_amount, win_amount, 
-           player_score, opponent_score)
-        
 # Дополнительные запросы для маркета
+# Объявление создается, только если карточка еще не выставлена.
+# Вместе с ним пишется строка витрины market_active_listings и +1 к счетчику редкости
+CREATE_MARKET_LISTING_QUERY = statement('create_market_listing', """
+WITH listing AS (
+    INSERT INTO market_listings (user_id, card_id, price, created_at)
+    SELECT $1, $2, $3, NOW()
+    WHERE NOT EXISTS (
+        SELECT 1 FROM market_active_listings WHERE card_id = $2
+    )
+    RETURNING id, user_id, card_id, price, created_at
+),
+listed AS (
+    INSERT INTO market_active_listings (
+        id, user_id, card_id, price, created_at, base_card_id, player_name,
+        rarity, uniq_name, weight, serial_number, seller_name, collection_name
+    )
+    SELECT l.id, l.user_id, l.card_id, l.price, l.created_at, c.id, c.player_name,
+           c.rarity, c.uniq_name, c.weight, uc.serial_number, u.username, col.name
+    FROM listing l
+    JOIN user_cards uc ON l.card_id = uc.id
+    JOIN cards c ON uc.card_id = c.id
+    LEFT JOIN users u ON l.user_id = u.user_id
+    LEFT JOIN collections col ON c.collection_id = col.id
+    RETURNING rarity
+),
+counted AS (
+    INSERT INTO market_listing_counts AS mlc (rarity, active)
+    SELECT rarity, 1 FROM listed
+    ON CONFLICT (rarity) DO UPDATE SET active = mlc.active + 1
+)
+SELECT id FROM listing
+""")
+
 async def create_market_listing(user_id: int, user_card_id: int, price: int):
     """Создает объявление о продаже карточки на маркете"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # Проверяем, не выставлена ли уже карточка
-        existing_query = "SELECT id FROM market_listings WHERE card_id = $1 AND is_sold = FALSE"
-        existing = await conn.fetchval(existing_query, user_card_id)
-        
-        if existing:
-            return None
-            
-        query = """
-        INSERT INTO market_listings (user_id, card_id, price, created_at)
-        VALUES ($1, $2, $3, NOW())
-        RETURNING id
-        """
         try:
-            return await conn.fetchval(query, user_id, user_card_id, price)
+            return await conn.fetchval(CREATE_MARKET_LISTING_QUERY, user_id, user_card_id, price)
         except Exception as e:
             print(f"Error creating market listing: {e}")
             return None
@@ -212,215 +202,428 @@ async def get_sale_history(user_card_id: int):
         """
         return await conn.fetch(query, user_card_id)
 
-async def remove_market_listing(listing_id: int, user_id: int):
-    """Удаляет объявление с маркета (только для владельца)"""
+# Проданное объявление в витрине уже отсутствует, поэтому счетчик
+# уменьшается только за снятое активное
+REMOVE_MARKET_LISTING_QUERY = statement('remove_market_listing', """
+WITH removed AS (
+    DELETE FROM market_listings
+    WHERE id = $1 AND user_id = $2
+    RETURNING id
+),
+unlisted AS (
+    DELETE FROM market_active_listings
+    WHERE id IN (SELECT id FROM removed)
+    RETURNING rarity
+),
+uncounted AS (
+    UPDATE market_listing_counts mlc
+    SET active = mlc.active - 1
+    FROM unlisted ul
+    WHERE mlc.rarity = ul.rarity
+)
+SELECT COUNT(*) FROM removed
+""")
+
+async def remove_market_listing(listing_id: int, user_id: int) -> int:
+    """Удаляет объявление с маркета (только для владельца), возвращает число удаленных"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = "DELETE FROM market_listings WHERE id = $1 AND user_id = $2"
-        return await conn.execute(query, listing_id, user_id)
+        return await conn.fetchval(REMOVE_MARKET_LISTING_QUERY, listing_id, user_id)
 
-async def update_market_listing_price(listing_id: int, user_id: int, new_price: int):
-    """Обновляет цену в объявлении"""
+UPDATE_MARKET_LISTING_PRICE_QUERY = statement('update_market_listing_price', """
+WITH updated AS (
+    UPDATE market_listings
+    SET price = $1
+    WHERE id = $2 AND user_id = $3
+    RETURNING id, price
+),
+relisted AS (
+    UPDATE market_active_listings mal
+    SET price = upd.price
+    FROM updated upd
+    WHERE mal.id = upd.id
+)
+SELECT COUNT(*) FROM updated
+""")
+
+async def update_market_listing_price(listing_id: int, user_id: int, new_price: int) -> int:
+    """Обновляет цену в объявлении, возвращает число измененных"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = "UPDATE market_listings SET price = $1 WHERE id = $2 AND user_id = $3"
-        return await conn.execute(query, new_price, listing_id, user_id)
+        return await conn.fetchval(UPDATE_MARKET_LISTING_PRICE_QUERY, new_price, listing_id, user_id)
+
+USER_MARKET_LISTINGS_QUERY = statement('get_user_market_listings', """
+SELECT * FROM market_active_listings
+WHERE user_id = $1
+ORDER BY created_at DESC
+""")
 
 async def get_user_market_listings(user_id: int):
     """Получает все активные объявления пользователя"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = """
-        SELECT ml.*, c.player_name, c.rarity, c.uniq_name, c.weight, 
-               uc.serial_number, col.name as collection_name
-        FROM market_listings ml
-        JOIN user_cards uc ON ml.card_id = uc.id
-        JOIN cards c ON uc.card_id = c.id
-        JOIN collections col ON c.collection_id = col.id
-        WHERE ml.user_id = $1 AND ml.is_sold = FALSE
-        ORDER BY ml.created_at DESC
-        """
-        return await conn.fetch(query, user_id)
+        return await conn.fetch(USER_MARKET_LISTINGS_QUERY, user_id)
     
-async def get_market_listings(page: int = 0, limit: int = 10, rarity: str = None, exclude_user_id: int = None):
-    """Получает объявления с маркета с пагинацией и фильтрацией"""
+MARKET_LISTINGS_SELECT = "SELECT * FROM market_active_listings ml"
+
+# Необязательные условия обзора маркета: (имя, условие, число параметров).
+# Курсор - ключ (created_at, id) последнего объявления предыдущей страницы
+MARKET_LISTINGS_FILTERS = (
+    ('cursor', "(ml.created_at, ml.id) < (${}, ${})", 2),
+    ('rarity', "ml.rarity = ${}", 1),
+    ('exclude_user', "ml.user_id != ${}", 1),
+)
+
+def _market_filter_statements(name: str, select: str, first_param: int, filters, suffix: str = "",
+                              required=()) -> dict:
+    """Готовые варианты запроса маркета для каждого набора фильтров
+    (ключ - кортеж флагов включенных фильтров в порядке filters).
+    Условия required входят во все варианты"""
+    variants = {}
+    for flags in itertools.product((False, True), repeat=len(filters)):
+        conditions = list(required)
+        param = first_param
+        variant_name = name
+        for enabled, (filter_name, condition, params_count) in zip(flags, filters):
+            if enabled:
+                conditions.append(condition.format(*range(param, param + params_count)))
+                param += params_count
+                variant_name += ":" + filter_name
+        query = select
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        variants[flags] = statement(variant_name, query + suffix)
+    return variants
+
+MARKET_LISTINGS_QUERIES = _market_filter_statements(
+    'get_market_listings', MARKET_LISTINGS_SELECT, 2, MARKET_LISTINGS_FILTERS,
+    " ORDER BY ml.created_at DESC, ml.id DESC LIMIT $1"
+)
+
+def market_cursor(listing) -> list:
+    """Курсор для следующей страницы: ключ последнего показанного объявления
+    (в виде, который можно хранить в FSM)"""
+    return [listing['created_at'].isoformat(), listing['id']]
+
+async def get_market_listings(cursor: list = None, limit: int = 10, rarity: str = None, exclude_user_id: int = None):
+    """Получает страницу объявлений с маркета после курсора (None - первая страница)"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        base_query = """
-        SELECT ml.*, c.player_name, c.rarity, c.uniq_name, c.weight,
-               uc.serial_number, u.username as seller_name, col.name as collection_name
-        FROM market_listings ml
-        JOIN user_cards uc ON ml.card_id = uc.id
-        JOIN cards c ON uc.card_id = c.id
-        JOIN users u ON ml.user_id = u.user_id
-        JOIN collections col ON c.collection_id = col.id
-        WHERE ml.is_sold = FALSE
-        """
+        params = [limit]
+        by_rarity = bool(rarity and rarity != 'all')
         
-        params = [limit, page * limit]
-        param_count = 2
+        if cursor:
+            params.extend((datetime.fromisoformat(cursor[0]), cursor[1]))
         
-        if rarity and rarity != 'all':
-            base_query += f" AND c.rarity = ${param_count + 1}"
+        if by_rarity:
             params.append(rarity)
-            param_count += 1
         
         # Исключаем предложения текущего пользователя
         if exclude_user_id is not None:
-            base_query += f" AND ml.user_id != ${param_count + 1}"
             params.append(exclude_user_id)
-            param_count += 1
         
-        base_query += " ORDER BY ml.created_at DESC LIMIT $1 OFFSET $2"
+        query = MARKET_LISTINGS_QUERIES[(bool(cursor), by_rarity, exclude_user_id is not None)]
+        return await conn.fetch(query, *params)
+
+# Обзор в диапазоне цен: от дешевых к дорогим, курсор - (price, id)
+MARKET_PRICE_FILTERS = (
+    ('cursor', "(ml.price, ml.id) > (${}, ${})", 2),
+) + MARKET_LISTINGS_FILTERS[1:]
+
+MARKET_LISTINGS_BY_PRICE_QUERIES = _market_filter_statements(
+    'get_market_listings_by_price', MARKET_LISTINGS_SELECT, 4, MARKET_PRICE_FILTERS,
+    " ORDER BY ml.price, ml.id LIMIT $1", required=("ml.price BETWEEN $2 AND $3",)
+)
+
+MAX_MARKET_PRICE = 2**31 - 1
+
+def market_price_cursor(listing) -> list:
+    """Курсор следующей страницы обзора по цене"""
+    return [listing['price'], listing['id']]
+
+async def get_market_listings_by_price(min_price: int = None, max_price: int = None, cursor: list = None,
+                                       limit: int = 10, rarity: str = None, exclude_user_id: int = None):
+    """Получает страницу объявлений в диапазоне цен, начиная с самых дешевых"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        params = [limit, min_price or 0, MAX_MARKET_PRICE if max_price is None else max_price]
+        by_rarity = bool(rarity and rarity != 'all')
+        
+        if cursor:
+            params.extend(cursor)
         
-        return await conn.fetch(base_query, *params)
+        if by_rarity:
+            params.append(rarity)
+        
+        if exclude_user_id is not None:
+            params.append(exclude_user_id)
+        
+        query = MARKET_LISTINGS_BY_PRICE_QUERIES[(bool(cursor), by_rarity, exclude_user_id is not None)]
+        return await conn.fetch(query, *params)
+
+CHEAPEST_LISTINGS_BY_CARD_QUERY = statement('get_cheapest_listings_by_card', """
+SELECT * FROM market_active_listings
+WHERE base_card_id = $1 AND ($3::bigint IS NULL OR user_id != $3)
+ORDER BY price, id
+LIMIT $2
+""")
+
+CHEAPEST_LISTINGS_BY_PLAYER_QUERY = statement('get_cheapest_listings_by_player', """
+SELECT * FROM market_active_listings
+WHERE lower(player_name) = lower($1) AND ($3::bigint IS NULL OR user_id != $3)
+ORDER BY price, id
+LIMIT $2
+""")
+
+async def get_cheapest_listings(card_id: int = None, player_name: str = None, limit: int = 5,
+                                exclude_user_id: int = None):
+    """Самые дешевые предложения карты (по ID карты) или игрока (по имени)"""
+    if card_id is None and not player_name:
+        return []
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        if card_id is not None:
+            return await conn.fetch(CHEAPEST_LISTINGS_BY_CARD_QUERY, card_id, limit, exclude_user_id)
+        return await conn.fetch(CHEAPEST_LISTINGS_BY_PLAYER_QUERY, player_name, limit, exclude_user_id)
+
+# Лучшие цены по картам (market_best_prices пересчитывается триггером на витрине).
+# Первая страница - курсор (0, 0): цены на маркете положительные
+BEST_PRICES_QUERY = statement('get_market_best_prices', """
+SELECT base_card_id, best_price, best_listing_id, listings
+FROM market_best_prices
+WHERE listings > 0 AND (best_price, base_card_id) > ($2, $3)
+ORDER BY best_price, base_card_id
+LIMIT $1
+""")
+
+BEST_PRICE_QUERY = statement('get_market_best_price', """
+SELECT base_card_id, best_price, best_listing_id, listings
+FROM market_best_prices
+WHERE base_card_id = $1 AND listings > 0
+""")
+
+BEST_PRICES_FOR_CARDS_QUERY = statement('get_market_best_prices_for_cards', """
+SELECT base_card_id, best_price, best_listing_id, listings
+FROM market_best_prices
+WHERE base_card_id = ANY($1::int[]) AND listings > 0
+""")
+
+def best_price_cursor(row) -> list:
+    """Курсор следующей страницы лучших цен"""
+    return [row['best_price'], row['base_card_id']]
+
+async def get_market_best_prices(cursor: list = None, limit: int = 10):
+    """Страница карт с лучшей ценой на маркете, от самых дешевых"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(BEST_PRICES_QUERY, limit, *(cursor or (0, 0)))
+
+async def get_market_best_prices_for_cards(card_ids: list):
+    """Лучшие цены переданных карт в их порядке (карты без предложений пропускаются)"""
+    if not card_ids:
+        return []
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(BEST_PRICES_FOR_CARDS_QUERY, list(card_ids))
+    by_card = {row['base_card_id']: row for row in rows}
+    return [by_card[card_id] for card_id in card_ids if card_id in by_card]
+
+# Лучшие цены и число предложений карт без учета предложений одного продавца
+# (свои объявления пользователь купить не может)
+OTHERS_BEST_PRICES_QUERY = statement('get_market_best_prices_excluding_user', """
+SELECT DISTINCT ON (base_card_id)
+    base_card_id,
+    price AS best_price,
+    id AS best_listing_id,
+    COUNT(*) OVER (PARTITION BY base_card_id) AS listings
+FROM market_active_listings
+WHERE base_card_id = ANY($1::int[]) AND user_id != $2
+ORDER BY base_card_id, price, id
+""")
+
+async def get_market_best_prices_excluding_user(card_ids: list, user_id: int) -> dict:
+    """Лучшие цены переданных карт среди чужих предложений: base_card_id -> строка
+    (карты, у которых есть только предложения user_id, пропускаются)"""
+    if not card_ids:
+        return {}
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(OTHERS_BEST_PRICES_QUERY, list(card_ids), user_id)
+    return {row['base_card_id']: row for row in rows}
+
+async def get_market_best_price(card_id: int):
+    """Лучшая цена карты на маркете или None, если предложений нет"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchrow(BEST_PRICE_QUERY, card_id)
+
+MARKET_LISTING_BY_USER_CARD_QUERY = statement(
+    'get_market_listing_by_user_card_id', "SELECT * FROM market_active_listings WHERE card_id = $1"
+)
+
+MARKET_LISTING_BY_ID_QUERY = statement(
+    'get_market_listing_by_id', "SELECT * FROM market_active_listings WHERE id = $1"
+)
 
 async def get_market_listing_by_id(listing_id: int):
-    """Получает объявление по ID"""
+    """Получает активное объявление по ID"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = """
-        SELECT ml.*, c.player_name, c.rarity, c.uniq_name, c.weight,
-               uc.serial_number, u.username as seller_name, col.name as collection_name
-        FROM market_listings ml
-        JOIN user_cards uc ON ml.card_id = uc.id
-        JOIN cards c ON uc.card_id = c.id
-        JOIN users u ON ml.user_id = u.user_id
-        JOIN collections col ON c.collection_id = col.id
-        WHERE ml.id = $1
-        """
-        return await conn.fetchrow(query, listing_id)
+        return await conn.fetchrow(MARKET_LISTING_BY_ID_QUERY, listing_id)
 
 async def get_market_listing_by_card_id(card_id: int):
     """Ищет объявление по ID карточки"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = """
-        SELECT ml.*, c.player_name, c.rarity, c.uniq_name, 
-               uc.serial_number, u.username as seller_name
-        FROM market_listings ml
-        JOIN user_cards uc ON ml.card_id = uc.id
-        JOIN cards c ON uc.card_id = c.id
-        JOIN users u ON ml.user_id = u.user_id
-        WHERE ml.card_id = $1 AND ml.is_sold = FALSE
-        """
-        return await conn.fetchrow(query, card_id)
+        return await conn.fetchrow(MARKET_LISTING_BY_USER_CARD_QUERY, card_id)
+
+# Покупка - два запроса на соединении транзакции.
+# Первый блокирует объявление, затем строки покупателя и продавца в порядке
+# user_id (встречные покупки двух игроков не взаимоблокируются) и возвращает
+# баланс покупателя под блокировкой
+LOCK_MARKET_PURCHASE_QUERY = statement('lock_market_purchase', """
+WITH listing AS (
+    SELECT id, user_id, card_id, price
+    FROM market_listings
+    WHERE id = $1 AND is_sold = FALSE
+    FOR UPDATE
+),
+parties AS (
+    SELECT u.user_id, u.balance
+    FROM users u, listing l
+    WHERE u.user_id IN (l.user_id, $2)
+    ORDER BY u.user_id
+    FOR UPDATE OF u
+)
+SELECT l.user_id AS seller_id, l.card_id, l.price, p.balance AS buyer_balance
+FROM listing l
+LEFT JOIN parties p ON p.user_id = $2
+""")
+
+# Второй делает всю сделку: объявление продано, деньги переведены одним
+# UPDATE по двум строкам, карта передана, история записана (с прежними
+# владельцами), объявление убрано из витрины и счетчика редкости
+COMPLETE_MARKET_PURCHASE_QUERY = statement('complete_market_purchase', """
+WITH sold AS (
+    UPDATE market_listings
+    SET is_sold = TRUE, buyer_id = $2, sold_at = NOW()
+    WHERE id = $1
+    RETURNING id, user_id AS seller_id, card_id, price
+),
+paid AS (
+    UPDATE users u
+    SET balance = u.balance
+        - CASE WHEN u.user_id = $2 THEN s.price ELSE 0 END
+        + CASE WHEN u.user_id = s.seller_id THEN s.price ELSE 0 END
+    FROM sold s
+    WHERE u.user_id IN ($2, s.seller_id)
+    RETURNING u.user_id, u.balance
+),
+moved AS (
+    UPDATE user_cards uc
+    SET user_id = $2
+    FROM sold s
+    WHERE uc.id = s.card_id
+),
+history AS (
+    INSERT INTO market_sales_history (user_card_id, seller_id, buyer_id, price, previous_owners)
+    SELECT
+        s.card_id, s.seller_id, $2, s.price,
+        CASE WHEN s.seller_id::text = ANY(prev.owners) THEN prev.owners
+             ELSE prev.owners || s.seller_id::text END
+    FROM sold s
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(array_agg(DISTINCT msh.seller_id::text), '{}') AS owners
+        FROM market_sales_history msh
+        WHERE msh.user_card_id = s.card_id
+    ) prev
+),
+unlisted AS (
+    DELETE FROM market_active_listings mal
+    USING sold s
+    WHERE mal.id = s.id
+    RETURNING mal.rarity
+),
+uncounted AS (
+    UPDATE market_listing_counts mlc
+    SET active = mlc.active - 1
+    FROM unlisted ul
+    WHERE mlc.rarity = ul.rarity
+)
+SELECT (SELECT balance FROM paid WHERE user_id = $2) AS buyer_balance
+FROM sold
+""")
 
 async def buy_market_listing(listing_id: int, buyer_id: int):
     """Покупка карточки с маркета с записью истории"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         async with conn.transaction():
-            # Получаем информацию об объявлении
-            listing = await conn.fetchrow(
-                "SELECT * FROM market_listings WHERE id = $1 AND is_sold = FALSE FOR UPDATE",
-                listing_id
-            )
+            listing = await conn.fetchrow(LOCK_MARKET_PURCHASE_QUERY, listing_id, buyer_id)
             
             if not listing:
                 return False, "Объявление не найдено или уже продано"
             
-            # Проверяем баланс покупателя
-            buyer_balance = await conn.fetchval(
-                "SELECT balance FROM users WHERE user_id = $1",
-                buyer_id
-            )
-            
-            if buyer_balance < listing['price']:
+            if listing['buyer_balance'] is None or listing['buyer_balance'] < listing['price']:
                 return False, "Недостаточно средств"
             
-            # Обновляем балансы
-            await conn.execute(
-                "UPDATE users SET balance = balance - $1 WHERE user_id = $2",
-                listing['price'], buyer_id
-            )
-            
-            await conn.execute(
-                "UPDATE users SET balance = balance + $1 WHERE user_id = $2",
-                listing['price'], listing['user_id']
-            )
-            
-            # Передаем карточку новому владельцу
-            await conn.execute(
-                "UPDATE user_cards SET user_id = $1 WHERE id = $2",
-                buyer_id, listing['card_id']
-            )
-            
-            # Записываем историю продажи
-            await record_sale_history(listing['card_id'], listing['user_id'], buyer_id, listing['price'])
-            
-            # Помечаем объявление как проданное
-            await conn.execute(
-                "UPDATE market_listings SET is_sold = TRUE, buyer_id = $1, sold_at = NOW() WHERE id = $2",
-                buyer_id, listing_id
-            )
-            
-            return True, "Покупка успешна"
+            await conn.fetchval(COMPLETE_MARKET_PURCHASE_QUERY, listing_id, buyer_id)
+    
+    # Балансы и карты обоих участников изменились
+    invalidate_user_stats(buyer_id, listing['seller_id'])
+    return True, "Покупка успешна"
+
+USER_CARDS_FOR_MARKET_QUERY = statement('get_user_cards_for_market', """
+SELECT uc.id as user_card_id, c.*, uc.serial_number, col.name as collection_name,
+       (SELECT COUNT(*) FROM market_active_listings mal WHERE mal.card_id = uc.id) as already_listed
+FROM user_cards uc
+JOIN cards c ON uc.card_id = c.id
+JOIN collections col ON c.collection_id = col.id
+WHERE uc.user_id = $1 AND uc.is_locked = FALSE
+ORDER BY 
+    CASE c.rarity
+        WHEN 'legendary' THEN 1
+        WHEN 'epic' THEN 2
+        WHEN 'rare' THEN 3
+        WHEN 'common' THEN 4
+    END,
+    c.player_name
+""")
 
 async def get_user_cards_for_market(user_id: int):
     """Получает карточки пользователя, которые можно выставить на продажу"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = """
-        SELECT uc.id as user_card_id, c.*, uc.serial_number, col.name as collection_name,
-               (SELECT COUNT(*) FROM market_listings ml WHERE ml.card_id = uc.id AND ml.is_sold = FALSE) as already_listed
-        FROM user_cards uc
-        JOIN cards c ON uc.card_id = c.id
-        JOIN collections col ON c.collection_id = col.id
-        WHERE uc.user_id = $1 AND uc.is_locked = FALSE
-        ORDER BY 
-            CASE c.rarity
-                WHEN 'legendary' THEN 1
-                WHEN 'epic' THEN 2
-                WHEN 'rare' THEN 3
-                WHEN 'common' THEN 4
-            END,
-            c.player_name
-        """
-        return await conn.fetch(query, user_id)
+        return await conn.fetch(USER_CARDS_FOR_MARKET_QUERY, user_id)
+
+# Общее число - из счетчиков по редкостям; свои объявления пользователя
+# (их немного, индекс по user_id) вычитаются отдельно
+MARKET_LISTINGS_COUNT_QUERY = statement('get_total_market_listings_count', """
+SELECT
+    (SELECT COALESCE(SUM(active), 0)
+     FROM market_listing_counts
+     WHERE $1::text IS NULL OR rarity = $1)
+  - (SELECT COUNT(*)
+     FROM market_active_listings
+     WHERE user_id = $2
+       AND ($1::text IS NULL OR rarity = $1))
+""")
 
 async def get_total_market_listings_count(rarity: str = None, exclude_user_id: int = None):
     """Получает общее количество активных объявлений с фильтрацией"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        base_query = """
-        SELECT COUNT(*) 
-        FROM market_listings ml
-        JOIN user_cards uc ON ml.card_id = uc.id
-        JOIN cards c ON uc.card_id = c.id
-        WHERE ml.is_sold = FALSE
-        """
-        
-        params = []
-        
-        if rarity and rarity != 'all':
-            base_query += " AND c.rarity = $1"
-            params.append(rarity)
-        
-        if exclude_user_id is not None:
-            if params:
-                base_query += f" AND ml.user_id != ${len(params) + 1}"
-            else:
-                base_query += " AND ml.user_id != $1"
-            params.append(exclude_user_id)
-        
-        return await conn.fetchval(base_query, *params)
+        by_rarity = bool(rarity and rarity != 'all')
+        return await conn.fetchval(
+            MARKET_LISTINGS_COUNT_QUERY, rarity if by_rarity else None, exclude_user_id
+        )
         
+
 async def get_market_listing_by_user_card_id(user_card_id: int):
     """Ищет объявление по ID карточки пользователя с информацией о коллекции"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        query = """
-        SELECT ml.*, c.player_name, c.rarity, c.uniq_name, c.weight,
-               uc.serial_number, u.username as seller_name, col.name as collection_name
-        FROM market_listings ml
-        JOIN user_cards uc ON ml.card_id = uc.id
-        JOIN cards c ON uc.card_id = c.id
-        JOIN users u ON ml.user_id = u.user_id
-        JOIN collections col ON c.collection_id = col.id
-        WHERE ml.card_id = $1 AND ml.is_sold = FALSE
-        """
-        return await conn.fetchrow(query, user_card_id)
+        return await conn.fetchrow(MARKET_LISTING_BY_USER_CARD_QUERY, user_card_id)
     
 async def get_user_sale_history(user_id: int):
     """Получает историю продаж и покупок пользователя"""
@@ -473,118 +676,28 @@ async def get_all_users():
         print(f"Ошибка при получении всех пользователей: {e}")
         return []
     
-async def get_user_stats(user_id: int):
-    """Получает полную статистику пользователя"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        # Основная информация пользователя
-        user_query = """
-        SELECT username, balance, score, created_at 
-        FROM users 
-        WHERE user_id = $1
-        """
-        user_data = await conn.fetchrow(user_query, user_id)
-        
-        if not user_data:
-            return None
-        
-        # Количество карт
-        cards_query = "SELECT COUNT(*) FROM user_cards WHERE user_id = $1"
-        total_cards = await conn.fetchval(cards_query, user_id)
-        
-        # Количество уникальных карт
-        unique_cards_query = "SELECT COUNT(DISTINCT card_id) FROM user_cards WHERE user_id = $1"
-        unique_cards = await conn.fetchval(unique_cards_query, user_id)
-        
-        # Статистика тренировок
-        training_query = """
-        SELECT 
-            COUNT(*) as total_trainings,
-            COUNT(CASE WHEN success = true THEN 1 END) as successful_trainings,
-            COALESCE(SUM(reward_earned), 0) as training_rewards,
-            COALESCE(MAX(level), 1) as max_training_level
-        FROM training_results 
-        WHERE user_id = $1
-        """
-        training_stats = await conn.fetchrow(training_query, user_id)
-        
-        # Статистика игр
-        games_query = """
-        SELECT 
-            COUNT(*) as total_games,
-            COUNT(CASE WHEN result = 'win' THEN 1 END) as wins,
-            COUNT(CASE WHEN result = 'lose' THEN 1 END) as losses,
-            COUNT(CASE WHEN result = 'draw' THEN 1 END) as draws,
-            COALESCE(SUM(win_amount), 0) as total_winnings,
-            COALESCE(SUM(bet_amount), 0) as total_bets
-        FROM game_results 
-        WHERE user_id = $1
-        """
-        games_stats = await conn.fetchrow(games_query, user_id)
-        
-        # Любимые карты
-        favorites_query = "SELECT COUNT(*) FROM user_cards WHERE user_id = $1 AND is_favorite = true"
-        favorite_cards = await conn.fetchval(favorites_query, user_id)
-        
-        return {
-            'username': user_data['username'],
-            'balance': user_data['balance'],
-            'score': user_data['score'],
-            'created_at': user_data['created_at'],
-            'total_cards': total_cards or 0,
-            'unique_cards': unique_cards or 0,
-            'favorite_cards': favorite_cards or 0,
-            'total_trainings': training_stats['total_trainings'] or 0,
-            'successful_trainings': training_stats['successful_trainings'] or 0,
-            'training_rewards': training_stats['training_rewards'] or 0,
-            'max_training_level': training_stats['max_training_level'] or 1,
-            'total_games': games_stats['total_games'] or 0,
-            'wins': games_stats['wins'] or 0,
-            'losses': games_stats['losses'] or 0,
-            'draws': games_stats['draws'] or 0,
-            'total_winnings': games_stats['total_winnings'] or 0,
-            'total_bets': games_stats['total_bets'] or 0
-        }
-    
+USER_SCORE_ROW_QUERY = statement('get_user_score_row', "SELECT username, score FROM users WHERE user_id = $1")
+
 async def get_leaderboard(user_id: int, limit: int = 10):
-    """Получает топ игроков по очкам и позицию текущего пользователя"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        # Получаем топ игроков
-        top_players_query = """
-        SELECT user_id, username, score, balance
-        FROM users 
-        WHERE score > 0
-        ORDER BY score DESC 
-        LIMIT $1
-        """
-        top_players = await conn.fetch(top_players_query, limit)
-        
-        # Получаем позицию текущего пользователя
-        user_position_query = """
-        SELECT position FROM (
-            SELECT user_id, ROW_NUMBER() OVER (ORDER BY score DESC) as position
-            FROM users 
-            WHERE score > 0
-        ) ranked 
-        WHERE user_id = $1
-        """
-        user_position = await conn.fetchval(user_position_query, user_id)
-        
-        # Получаем общее количество игроков с очками
-        total_players_query = "SELECT COUNT(*) FROM users WHERE score > 0"
-        total_players = await conn.fetchval(total_players_query)
-        
-        # Получаем данные текущего пользователя
-        user_data_query = "SELECT username, score FROM users WHERE user_id = $1"
-        user_data = await conn.fetchrow(user_data_query, user_id)
-        
-        return {
-            'top_players': [dict(player) for player in top_players],
-            'user_position': user_position,
-            'total_players': total_players,
-            'current_user': dict(user_data) if user_data else None
-        }
+    """Получает топ игроков по очкам и позицию текущего пользователя (из рейтинга в памяти)"""
+    await ensure_leaderboard()
+
+    current_user = get_player(user_id)
+    if current_user is None:
+        # Игрока без очков в рейтинге нет - его строку читаем по ключу
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            user_data = await conn.fetchrow(USER_SCORE_ROW_QUERY, user_id)
+        current_user = dict(user_data) if user_data else None
+    else:
+        current_user = {'username': current_user['username'], 'score': current_user['score']}
+
+    return {
+        'top_players': get_top(limit),
+        'user_position': get_rank(user_id),
+        'total_players': total_players(),
+        'current_user': current_user
+    }
     
 async def get_collections_info():
     """Получает информацию о всех коллекциях"""
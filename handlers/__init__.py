@@ -13,6 +13,8 @@ def setup_message_routers() -> Router:
     from . import donate
     from . import football_roulette
     from . import football_training
+    from . import admin
+    from . import subscriptions
 
     router = Router()
     router.include_router(start.router)
@@ -26,4 +28,6 @@ def setup_message_routers() -> Router:
     router.include_router(donate.router)
     router.include_router(football_roulette.router)
     router.include_router(football_training.router)
+    router.include_router(admin.router)
+    router.include_router(subscriptions.router)
     return router
\ No newline at end of file
@@ -0,0 +1,94 @@
+from aiogram import Router
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.filters import Command
+from aiogram.types import Message
+from datetime import datetime
+import asyncio
+import html
+import os
+
+from config import config
+from filters import IsAdmin
+from db.pool import get_db_pool
+from db.metrics import dump_metrics, reset_metrics
+from db.image_registry import is_registered, load_file_ids
+from handlers.card_images import IMAGES_DIR, image_mtime_ns, upload_image
+from middlewares import ThrottlingMiddleware
+
+router = Router()
+router.message.filter(IsAdmin(config.ADMIN_IDS))
+
+# Пауза между загрузками, чтобы не упираться в лимиты Telegram на один чат
+WARM_UP_DELAY = 1.0
+
+def iter_card_images():
+    """Все картинки карт в каталоге players/"""
+    for root, _, files in os.walk(IMAGES_DIR):
+        for name in sorted(files):
+            if name.endswith('.jpg'):
+                yield f"{root}/{name}".replace(os.sep, '/')
+
+@router.message(Command("warm_images"))
+async def warm_images(message: Message):
+    """Заранее загружает в Telegram все картинки карт и сохраняет их file_id"""
+    bot = message.bot
+    await load_file_ids()
+
+    pending = []
+    for path in iter_card_images():
+        mtime_ns = image_mtime_ns(path)
+        if mtime_ns is not None and not is_registered(bot.id, path, mtime_ns):
+            pending.append((path, mtime_ns))
+    status = await message.answer(f"🖼 Картинок к загрузке: {len(pending)}")
+    print(f"[{datetime.now()}] Прогрев картинок: {len(pending)} файлов")
+
+    uploaded = 0
+    failed = 0
+    for path, mtime_ns in pending:
+        sent = None
+        while True:
+            try:
+                sent = await upload_image(bot, message.chat.id, path, mtime_ns, disable_notification=True)
+                uploaded += 1
+                break
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                print(f"[{datetime.now()}] Не удалось загрузить {path}: {e}")
+                failed += 1
+                break
+
+        # Служебное сообщение с картинкой в чате не нужно
+        if sent:
+            try:
+                await sent.delete()
+            except Exception:
+                pass
+        await asyncio.sleep(WARM_UP_DELAY)
+
+    await status.edit_text(
+        f"✅ Прогрев завершен\n\n"
+        f"📤 Загружено: {uploaded}\n"
+        f"❌ Ошибок: {failed}"
+    )
+
+@router.message(Command("dbstats"))
+async def show_db_stats(message: Message):
+    """Метрики пула соединений и запросов к БД (/dbstats reset - сбросить)"""
+    if message.text and message.text.split()[-1] == "reset":
+        reset_metrics()
+        await message.answer("🧹 Метрики БД сброшены")
+        return
+
+    pool = await get_db_pool()
+    report = html.escape(dump_metrics(pool))
+    # Ограничение Telegram на длину сообщения
+    await message.answer(f"<pre>{report[:3900]}</pre>", parse_mode="HTML")
+
+@router.message(Command("throttlestats"))
+async def show_throttle_stats(message: Message, throttling: ThrottlingMiddleware = None):
+    """Сколько событий пропущено и отброшено ограничением частоты"""
+    if throttling is None:
+        await message.answer("Ограничение частоты не подключено")
+        return
+    await message.answer(f"<pre>{html.escape(throttling.stats())}</pre>", parse_mode="HTML")
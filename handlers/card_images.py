@@ -0,0 +1,51 @@
+# card_images.py
+import os
+from datetime import datetime
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+from db.image_registry import get_file_id, save_file_id, forget_file_id
+
+IMAGES_DIR = "players"
+
+def card_image_path(rarity: str, uniq_name: str) -> str:
+    """Путь к картинке карты"""
+    return f"{IMAGES_DIR}/{rarity}/{uniq_name}.jpg"
+
+def image_mtime_ns(path: str) -> Optional[int]:
+    """mtime файла картинки или None, если файла нет"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+async def upload_image(bot: Bot, chat_id: int, path: str, mtime_ns: int, **kwargs) -> Message:
+    """Отправляет картинку файлом и запоминает ее file_id"""
+    sent = await bot.send_photo(chat_id=chat_id, photo=FSInputFile(path), **kwargs)
+    await save_file_id(bot.id, path, mtime_ns, sent.photo[-1].file_id)
+    return sent
+
+async def answer_card_photo(message: Message, rarity: str, uniq_name: str, **kwargs) -> bool:
+    """Отвечает фото карты: по сохраненному file_id, а при первом показе - файлом.
+
+    Возвращает False, если картинки карты нет (тогда вызывающий отправляет текст)."""
+    path = card_image_path(rarity, uniq_name)
+    mtime_ns = image_mtime_ns(path)
+    if mtime_ns is None:
+        return False
+
+    bot = message.bot
+    file_id = await get_file_id(bot.id, path, mtime_ns)
+    if file_id:
+        try:
+            await message.answer_photo(photo=file_id, **kwargs)
+            return True
+        except TelegramBadRequest as e:
+            print(f"[{datetime.now()}] file_id для {path} не принят, загружаем заново: {e}")
+            forget_file_id(bot.id, path)
+
+    await upload_image(bot, message.chat.id, path, mtime_ns, **kwargs)
+    return True
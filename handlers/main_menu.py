@@ -7,42 +7,10 @@ from datetime import datetime, timedelta
 from aiogram.utils.markdown import html_decoration as hd
 
 from db.user_queries import *
+from handlers.subscriptions import CHANNELS_CONFIG, check_channels_subscription
 
 router = Router()
 
-# Конфигурация каналов для подписки
-CHANNELS_CONFIG = {
-    -1002655732796: {  # ID канала 1
-        'name': '📢 Футбольные новости',
-        'url': 'https://t.me/RonaldoOrMessiQuest'
-    },
-    -1002459798852: {  # ID канала 2
-        'name': '🎮 Основной канал', 
-        'url': 'https://t.me/FootyCardsChannel'
-    }
-}
-
-async def check_channels_subscription(user_id: int, bot: Bot) -> tuple[bool, list]:
-    """
-    Проверяет подписку пользователя на все каналы
-    Возвращает (все_ли_подписки_активны, список_неподписанных_каналов)
-    """
-    not_subscribed = []
-    
-    for channel_id, channel_info in CHANNELS_CONFIG.items():
-        try:
-            # Проверяем статус подписки
-            member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-            # Если пользователь не подписан или покинул канал
-            if member.status in ['left', 'kicked']:
-                not_subscribed.append((channel_id, channel_info))
-        except Exception as e:
-            print(f"Ошибка при проверке канала {channel_id}: {e}")
-            # В случае ошибки считаем, что пользователь не подписан
-            not_subscribed.append((channel_id, channel_info))
-    
-    return len(not_subscribed) == 0, not_subscribed
-
 async def create_subscription_keyboard(not_subscribed_channels: list) -> InlineKeyboardMarkup:
     """Создает клавиатуру с кнопками для подписки на каналы"""
     buttons = []
@@ -186,7 +154,10 @@ async def play_menu(callback: CallbackQuery, state: FSMContext, bot: Bot):
 async def check_subscription_handler(callback: CallbackQuery, state: FSMContext, bot: Bot):
     """Проверяет подписку после нажатия кнопки 'Я подписался'"""
     
-    is_subscribed, not_subscribed = await check_channels_subscription(callback.from_user.id, bot)
+    # Отказ из кэша мог устареть: пользователь только что подписался
+    is_subscribed, not_subscribed = await check_channels_subscription(
+        callback.from_user.id, bot, recheck_negative=True
+    )
     
     if is_subscribed:
         # Если подписан на все каналы, показываем игровые режимы
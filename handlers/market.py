@@ -8,9 +8,13 @@ from aiogram.utils.markdown import html_decoration as hd
 from typing import List
 
 from db.user_queries import *
+from db.card_pool import ensure_card_pool, get_card
+from db.card_search import search_cards
 
 router = Router()
 
+SEARCH_RESULTS_LIMIT = 10
+
 # Состояния для маркета
 class MarketStates(StatesGroup):
     selecting_card = State()
@@ -18,6 +22,7 @@ class MarketStates(StatesGroup):
     editing_price = State()
     searching_card = State()
     filtering_rarity = State()
+    filtering_price = State()
     viewing_history = State()
 
 
@@ -34,6 +39,7 @@ async def market_menu(callback: CallbackQuery, state: FSMContext):
         [InlineKeyboardButton(text="📤 Выставить на продажу", callback_data="market_sell")],
         [InlineKeyboardButton(text="📋 Мои предложения", callback_data="market_my_listings")],
         [InlineKeyboardButton(text="🛒 Обзор рынка", callback_data="market_browse")],
+        [InlineKeyboardButton(text="💰 Лучшие цены", callback_data="market_best_prices")],
         [InlineKeyboardButton(text="🔍 Поиск по ID", callback_data="market_search")],
         [InlineKeyboardButton(text="📈 Мои сделки", callback_data="market_my_deals")],
         [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_menu")]
@@ -51,7 +57,8 @@ async def market_sell_start(callback: CallbackQuery, state: FSMContext):
         await callback.answer("У вас нет карточек для продажи", show_alert=True)
         return
     
-    available_cards = [card for card in user_cards if card['already_listed'] == 0]
+    # В состоянии FSM храним словари: оно сохраняется в БД, а Record не сериализуется
+    available_cards = [dict(card) for card in user_cards if card['already_listed'] == 0]
     
     if not available_cards:
         await callback.answer("Все ваши карточки уже выставлены на продажу", show_alert=True)
@@ -205,6 +212,8 @@ async def select_card_for_sale(callback: CallbackQuery, state: FSMContext):
         card = next((c for c in available_cards if c['user_card_id'] == user_card_id), None)
         
         if card:
+            best = await get_market_best_price(card['id'])
+            best_line = f"\n🏷️ Лучшая цена на рынке: 🪙 {best['best_price']:,}\n" if best else ""
             text = f"""<b>🎴 Установка цены</b>
 
 <blockquote>
@@ -215,7 +224,7 @@ async def select_card_for_sale(callback: CallbackQuery, state: FSMContext):
 ├ Номер: #{card['serial_number']}
 └ ID: <code>{card['user_card_id']}</code>
 </blockquote>
-
+{best_line}
 💵 Введите цену продажи:"""
             
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -275,7 +284,7 @@ async def show_my_listings(callback: CallbackQuery, state: FSMContext):
         await callback.answer("У вас нет активных предложений", show_alert=True)
         return
     
-    await state.update_data(my_listings=listings, current_page=0)
+    await state.update_data(my_listings=[dict(listing) for listing in listings], current_page=0)
     await show_listings_list(callback, state)
 
 async def show_listings_list(callback: CallbackQuery, state: FSMContext):
@@ -420,34 +429,65 @@ async def remove_listing(callback: CallbackQuery, state: FSMContext):
 # 3. Просмотр маркета - ИСПРАВЛЕННАЯ ВЕРСИЯ
 @router.callback_query(F.data == "market_browse")
 async def browse_market(callback: CallbackQuery, state: FSMContext):
-    await state.update_data(market_page=0, market_filter='all')
+    await state.update_data(market_cursors=[None], market_filter='all', market_price_range=None)
     await show_market_page(callback, state)
 
 async def show_market_page(callback: CallbackQuery, state: FSMContext):
+    text, keyboard = await build_market_page(state, callback.from_user.id)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+
+async def build_market_page(state: FSMContext, user_id: int):
+    """Текст и клавиатура текущей страницы обзора маркета"""
     data = await state.get_data()
-    page = data.get('market_page', 0)
+    # Стек курсоров: начало каждой пройденной страницы, последний - текущая
+    cursors = data.get('market_cursors') or [None]
+    page = len(cursors) - 1
     rarity_filter = data.get('market_filter', 'all')
+    price_range = data.get('market_price_range')
     
-    # Исключаем предложения текущего пользователя
-    listings = await get_market_listings(page, 5, rarity_filter, callback.from_user.id)
-    total_count = await get_total_market_listings_count(rarity_filter, callback.from_user.id)
+    # Исключаем предложения текущего пользователя. Лишнее объявление
+    # показывает, есть ли следующая страница
+    if price_range:
+        listings = await get_market_listings_by_price(
+            price_range[0], price_range[1], cursors[-1], 6, rarity_filter, user_id
+        )
+        next_cursor = market_price_cursor(listings[4]) if len(listings) > 5 else None
+    else:
+        listings = await get_market_listings(cursors[-1], 6, rarity_filter, user_id)
+        next_cursor = market_cursor(listings[4]) if len(listings) > 5 else None
+    listings = listings[:5]
+    await state.update_data(market_next_cursor=next_cursor)
     
     if not listings:
         text = """<b>🎪 Футбольный Маркет</b>
 
 📊 На рынке пока нет предложений
 🎯 Будьте первым, кто выставит карточку!"""
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        keyboard_buttons = []
+        if price_range:
+            text = """<b>🎪 Футбольный Маркет</b>
+
+📊 В этом диапазоне цен предложений нет"""
+            keyboard_buttons.append([InlineKeyboardButton(text="💵 Сбросить цену", callback_data="market_price_reset")])
+        keyboard_buttons += [
             [InlineKeyboardButton(text="📤 Выставить карточку", callback_data="market_sell")],
             [InlineKeyboardButton(text="🏠 В меню", callback_data="market_menu")]
-        ])
-        await callback.message.edit_text(text, reply_markup=keyboard)
-        return
+        ]
+        return text, InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    
+    if price_range:
+        # Для диапазона цен счетчиков нет - показываем только номера предложений
+        shown = f"{page * 5 + 1}-{page * 5 + len(listings)}"
+        price_line = f"\n💵 Цена: {format_price_range(price_range)} (сначала дешевые)"
+    else:
+        total_count = await get_total_market_listings_count(rarity_filter, user_id)
+        shown = f"{page * 5 + 1}-{page * 5 + len(listings)} из {total_count}"
+        price_line = ""
     
     text = f"""<b>🎪 Футбольный Маркет</b>
 
-📊 Предложения: {page * 5 + 1}-{min((page + 1) * 5, total_count)} из {total_count}
-🎯 Фильтр: {get_rarity_display_name(rarity_filter)}
+📊 Предложения: {shown}
+🎯 Фильтр: {get_rarity_display_name(rarity_filter)}{price_line}
 
 <blockquote>"""
     
@@ -478,7 +518,7 @@ async def show_market_page(callback: CallbackQuery, state: FSMContext):
     if page > 0:
         nav_buttons.append(InlineKeyboardButton(text="⏪", callback_data="market_prev"))
     
-    if (page + 1) * 5 < total_count:
+    if next_cursor:
         nav_buttons.append(InlineKeyboardButton(text="⏩", callback_data="market_next"))
     
     if nav_buttons:
@@ -493,14 +533,226 @@ async def show_market_page(callback: CallbackQuery, state: FSMContext):
     ]
     keyboard_buttons.append(filter_buttons)
     
+    if price_range:
+        keyboard_buttons.append([
+            InlineKeyboardButton(text="💵 Другая цена", callback_data="market_price_filter"),
+            InlineKeyboardButton(text="❌ Сбросить цену", callback_data="market_price_reset")
+        ])
+    else:
+        keyboard_buttons.append([InlineKeyboardButton(text="💵 Фильтр по цене", callback_data="market_price_filter")])
+    
     action_buttons = [
         InlineKeyboardButton(text="📤 Продать", callback_data="market_sell"),
         InlineKeyboardButton(text="🏠 Меню", callback_data="market_menu")
     ]
     keyboard_buttons.append(action_buttons)
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-    await callback.message.edit_text(text, reply_markup=keyboard)
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
+def format_price_range(price_range) -> str:
+    min_price, max_price = price_range
+    if max_price is None:
+        return f"от 🪙 {min_price:,}"
+    if not min_price:
+        return f"до 🪙 {max_price:,}"
+    return f"🪙 {min_price:,} - {max_price:,}"
+
+def parse_price_range(text: str):
+    """Диапазон цен из ввода вида "100-500", "100-", "-500" или "500" (не дороже)"""
+    text = text.replace(" ", "").replace("–", "-")
+    if "-" in text:
+        low, high = text.split("-", 1)
+        min_price = int(low) if low else 0
+        max_price = int(high) if high else None
+    else:
+        min_price, max_price = 0, int(text)
+    if min_price < 0 or (max_price is not None and max_price < min_price):
+        raise ValueError(text)
+    # Цены в БД - integer: больше MAX_MARKET_PRICE запрос не примет
+    if min_price > MAX_MARKET_PRICE or (max_price is not None and max_price > MAX_MARKET_PRICE):
+        raise ValueError(text)
+    return [min_price, max_price]
+
+@router.callback_query(F.data == "market_price_filter")
+async def market_price_filter_start(callback: CallbackQuery, state: FSMContext):
+    await state.set_state(MarketStates.filtering_price)
+    
+    text = """<b>💵 Фильтр по цене</b>
+
+📝 Введите диапазон цен:
+• <code>100-500</code> - от 100 до 500 монет
+• <code>100-</code> - от 100 монет
+• <code>500</code> - не дороже 500 монет
+
+Предложения будут показаны от самых дешевых"""
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="❌ Отмена", callback_data="market_price_cancel")]
+        ])
+    )
+
+@router.callback_query(F.data == "market_price_cancel")
+async def market_price_filter_cancel(callback: CallbackQuery, state: FSMContext):
+    await state.set_state(None)
+    await show_market_page(callback, state)
+
+@router.message(MarketStates.filtering_price)
+async def market_price_filter_apply(message: Message, state: FSMContext):
+    try:
+        price_range = parse_price_range(message.text or "")
+    except ValueError:
+        await message.answer("❌ Неверный диапазон. Пример: <code>100-500</code>")
+        return
+    
+    await state.set_state(None)
+    await state.update_data(market_price_range=price_range, market_cursors=[None])
+    text, keyboard = await build_market_page(state, message.from_user.id)
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data == "market_price_reset")
+async def market_price_reset(callback: CallbackQuery, state: FSMContext):
+    await state.update_data(market_price_range=None, market_cursors=[None])
+    await show_market_page(callback, state)
+
+# Лучшие цены: самое дешевое предложение каждой карты
+@router.callback_query(F.data == "market_best_prices")
+async def market_best_prices(callback: CallbackQuery, state: FSMContext):
+    await state.update_data(best_price_cursors=[None])
+    await show_best_prices_page(callback, state)
+
+async def show_best_prices_page(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    cursors = data.get('best_price_cursors') or [None]
+    page = len(cursors) - 1
+    
+    await ensure_card_pool()
+    rows = await get_market_best_prices(cursors[-1], 6)
+    next_cursor = best_price_cursor(rows[4]) if len(rows) > 5 else None
+    rows = rows[:5]
+    await state.update_data(best_price_next_cursor=next_cursor)
+    
+    # Лучшие цены общие для всех, а свои предложения пользователь купить не может:
+    # цены и число предложений на странице - среди чужих (одним запросом)
+    others = await get_market_best_prices_excluding_user(
+        [row['base_card_id'] for row in rows], callback.from_user.id
+    )
+    
+    if not rows:
+        await callback.message.edit_text(
+            "<b>💰 Лучшие цены</b>\n\n📊 На рынке пока нет предложений",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="🏠 В меню", callback_data="market_menu")]
+            ])
+        )
+        return
+    
+    text = f"""<b>💰 Лучшие цены</b>
+
+📊 Карты {page * 5 + 1}-{page * 5 + len(rows)}, самые дешевые - первыми
+
+<blockquote>"""
+    
+    keyboard_buttons = []
+    for row in rows:
+        card = get_card(row['base_card_id']) or {}
+        player_name = card.get('player_name', f"Карта {row['base_card_id']}")
+        emoji = get_rarity_emoji(card.get('rarity'))
+        offer = others.get(row['base_card_id'])
+        
+        if offer is None:
+            text += f"""
+{emoji} <b>{player_name}</b>
+└ 👤 Только ваше предложение: 🪙 {row['best_price']:,}
+"""
+            continue
+        
+        best_price = offer['best_price']
+        text += f"""
+{emoji} <b>{player_name}</b>
+├ 💵 <b>От:</b> 🪙 {best_price:,}
+└ 📦 <b>Предложений:</b> {offer['listings']}
+"""
+        keyboard_buttons.append([
+            InlineKeyboardButton(
+                text=f"{emoji} {player_name[:12]} - 🪙 {best_price:,}",
+                callback_data=f"market_card_offers_{row['base_card_id']}"
+            )
+        ])
+    text += "</blockquote>"
+    
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton(text="⏪", callback_data="market_best_prev"))
+    if next_cursor:
+        nav_buttons.append(InlineKeyboardButton(text="⏩", callback_data="market_best_next"))
+    if nav_buttons:
+        keyboard_buttons.append(nav_buttons)
+    
+    keyboard_buttons.append([InlineKeyboardButton(text="🏠 В меню", callback_data="market_menu")])
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons))
+
+@router.callback_query(F.data == "market_best_prev")
+async def market_best_prev(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    cursors = data.get('best_price_cursors') or [None]
+    if len(cursors) > 1:
+        await state.update_data(best_price_cursors=cursors[:-1])
+        await show_best_prices_page(callback, state)
+    else:
+        await callback.answer("Это первая страница")
+
+@router.callback_query(F.data == "market_best_next")
+async def market_best_next(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    cursors = data.get('best_price_cursors') or [None]
+    next_cursor = data.get('best_price_next_cursor')
+    if next_cursor:
+        await state.update_data(best_price_cursors=cursors + [next_cursor])
+        await show_best_prices_page(callback, state)
+    else:
+        await callback.answer("Это последняя страница")
+
+@router.callback_query(F.data.startswith("market_card_offers_"))
+async def market_card_offers(callback: CallbackQuery, state: FSMContext):
+    """Самые дешевые предложения одной карты"""
+    card_id = int(callback.data.split("_")[3])
+    listings = await get_cheapest_listings(card_id=card_id, limit=5, exclude_user_id=callback.from_user.id)
+    
+    if not listings:
+        await callback.answer("❌ Предложений этой карты больше нет", show_alert=True)
+        return
+    
+    first = listings[0]
+    text = f"""<b>💰 Самые дешевые предложения</b>
+
+{get_rarity_emoji(first['rarity'])} <b>{first['player_name']}</b>
+
+<blockquote>"""
+    
+    keyboard_buttons = []
+    for i, listing in enumerate(listings, start=1):
+        text += f"""
+{i}. 🪙 <b>{listing['price']:,}</b> - #{listing['serial_number']}, 👤 {listing['seller_name']}
+"""
+        keyboard_buttons.append([
+            InlineKeyboardButton(
+                text=f"🛒 Купить #{i} - 🪙 {listing['price']:,}",
+                callback_data=f"buy_listing_{listing['id']}"
+            )
+        ])
+    text += "</blockquote>"
+    
+    keyboard_buttons.append([
+        InlineKeyboardButton(text="🔙 К лучшим ценам", callback_data="market_best_back"),
+        InlineKeyboardButton(text="🏠 Меню", callback_data="market_menu")
+    ])
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons))
+
+@router.callback_query(F.data == "market_best_back")
+async def market_best_back(callback: CallbackQuery, state: FSMContext):
+    await show_best_prices_page(callback, state)
 
 @router.callback_query(F.data == "market_history")
 async def market_history_start(callback: CallbackQuery, state: FSMContext):
@@ -614,21 +866,20 @@ async def buy_listing(callback: CallbackQuery, state: FSMContext):
         await callback.answer(f"❌ {message}", show_alert=True)
         await browse_market(callback, state)
 
-# 4. Поиск карточки по ID - ИСПРАВЛЕННАЯ ВЕРСИЯ
+# 4. Поиск карточки по ID или имени игрока
 @router.callback_query(F.data == "market_search")
 async def search_card_start(callback: CallbackQuery, state: FSMContext):
     await state.set_state(MarketStates.searching_card)
     
     text = """<b>🔍 Поиск карточки на маркете</b>
 
-🎯 <i>Найдите нужную карточку по её уникальному ID</i>
+🎯 <i>Найдите карточку по имени игрока или по её уникальному ID</i>
 
-💡 <b>Как найти ID карточки?</b>
-• Попросите владельца карточки поделиться ID
-• ID отображается в информации о карточке
-• Это число, например: 123
+💡 <b>Как искать?</b>
+• Имя можно вводить не полностью и с опечатками, например: месси
+• ID отображается в информации о карточке - это число, например: 123
 
-📝 <b>Введите ID карточки:</b>"""
+📝 <b>Введите имя игрока или ID карточки:</b>"""
     
     await callback.message.edit_text(
         text,
@@ -639,6 +890,11 @@ async def search_card_start(callback: CallbackQuery, state: FSMContext):
 
 @router.message(MarketStates.searching_card)
 async def search_card_by_id(message: Message, state: FSMContext):
+    query = (message.text or "").strip()
+    if query and not query.isdigit():
+        await search_card_by_name(message, state, query)
+        return
+    
     try:
         card_id = int(message.text)
         listing = await get_market_listing_by_user_card_id(card_id)
@@ -685,9 +941,48 @@ async def search_card_by_id(message: Message, state: FSMContext):
     except ValueError:
         await message.answer("""<b>❌ Неверный формат</b>
 
-Пожалуйста, введите <b>число</b> - ID карточки.
+Пожалуйста, введите имя игрока или <b>число</b> - ID карточки.
+
+Пример: месси или 123""")
 
-Пример: 123 или 456""")
+async def search_card_by_name(message: Message, state: FSMContext, query: str):
+    """Карты, подходящие к имени, у которых есть предложения на маркете"""
+    await ensure_card_pool()
+    # Все совпадения: лучшие по имени карты могут не продаваться, а более дальние - продаваться
+    card_ids = search_cards(query, limit=None)
+    offers = (await get_market_best_prices_for_cards(card_ids))[:SEARCH_RESULTS_LIMIT]
+    
+    if not offers:
+        await message.answer(f"""<b>❌ Ничего не найдено</b>
+
+По запросу «{hd.quote(query)}» на маркете нет предложений.
+Попробуйте другое имя или ID карточки""")
+        return
+    
+    text = f"""<b>✅ Найдено на маркете: {len(offers)}</b>
+
+<blockquote>"""
+    keyboard_buttons = []
+    for row in offers:
+        card = get_card(row['base_card_id']) or {}
+        player_name = card.get('player_name', f"Карта {row['base_card_id']}")
+        emoji = get_rarity_emoji(card.get('rarity'))
+        text += f"""
+{emoji} <b>{player_name}</b> - от 🪙 {row['best_price']:,} ({row['listings']} шт.)"""
+        keyboard_buttons.append([
+            InlineKeyboardButton(
+                text=f"{emoji} {player_name[:12]} - 🪙 {row['best_price']:,}",
+                callback_data=f"market_card_offers_{row['base_card_id']}"
+            )
+        ])
+    text += "\n</blockquote>"
+    
+    keyboard_buttons.append([
+        InlineKeyboardButton(text="🔍 Новый поиск", callback_data="market_search"),
+        InlineKeyboardButton(text="🏠 В меню", callback_data="market_menu")
+    ])
+    await message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons))
+    await state.clear()
 
 # Вспомогательные функции
 def get_rarity_emoji(rarity: str) -> str:
@@ -757,9 +1052,9 @@ async def next_listings_page(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "market_prev")
 async def market_prev(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    page = data.get('market_page', 0)
-    if page > 0:
-        await state.update_data(market_page=page - 1)
+    cursors = data.get('market_cursors') or [None]
+    if len(cursors) > 1:
+        await state.update_data(market_cursors=cursors[:-1])
         await show_market_page(callback, state)
     else:
         await callback.answer("Это первая страница")
@@ -767,12 +1062,11 @@ async def market_prev(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "market_next")
 async def market_next(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    page = data.get('market_page', 0)
-    rarity_filter = data.get('market_filter', 'all')
-    total_count = await get_total_market_listings_count(rarity_filter)
+    cursors = data.get('market_cursors') or [None]
+    next_cursor = data.get('market_next_cursor')
     
-    if (page + 1) * 5 < total_count:
-        await state.update_data(market_page=page + 1)
+    if next_cursor:
+        await state.update_data(market_cursors=cursors + [next_cursor])
         await show_market_page(callback, state)
     else:
         await callback.answer("Это последняя страница")
@@ -781,5 +1075,5 @@ async def market_next(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data.startswith("market_filter_"))
 async def apply_market_filter(callback: CallbackQuery, state: FSMContext):
     filter_type = callback.data.split("_")[2]
-    await state.update_data(market_filter=filter_type, market_page=0)
+    await state.update_data(market_filter=filter_type, market_cursors=[None])
     await show_market_page(callback, state)
\ No newline at end of file
@@ -1,11 +1,15 @@
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, Message
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from typing import List, Dict, Any
-import os
 
-from db.card_queries import get_user_cards_by_rarity, get_user_card_details, get_user_total_cards_count
+from db.card_queries import (
+    get_user_cards_by_rarity, get_user_cards_by_ids, get_user_card_details, get_user_total_cards_count
+)
+from db.card_pool import ensure_card_pool
+from db.card_search import search_cards
+from handlers.card_images import answer_card_photo
 
 router = Router()
 
@@ -14,6 +18,10 @@ class CardsStates(StatesGroup):
     viewing_rarities = State()
     viewing_cards_list = State()
     viewing_card_details = State()
+    searching_cards = State()
+
+# Сколько подходящих к имени карт пользователя показывать
+SEARCH_RESULTS_LIMIT = 10
 
 # Стили для редкостей
 RARITY_STYLES = {
@@ -46,6 +54,7 @@ async def show_rarity_selection(callback: CallbackQuery, state: FSMContext):
             [InlineKeyboardButton(text=RARITY_STYLES['epic']['button'], callback_data="cards_epic")],
             [InlineKeyboardButton(text=RARITY_STYLES['rare']['button'], callback_data="cards_rare")],
             [InlineKeyboardButton(text=RARITY_STYLES['common']['button'], callback_data="cards_common")],
+            [InlineKeyboardButton(text="🔍 Поиск по имени", callback_data="my_cards_search")],
             [InlineKeyboardButton(text="🏠 Главное меню", callback_data="back_to_menu")]
         ])
         
@@ -63,6 +72,58 @@ async def show_rarity_selection(callback: CallbackQuery, state: FSMContext):
         print(f"Error in show_rarity_selection: {e}")
         await callback.answer("❌ Ошибка загрузки коллекции", show_alert=True)
 
+@router.callback_query(F.data == "my_cards_search")
+async def search_my_cards_start(callback: CallbackQuery, state: FSMContext):
+    """Просит ввести имя игрока для поиска в коллекции"""
+    await state.set_state(CardsStates.searching_cards)
+    await callback.message.edit_text(
+        "🔍 <b>Поиск в коллекции</b>\n\n"
+        "📝 Введите имя игрока (можно не полностью и с опечатками):",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="↩️ Назад к редкостям", callback_data="my_cards")]
+        ]),
+        parse_mode="HTML"
+    )
+
+@router.message(CardsStates.searching_cards)
+async def search_my_cards(message: Message, state: FSMContext):
+    """Показывает карты пользователя, подходящие к имени"""
+    await ensure_card_pool()
+    # Все совпадения по каталогу: у пользователя может быть только дальнее из них
+    card_ids = search_cards(message.text or "", limit=None)
+    cards = (await get_user_cards_by_ids(message.from_user.id, card_ids))[:SEARCH_RESULTS_LIMIT]
+    
+    if not cards:
+        await message.answer(
+            "❌ <b>В вашей коллекции таких игроков нет</b>\n\nПопробуйте другое имя",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="↩️ Назад к редкостям", callback_data="my_cards")]
+            ]),
+            parse_mode="HTML"
+        )
+        return
+    
+    keyboard_buttons = []
+    for i, card in enumerate(cards, start=1):
+        button_text = f"{i}. {RARITY_STYLES[card['rarity']]['emoji']} {card['player_name']}"
+        if card['copies_count'] > 1:
+            button_text += f" (x{card['copies_count']})"
+        keyboard_buttons.append([InlineKeyboardButton(text=button_text, callback_data=f"card_{card['id']}")])
+    keyboard_buttons.extend([
+        [InlineKeyboardButton(text="🔍 Новый поиск", callback_data="my_cards_search")],
+        [InlineKeyboardButton(text="↩️ Назад к редкостям", callback_data="my_cards")]
+    ])
+    
+    # Карточка из результатов открывается обычным просмотром списка,
+    # кнопка возврата ведет к списку ее редкости
+    await state.set_state(CardsStates.viewing_cards_list)
+    await state.update_data(current_rarity=None)
+    await message.answer(
+        f"🔍 <b>Найдено в коллекции:</b> {len(cards)}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons),
+        parse_mode="HTML"
+    )
+
 @router.callback_query(F.data.startswith("cards_") & ~F.data.endswith(("_prev", "_next")))
 async def show_cards_list(callback: CallbackQuery, state: FSMContext):
     """Показывает список карт выбранной редкости"""
@@ -251,7 +312,7 @@ async def show_card_details(callback: CallbackQuery, state: FSMContext):
 
         # Получаем текущую редкость из состояния для кнопки возврата
         data = await state.get_data()
-        current_rarity = data.get('current_rarity', card_info['rarity'])
+        current_rarity = data.get('current_rarity') or card_info['rarity']
         
         # Клавиатура
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -267,19 +328,14 @@ async def show_card_details(callback: CallbackQuery, state: FSMContext):
         except:
             pass
         
-        # Проверяем наличие фото карты
-        image_path = f"players/{card_info['rarity']}/{card_info['uniq_name']}.jpg"
-        
-        if os.path.exists(image_path):
-            # Отправляем сообщение с фото
-            photo = FSInputFile(image_path)
-            await callback.message.answer_photo(
-                photo=photo,
-                caption=card_text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-        else:
+        # Отправляем фото карты (по сохраненному file_id, если картинка уже загружалась)
+        sent_photo = await answer_card_photo(
+            callback.message, card_info['rarity'], card_info['uniq_name'],
+            caption=card_text,
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+        if not sent_photo:
             # Отправляем текстовое сообщение если фото нет
             await callback.message.answer(
                 text=card_text,
@@ -1,5 +1,5 @@
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile  
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import random
@@ -8,15 +8,21 @@ from datetime import datetime
 import traceback
 
 from db.pack_queries import *
+from db.pack_catalogue import get_available_packs, get_pack_by_id, get_pack_name, resolve_collection_name
+from db.card_pool import ensure_card_pool, get_card
 from db.user_queries import *
 from db.card_queries import *
+from db import pack_opening
+from handlers.card_images import answer_card_photo
 
 from handlers.main_menu import show_menu
-import os
 import asyncio
 
 router = Router()
 
+# Сколько паков открывается кнопкой "Открыть xN"
+MULTI_OPEN_COUNT = 10
+
 # Стили для оформления
 class PackDesign:
     PACK_STYLES = {
@@ -159,18 +165,29 @@ async def create_packs_keyboard(
             [InlineKeyboardButton(text="🏠 В главное меню", callback_data="back_to_menu")]
         ])
 
-async def create_confirmation_keyboard(pack_id) -> InlineKeyboardMarkup:
+async def create_confirmation_keyboard(pack_id, pack: Dict = None, user_balance: int = 0) -> InlineKeyboardMarkup:
     """Клавиатура для подтверждения покупки"""
     try:
-        return InlineKeyboardMarkup(inline_keyboard=[
+        keyboard_rows = [
             [
                 InlineKeyboardButton(text="✅ Да, покупаю!", callback_data=f"pack_buy_{pack_id}"),
                 InlineKeyboardButton(text="❌ Отмена", callback_data="pack_cancel")
-            ],
-            [
-                InlineKeyboardButton(text="↩️ Назад к пакам", callback_data="back_to_packs")
             ]
+        ]
+        
+        # Массовое открытие доступно только для платных паков
+        if pack and pack['cost'] > 0 and user_balance >= pack['cost'] * MULTI_OPEN_COUNT:
+            keyboard_rows.append([
+                InlineKeyboardButton(
+                    text=f"🎁 Открыть x{MULTI_OPEN_COUNT} ({pack['cost'] * MULTI_OPEN_COUNT} монет)",
+                    callback_data=f"pack_multibuy_{pack_id}"
+                )
+            ])
+        
+        keyboard_rows.append([
+            InlineKeyboardButton(text="↩️ Назад к пакам", callback_data="back_to_packs")
         ])
+        return InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
     except Exception as e:
         print(f"[{datetime.now()}] ОШИБКА создания клавиатуры подтверждения: {e}")
         raise
@@ -181,19 +198,8 @@ async def show_packs_menu(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     
     try:
-        user = await get_user_by_id(user_id)
-        
-        # Получаем все доступные паки
-        all_packs = await get_available_packs(user_id)
-        print(f"[{datetime.now()}] Получено {len(all_packs)} доступных паков для пользователя {user_id}")
-        
-        # Разделяем на обычные и коллекционные
-        standard_packs = [p for p in all_packs if p['pack_type'] == 'standard']
-        collection_packs = [p for p in all_packs if p['pack_type'] == 'collection']
-        
+        # В состоянии только вид и позиция, сами паки берутся из каталога в памяти
         await state.update_data(
-            standard_packs=standard_packs,
-            collection_packs=collection_packs,
             current_view='standard',
             current_index=0
         )
@@ -218,6 +224,11 @@ async def show_packs_menu(callback: CallbackQuery, state: FSMContext):
         traceback.print_exc()
         await callback.answer("❌ Ошибка загрузки магазина", show_alert=True)
 
+async def get_view_packs(user_id: int, view: str) -> List[Dict]:
+    """Паки выбранного вида (standard / collection) из каталога"""
+    all_packs = await get_available_packs(user_id)
+    return [p for p in all_packs if p['pack_type'] == view]
+
 async def display_current_pack(callback: CallbackQuery, state: FSMContext, message_to_edit=None):
     """Отображает текущий пак"""
     user_id = callback.from_user.id
@@ -229,7 +240,7 @@ async def display_current_pack(callback: CallbackQuery, state: FSMContext, messa
         current_view = data.get('current_view', 'standard')
         current_index = data.get('current_index', 0)
         
-        packs = data['standard_packs'] if current_view == 'standard' else data['collection_packs']
+        packs = await get_view_packs(user_id, current_view)
         style = PackDesign.PACK_STYLES.get(current_view, PackDesign.PACK_STYLES['standard'])
         
         print(f"[{datetime.now()}] Отображение пака {current_index} типа {current_view} для пользователя {user_id}")
@@ -252,6 +263,8 @@ async def display_current_pack(callback: CallbackQuery, state: FSMContext, messa
                 await callback.message.edit_text(message, reply_markup=keyboard, parse_mode="HTML")
             return
         
+        # Каталог мог измениться с прошлого показа
+        current_index = current_index % len(packs)
         current_pack = packs[current_index]
         
         # Создаем карточку пака
@@ -293,7 +306,7 @@ async def confirm_pack_purchase(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     
     try:
-        pack_id_str = callback.data.split("_")[2]
+        pack_id_str = callback.data.split("_", 2)[2]
         print(f"[{datetime.now()}] Подтверждение покупки пака {pack_id_str} для пользователя {user_id}")
         
         # Определяем тип pack_id
@@ -320,7 +333,7 @@ async def confirm_pack_purchase(callback: CallbackQuery, state: FSMContext):
             f"<i>Вы уверены, что хотите купить этот пак?</i>"
         )
         
-        keyboard = await create_confirmation_keyboard(pack_id)
+        keyboard = await create_confirmation_keyboard(pack_id, pack, user['balance'])
         
         await callback.message.edit_text(
             text=confirmation_text,
@@ -341,7 +354,7 @@ async def process_pack_purchase(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     
     try:
-        pack_id_str = callback.data.split("_")[2]
+        pack_id_str = callback.data.split("_", 2)[2]
         print(f"[{datetime.now()}] Обработка покупки пака {pack_id_str} для пользователя {user_id}")
         
         # Определяем тип pack_id
@@ -358,6 +371,97 @@ async def process_pack_purchase(callback: CallbackQuery, state: FSMContext):
         await callback.answer("❌ Ошибка при покупке", show_alert=True)
         await state.clear()
 
+@router.callback_query(F.data.startswith("pack_multibuy_"))
+async def process_pack_multi_purchase(callback: CallbackQuery, state: FSMContext):
+    """Открытие нескольких одинаковых паков за раз"""
+    user_id = callback.from_user.id
+    
+    try:
+        pack_id_str = callback.data.split("_", 2)[2]
+        pack_id = pack_id_str if pack_id_str.startswith('collection') else int(pack_id_str)
+        print(f"[{datetime.now()}] Массовое открытие x{MULTI_OPEN_COUNT} пака {pack_id} для пользователя {user_id}")
+        
+        result = await pack_opening.open_packs(user_id, pack_id, MULTI_OPEN_COUNT)
+        
+        if not result['success']:
+            await callback.answer(result['message'], show_alert=True)
+            return
+        
+        card_infos = result['cards']
+        print(f"[{datetime.now()}] Открыто {result['packs_count']} паков {pack_id}: "
+              f"{len(card_infos)} карт, +{result['total_score']} очков")
+        
+        await state.set_state(PackStates.viewing_cards)
+        await state.update_data(
+            opened_cards=compact_opened_cards(card_infos),
+            opened_pack_id=result['pack']['id'],
+            current_card_index=0
+        )
+        
+        text = create_multi_open_summary(result)
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔍 Смотреть карты по одной", callback_data="opened_view_cards")],
+            [InlineKeyboardButton(text=f"🔁 Открыть ещё x{MULTI_OPEN_COUNT}", callback_data=f"pack_multibuy_{result['pack']['id']}")],
+            [InlineKeyboardButton(text="📦 В магазин", callback_data="show_shop_packs")],
+            [InlineKeyboardButton(text="🏠 В главное меню", callback_data="back_to_menu_from_shop")]
+        ])
+        
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        await callback.answer()
+        
+    except Exception as e:
+        print(f"[{datetime.now()}] ОШИБКА в process_pack_multi_purchase: {e}")
+        traceback.print_exc()
+        await callback.answer("❌ Ошибка при покупке", show_alert=True)
+
+def create_multi_open_summary(result: Dict, top_limit: int = 10) -> str:
+    """Создает одно итоговое сообщение по всем открытым пакам"""
+    card_infos = result['cards']
+    
+    rarity_counts = {}
+    for info in card_infos:
+        rarity = info['card']['rarity']
+        rarity_counts[rarity] = rarity_counts.get(rarity, 0) + 1
+    
+    text = (
+        f"🎉 <b>ОТКРЫТО ПАКОВ: {result['packs_count']}</b>\n\n"
+        f"📦 <b>Пак:</b> {result['pack']['name']}\n"
+        f"🎴 <b>Получено карт:</b> {len(card_infos)}\n"
+        f"💸 <b>Потрачено:</b> {result['total_cost']} монет\n"
+        f"💰 <b>Баланс:</b> {result['balance']} монет\n"
+        f"🏅 <b>Очки:</b> +{result['total_score']}\n\n"
+        f"📊 <b>По редкостям:</b>\n"
+    )
+    
+    for rarity in ('legendary', 'epic', 'rare', 'common'):
+        if rarity_counts.get(rarity):
+            style = PackDesign.RARITY_STYLES[rarity]
+            text += f"{style['emoji']} {style['name']}: {rarity_counts[rarity]}\n"
+    
+    # Лучшие карты: сначала по редкости, затем по рейтингу
+    rarity_order = {'common': 1, 'rare': 2, 'epic': 3, 'legendary': 4}
+    best_cards = sorted(
+        card_infos,
+        key=lambda info: (rarity_order.get(info['card']['rarity'], 0), info['card']['weight']),
+        reverse=True
+    )[:top_limit]
+    
+    text += "\n⭐ <b>Лучшие карты:</b>\n<blockquote>"
+    for info in best_cards:
+        card = info['card']
+        style = PackDesign.RARITY_STYLES.get(card['rarity'], PackDesign.RARITY_STYLES['common'])
+        text += f"{style['emoji']} {card['player_name']} 🎯 {int(card['weight'])} 🔢 #{info['serial_number']:06d}\n"
+    text += "</blockquote>"
+    
+    return text
+
+@router.callback_query(F.data == "opened_view_cards", PackStates.viewing_cards)
+async def view_opened_cards_one_by_one(callback: CallbackQuery, state: FSMContext):
+    """Переход от итогового сообщения к просмотру карт по одной"""
+    await state.update_data(current_card_index=0)
+    await show_opened_card(callback, state)
+    await callback.answer()
+
 @router.callback_query(F.data == "pack_cancel")
 async def cancel_purchase(callback: CallbackQuery, state: FSMContext):
     """Отмена покупки"""
@@ -381,7 +485,12 @@ async def handle_pack_actions(callback: CallbackQuery, state: FSMContext):
         current_view = data.get('current_view', 'standard')
         current_index = data.get('current_index', 0)
         
-        packs = data['standard_packs'] if current_view == 'standard' else data['collection_packs']
+        if action in ("prev", "next"):
+            packs = await get_view_packs(user_id, current_view)
+            if not packs:
+                await display_current_pack(callback, state)
+                await callback.answer()
+                return
         
         if action == "prev":
             new_index = (current_index - 1) % len(packs)
@@ -452,123 +561,27 @@ async def open_pack(callback: CallbackQuery, state: FSMContext, pack_id: int):
     print(f"[{datetime.now()}] Начало открытия пака {pack_id} для пользователя {user_id}")
     
     try:
-        user = await get_user_by_id(user_id)
-        pack = await get_pack_by_id(pack_id)
-        
-        if not pack:
-            print(f"[{datetime.now()}] Пак {pack_id} не найден при открытии")
-            await callback.answer("❌ Пак не найден", show_alert=True)
-            return
+        # Списание, выдача карт, очки, лог и статистика - одна транзакция
+        result = await pack_opening.open_pack(user_id, pack_id)
         
-        # Проверяем возможность открытия
-        if pack['cost'] == 0:
-            can_open, time_left = await can_open_free_pack(user_id)
-            if not can_open:
-                hours = int(time_left // 3600)
-                mins = int((time_left % 3600) // 60)
-                print(f"[{datetime.now()}] Бесплатный пак недоступен для пользователя {user_id}, осталось {hours}ч {mins}м")
-                await callback.answer(f"⏳ Доступно через {hours}ч {mins}м", show_alert=True)
-                return
-        
-        if pack['cost'] > 0 and user['balance'] < pack['cost']:
-            print(f"[{datetime.now()}] Недостаточно средств у пользователя {user_id}: баланс {user['balance']}, стоимость {pack['cost']}")
-            await callback.answer("❌ Недостаточно монет", show_alert=True)
+        if not result['success']:
+            print(f"[{datetime.now()}] Пак {pack_id} не открыт для пользователя {user_id}: {result['message']}")
+            await callback.answer(result['message'], show_alert=True)
             return
         
-        # Списание стоимости
-        if pack['cost'] > 0:
-            await update_user_balance(user_id, -pack['cost'])
-            print(f"[{datetime.now()}] Списано {pack['cost']} монет с пользователя {user_id}")
-        else:
-            await update_last_pack_time(user_id)
-            print(f"[{datetime.now()}] Обновлено время открытия бесплатного пака для пользователя {user_id}")
-        
-        # Генерация карт
-        cards = await generate_pack_cards(pack)
-        print(f"[{datetime.now()}] Сгенерировано {len(cards)} карт для пака {pack_id}")
-        
-        if not cards:
-            # Возвращаем деньги если карты не сгенерировались
-            if pack['cost'] > 0:
-                await update_user_balance(user_id, pack['cost'])
-                print(f"[{datetime.now()}] Возвращены {pack['cost']} монет пользователю {user_id} из-за ошибки генерации")
-            await callback.answer("❌ Ошибка генерации карт", show_alert=True)
-            return
+        pack = result['pack']
+        card_infos = result['cards']
+        total_score_earned = result['total_score']
         
-        # Добавляем карты пользователю
-        card_ids = [card['id'] for card in cards]
-        add_result = await add_cards_to_user(user_id, card_ids)
-        serial_numbers = add_result['serial_numbers']
-        print(f"[{datetime.now()}] Карты добавлены пользователю {user_id}, серийные номера: {serial_numbers}")
-        
-        # НАЧИСЛЯЕМ ОЧКИ ЗА КАРТЫ - ПЕРЕМЕЩЕНО В НАЧАЛО!
-        total_score_earned = 0
-        score_details = []
-        
-        print(f"[{datetime.now()}] НАЧАЛО РАСЧЕТА ОЧКОВ:")
-        
-        # Подготавливаем данные для показа
-        rarity_order = {'common': 1, 'rare': 2, 'epic': 3, 'legendary': 4}
-        sorted_cards = sorted(cards, key=lambda x: rarity_order.get(x['rarity'], 0))
-        
-        # Рассчитываем очки для каждой карты
-        for card in sorted_cards:
-            score_for_card = calculate_score_for_card(card)
-            total_score_earned += score_for_card
-            score_details.append({
-                'player_name': card['player_name'],
-                'rarity': card['rarity'],
-                'score': score_for_card
-            })
-            print(f"  Карта: {card['player_name']} ({card['rarity']}) = {score_for_card} очков")
-        
-        print(f"[{datetime.now()}] ИТОГО ОЧКОВ: {total_score_earned}")
-        
-        # Обновляем счет пользователя - ТЕПЕРЬ ПОСЛЕ РАСЧЕТА ОЧКОВ
-        if total_score_earned > 0:
-            update_result = await update_user_score(user_id, total_score_earned)
-            if update_result:
-                print(f"[{datetime.now()}] Начислено {total_score_earned} очков пользователю {user_id}. Новый счет: {update_result['score']}")
-            else:
-                print(f"[{datetime.now()}] ОШИБКА: Не удалось обновить счет пользователя {user_id}")
-        else:
-            print(f"[{datetime.now()}] Нет очков для начисления пользователю {user_id}")
-        
-        # Логируем открытие
-        await log_pack_opening(user_id, pack['id'], card_ids)
-        print(f"[{datetime.now()}] Открытие пака {pack_id} записано в логи")
-        
-        # Обновляем статистику
-        await update_collection_stats_by_cards(card_ids)
-        print(f"[{datetime.now()}] Статистика коллекции обновлена")
-        
-        # Сохраняем информацию о картах и очках
-        card_infos = []
-        for i, card in enumerate(sorted_cards):
-            # Используем те же очки что уже рассчитали
-            card_score = score_details[i]['score']
-            card_info = {
-                'card': card,
-                'serial_number': serial_numbers.get(card['id'], {}).get('serial_number', 0),
-                'collection_name': await get_collection_name(card.get('collection_id')),
-                'score': card_score
-            }
-            card_infos.append(card_info)
-        
-        # ФИНАЛЬНАЯ ПРОВЕРКА СУММЫ
-        calculated_total = sum(info['score'] for info in card_infos)
-        if calculated_total != total_score_earned:
-            print(f"[{datetime.now()}] КРИТИЧЕСКАЯ ОШИБКА: расхождение в сумме очков! calculated_total={calculated_total}, total_score_earned={total_score_earned}")
-            # Используем пересчитанную сумму для надежности
-            total_score_earned = calculated_total
+        print(f"[{datetime.now()}] Пак {pack_id} открыт (открытие #{result['opening_ids'][0]}): "
+              f"{len(card_infos)} карт, +{total_score_earned} очков, новый счет {result['score']}")
         
         await state.set_state(PackStates.viewing_cards)
         await state.update_data(
-            card_infos=card_infos,
-            current_card_index=0,
-            pack_name=pack['name'],
-            total_score_earned=total_score_earned,
-            score_details=score_details
+            opened_cards=compact_opened_cards(card_infos),
+            opened_pack_id=pack['id'],
+            opening_id=result['opening_ids'][0],
+            current_card_index=0
         )
         
         await show_opened_card(callback, state)
@@ -578,38 +591,23 @@ async def open_pack(callback: CallbackQuery, state: FSMContext, pack_id: int):
         traceback.print_exc()
         await callback.answer("❌ Ошибка при открытии пака", show_alert=True)
 
-def calculate_score_for_card(card: Dict) -> int:
-    """Рассчитывает количество очков за карту в зависимости от редкости"""
-    rarity = card.get('rarity', 'common')
-    
-    # Строго определенные диапазоны очков по редкостям
-    score_ranges = {
-        'common': (5, 10),      # обычный: строго 5-10 очков
-        'rare': (10, 15),       # редкий: строго 10-15 очков  
-        'epic': (15, 20),       # эпический: строго 15-20 очков
-        'legendary': (20, 25)   # легендарный: строго 20-25 очков
+def compact_opened_cards(card_infos: List[Dict]) -> List[List[int]]:
+    """Открытые карты для FSM: только [card_id, серийный номер, очки]"""
+    return [[info['card']['id'], info['serial_number'], info['score']] for info in card_infos]
+
+async def resolve_opened_card(opened_card: List[int]) -> Dict:
+    """Восстанавливает данные открытой карты из пула карт и каталога"""
+    card_id, serial_number, score = opened_card
+    await ensure_card_pool()
+    card = get_card(card_id)
+    if not card:
+        return None
+    return {
+        'card': card,
+        'serial_number': serial_number,
+        'score': score,
+        'collection_name': await resolve_collection_name(card.get('collection_id'))
     }
-    
-    # Получаем диапазон для данной редкости
-    if rarity not in score_ranges:
-        print(f"[{datetime.now()}] ВНИМАНИЕ: неизвестная редкость '{rarity}', используем common")
-        rarity = 'common'
-    
-    min_score, max_score = score_ranges[rarity]
-    
-    # Случайное значение в диапазоне (включительно)
-    score = random.randint(min_score, max_score)
-    
-    # ДЕБАГ: логируем расчет очков
-    print(f"[{datetime.now()}] Расчет очков: {card['player_name']} ({rarity}) -> {min_score}-{max_score} = {score} очков")
-    
-    # Дополнительная проверка на корректность диапазона
-    if not (min_score <= score <= max_score):
-        print(f"[{datetime.now()}] ОШИБКА: очки {score} вне диапазона {min_score}-{max_score} для редкости {rarity}")
-        # Возвращаем минимальное значение при ошибке
-        return min_score
-    
-    return score
 
 async def show_opened_card(callback: CallbackQuery, state: FSMContext):
     """Показывает открытую карту с картинкой и начисленными очками"""
@@ -617,25 +615,25 @@ async def show_opened_card(callback: CallbackQuery, state: FSMContext):
     
     try:
         data = await state.get_data()
-        card_infos = data['card_infos']
+        opened_cards = data['opened_cards']
         current_index = data['current_card_index']
-        pack_name = data['pack_name']
-        total_score_earned = data.get('total_score_earned', 0)
+        pack_name = await get_pack_name(data['opened_pack_id']) or "—"
+        total_score_earned = sum(score for _, _, score in opened_cards)
         
-        current_info = card_infos[current_index]
+        current_info = await resolve_opened_card(opened_cards[current_index])
+        if not current_info:
+            await callback.answer("❌ Карта не найдена", show_alert=True)
+            return
         card = current_info['card']
         rarity_style = PackDesign.RARITY_STYLES.get(card['rarity'], PackDesign.RARITY_STYLES['common'])
         
-        print(f"[{datetime.now()}] Отображение карты {current_index + 1}/{len(card_infos)} для пользователя {user_id}, редкость: {card['rarity']}")
-        
-        # Получаем путь к картинке
-        image_path = f"players/{card['rarity']}/{card['uniq_name']}.jpg"
+        print(f"[{datetime.now()}] Отображение карты {current_index + 1}/{len(opened_cards)} для пользователя {user_id}, редкость: {card['rarity']}")
         
         # Создаем текст карточки с информацией об очках
         card_text = (
             f"🎉 <b>НОВАЯ КАРТА!</b>\n\n"
             f"📦 <b>Пак:</b> {pack_name}\n"
-            f"🎴 <b>Карта {current_index + 1}/{len(card_infos)}</b>\n\n"
+            f"🎴 <b>Карта {current_index + 1}/{len(opened_cards)}</b>\n\n"
             f"{rarity_style['color']} {rarity_style['emoji']} <b>{card['player_name']}</b>\n"
             f"{rarity_style['color']} 🏷️ {rarity_style['name']}\n"
             f"{rarity_style['color']} 🔢 #{current_info['serial_number']:06d}\n"
@@ -648,27 +646,25 @@ async def show_opened_card(callback: CallbackQuery, state: FSMContext):
             card_text += f"\n🏆 <b>Коллекция:</b> {current_info['collection_name']}"
         
         # Показываем общее количество заработанных очков только на последней карте
-        if current_index == len(card_infos) - 1 and total_score_earned > 0:
-            # Всегда пересчитываем сумму для точности
-            calculated_total = sum(info['score'] for info in card_infos)
-            card_text += f"\n\n🏅 <b>Всего заработано очков за пак:</b> +{calculated_total}"
+        if current_index == len(opened_cards) - 1 and total_score_earned > 0:
+            card_text += f"\n\n🏅 <b>Всего заработано очков за пак:</b> +{total_score_earned}"
             
         # Создаем клавиатуру
         keyboard_rows = []
         
         # Навигация если карт больше одной
-        if len(card_infos) > 1:
+        if len(opened_cards) > 1:
             nav_buttons = []
             if current_index > 0:
                 nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data="card_prev"))
-            nav_buttons.append(InlineKeyboardButton(text=f"{current_index + 1}/{len(card_infos)}", callback_data="card_info"))
-            if current_index < len(card_infos) - 1:
+            nav_buttons.append(InlineKeyboardButton(text=f"{current_index + 1}/{len(opened_cards)}", callback_data="card_info"))
+            if current_index < len(opened_cards) - 1:
                 nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data="card_next"))
             keyboard_rows.append(nav_buttons)
         
         # Основные кнопки
         action_buttons = []
-        if current_index == len(card_infos) - 1:
+        if current_index == len(opened_cards) - 1:
             # Если это последняя карта, показываем кнопку для открытия еще паков
             action_buttons.append(InlineKeyboardButton(text="📦 Открыть ещё паков", callback_data="show_shop_packs"))
         else:
@@ -688,15 +684,14 @@ async def show_opened_card(callback: CallbackQuery, state: FSMContext):
         except Exception as e:
             print(f"[{datetime.now()}] Не удалось удалить предыдущее сообщение: {e}")
         
-        if os.path.exists(image_path):
-            photo = FSInputFile(image_path)
-            await callback.message.answer_photo(
-                photo=photo,
-                caption=card_text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-        else:
+        # Картинка отправляется по file_id, файлом - только при первом показе
+        sent_photo = await answer_card_photo(
+            callback.message, card['rarity'], card['uniq_name'],
+            caption=card_text,
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+        if not sent_photo:
             await callback.message.answer(
                 text=card_text,
                 reply_markup=keyboard,
@@ -716,16 +711,16 @@ async def navigate_opened_cards(callback: CallbackQuery, state: FSMContext):
     try:
         data = await state.get_data()
         current_index = data['current_card_index']
-        card_infos = data['card_infos']
+        opened_cards = data['opened_cards']
         
         print(f"[{datetime.now()}] Навигация по картам: {callback.data}, текущий индекс: {current_index}")
         
         if callback.data == "card_prev":
             new_index = max(0, current_index - 1)
         elif callback.data == "card_next":
-            new_index = min(len(card_infos) - 1, current_index + 1)
+            new_index = min(len(opened_cards) - 1, current_index + 1)
         else:  # card_info
-            await callback.answer(f"Карта {current_index + 1} из {len(card_infos)}")
+            await callback.answer(f"Карта {current_index + 1} из {len(opened_cards)}")
             return
         
         await state.update_data(current_card_index=new_index)
@@ -0,0 +1,102 @@
+# subscriptions.py
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, Tuple
+
+from aiogram import Bot, Router
+from aiogram.types import ChatMemberUpdated
+
+router = Router()
+
+# Конфигурация каналов для подписки
+CHANNELS_CONFIG = {
+    -1002655732796: {  # ID канала 1
+        'name': '📢 Футбольные новости',
+        'url': 'https://t.me/RonaldoOrMessiQuest'
+    },
+    -1002459798852: {  # ID канала 2
+        'name': '🎮 Основной канал',
+        'url': 'https://t.me/FootyCardsChannel'
+    }
+}
+
+NOT_MEMBER_STATUSES = ('left', 'kicked')
+
+# Статус подписки кэшируется, чтобы не ходить в Bot API на каждое нажатие.
+# Подписка живет дольше отказа: отписку и подписку ловят обновления chat_member
+# (бот - администратор канала), TTL страхует, если обновление не пришло
+SUBSCRIBED_TTL = 600
+NOT_SUBSCRIBED_TTL = 30
+# Ошибка Bot API (в том числе лимит запросов) считается отказом на короткое время
+ERROR_TTL = 5
+SUBSCRIPTION_CACHE_MAX_SIZE = 50000
+
+# (channel_id, user_id) -> (момент устаревания по monotonic, подписан ли)
+_statuses: Dict[Tuple[int, int], Tuple[float, bool]] = {}
+# Проверки в полете: параллельные запросы одного статуса ждут один вызов API
+_inflight: Dict[Tuple[int, int], asyncio.Future] = {}
+
+def set_subscription_status(channel_id: int, user_id: int, subscribed: bool, ttl: float = None):
+    """Запоминает статус подписки пользователя на канал"""
+    if ttl is None:
+        ttl = SUBSCRIBED_TTL if subscribed else NOT_SUBSCRIBED_TTL
+    key = (channel_id, user_id)
+    _statuses.pop(key, None)
+    if len(_statuses) >= SUBSCRIPTION_CACHE_MAX_SIZE:
+        # Вытесняем самую старую запись
+        _statuses.pop(next(iter(_statuses)))
+    _statuses[key] = (time.monotonic() + ttl, subscribed)
+
+def _cached_status(channel_id: int, user_id: int):
+    cached = _statuses.get((channel_id, user_id))
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+async def _fetch_status(bot: Bot, channel_id: int, user_id: int) -> bool:
+    try:
+        member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
+    except Exception as e:
+        print(f"[{datetime.now()}] Ошибка при проверке канала {channel_id}: {e}")
+        # В случае ошибки считаем, что пользователь не подписан
+        set_subscription_status(channel_id, user_id, False, ERROR_TTL)
+        return False
+    subscribed = member.status not in NOT_MEMBER_STATUSES
+    set_subscription_status(channel_id, user_id, subscribed)
+    return subscribed
+
+async def _channel_status(bot: Bot, channel_id: int, user_id: int, recheck_negative: bool) -> bool:
+    cached = _cached_status(channel_id, user_id)
+    if cached or (cached is False and not recheck_negative):
+        return cached
+
+    key = (channel_id, user_id)
+    future = _inflight.get(key)
+    if future is None:
+        future = _inflight[key] = asyncio.ensure_future(_fetch_status(bot, channel_id, user_id))
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(future)
+
+async def check_channels_subscription(user_id: int, bot: Bot, recheck_negative: bool = False) -> tuple[bool, list]:
+    """
+    Проверяет подписку пользователя на все каналы (из кэша, непроверенные - параллельно)
+    Возвращает (все_ли_подписки_активны, список_неподписанных_каналов)
+
+    recheck_negative - заново спросить Bot API о каналах, где подписки не было
+    (после нажатия "Я подписался")
+    """
+    channels = list(CHANNELS_CONFIG.items())
+    statuses = await asyncio.gather(*(
+        _channel_status(bot, channel_id, user_id, recheck_negative) for channel_id, _ in channels
+    ))
+    not_subscribed = [channel for channel, subscribed in zip(channels, statuses) if not subscribed]
+    return len(not_subscribed) == 0, not_subscribed
+
+@router.chat_member()
+async def on_channel_member_updated(update: ChatMemberUpdated):
+    """Обновляет кэш по событию вступления в канал или выхода из него"""
+    if update.chat.id not in CHANNELS_CONFIG:
+        return
+    member = update.new_chat_member
+    set_subscription_status(update.chat.id, member.user.id, member.status not in NOT_MEMBER_STATUSES)
@@ -1,2 +1,3 @@
 from .throttling import ThrottlingMiddleware
-from .subscription_checker import CheckSubscription
\ No newline at end of file
+from .subscription_checker import CheckSubscription
+from .fsm_flush import FSMFlushMiddleware
@@ -3,6 +3,8 @@ from typing import Callable, Awaitable, Dict, Any
 from aiogram import BaseMiddleware
 from aiogram.types import Message
 
+from handlers.subscriptions import check_channels_subscription
+
 
 class CheckSubscription(BaseMiddleware):
 
@@ -12,15 +14,15 @@ class CheckSubscription(BaseMiddleware):
         event: Message,
         data: Dict[str, Any]
     ) -> Any:
-        """ Проверка подписки на канал
+        """ Проверка подписки на каналы CHANNELS_CONFIG (статусы кэшируются)
 
         - При желании укажите клавиатуру с ссылкой на ваш канал.
         - [!] Также, чтобы все работало, бот должен состоять в группе/канале с правами администратора.
         """
 
-        chat_member = await event.bot.get_chat_member("@fsoky_community", event.from_user.id)
+        is_subscribed, _ = await check_channels_subscription(event.from_user.id, event.bot)
 
-        if chat_member.status == "left":
+        if not is_subscribed:
             await event.answer("Подпишись на канал, чтобы пользоваться ботом!",)
         else:
             return await handler(event, data)
\ No newline at end of file
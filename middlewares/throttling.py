@@ -1,21 +1,130 @@
-from typing import Callable, Awaitable, Union, Dict, Any
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Awaitable, Union, Dict, Any, Optional, Tuple
 
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 
-from cachetools import TTLCache
+# Кнопки, которые пишут в БД (ставки в играх, покупка паков и карт на маркете):
+# префикс callback_data -> действие со своим, более строгим лимитом
+ACTION_PREFIXES = {
+    'football21_bet:': 'game',
+    'football21_add': 'game',
+    'football21_stand': 'game',
+    'footballDice_bet:': 'game',
+    'next_round': 'game',
+    'slot_bet:': 'game',
+    'roulette_bet:': 'game',
+    'number_bet:': 'game',
+    'color_bet:': 'game',
+    'sector_bet:': 'game',
+    'start_drill:': 'game',
+    'memory_guess:': 'game',
+    'dribble:': 'game',
+    'pack_buy_': 'pack',
+    'pack_multibuy_': 'pack',
+    'confirm_buy_': 'market_buy',
+}
+
+THROTTLED_TEXT = "⏳ Не так быстро!"
+
+
+class TokenBucket:
+    """Корзина токенов: пополняется со скоростью rate в секунду до burst"""
+
+    __slots__ = ('tokens', 'updated', 'notified')
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+        self.notified = False
+
+    def refill(self, rate: float, burst: float, now: float):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
 
 
 class ThrottlingMiddleware(BaseMiddleware):
 
-    def __init__(self, time_limit: Union[int, float]=1) -> None:
+    def __init__(
+        self,
+        rate: float = 2.0,
+        burst: int = 5,
+        action_limits: Optional[Dict[str, Tuple[float, int]]] = None
+    ) -> None:
         """
-        :param time_limit:
-            - Задержка, при срабатывании "отключает" хендлер на определенное время.
-            По умолчанию 1 секунда.
+        :param rate: событий в секунду на пользователя в среднем.
+        :param burst: сколько событий подряд пропускается без задержки.
+        :param action_limits: действие -> (rate, burst), отдельная корзина
+            пользователя для кнопок из ACTION_PREFIXES (событие должно пройти обе).
+
+        Корзина, которая не использовалась дольше времени полного пополнения,
+        удаляется: новая для того же ключа будет такой же полной, поэтому
+        память занимают только активные пользователи.
         """
+        self._limits = {'user': (rate, burst)}
+        self._limits.update(action_limits or {})
+        # (действие, user_id) -> корзина, от давно не использованных к недавним
+        self._buckets: "OrderedDict[Tuple[str, int], TokenBucket]" = OrderedDict()
+        self._idle_ttl = max(limit_burst / limit_rate for limit_rate, limit_burst in self._limits.values())
+        self.passed = 0
+        self.dropped: Counter = Counter()
 
-        self._limit = TTLCache(maxsize=10_000, ttl=time_limit)
+    @staticmethod
+    def get_action(event: Union[Message, CallbackQuery]) -> Optional[str]:
+        if isinstance(event, CallbackQuery) and event.data:
+            for prefix, action in ACTION_PREFIXES.items():
+                if event.data.startswith(prefix):
+                    return action
+        return None
+
+    def _bucket(self, action: str, user_id: int, now: float) -> TokenBucket:
+        key = (action, user_id)
+        rate, burst = self._limits[action]
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(burst, now)
+        else:
+            bucket.refill(rate, burst, now)
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _expire(self, now: float):
+        # Слева лежат корзины, к которым дольше всего не обращались
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket.updated < self._idle_ttl:
+                break
+            del self._buckets[key]
+
+    def allow(self, user_id: int, action: Optional[str] = None) -> Tuple[bool, bool]:
+        """Списывает токены события; возвращает (пропустить, сообщить об ограничении)"""
+        now = time.monotonic()
+        self._expire(now)
+
+        buckets = [self._bucket('user', user_id, now)]
+        if action in self._limits:
+            buckets.append(self._bucket(action, user_id, now))
+
+        if all(bucket.tokens >= 1 for bucket in buckets):
+            for bucket in buckets:
+                bucket.tokens -= 1
+                bucket.notified = False
+            self.passed += 1
+            return True, False
+
+        limited = [bucket for bucket in buckets if bucket.tokens < 1]
+        notify = not any(bucket.notified for bucket in limited)
+        for bucket in limited:
+            bucket.notified = True
+        # Отказ по лимиту действия считаем отдельно от общего лимита пользователя
+        self.dropped[action if len(buckets) > 1 and buckets[1].tokens < 1 else 'user'] += 1
+        return False, notify
+
+    def stats(self) -> str:
+        """Текстовый отчет: пропущено, отброшено по действиям, активных корзин"""
+        dropped = ", ".join(f"{action}={count}" for action, count in self.dropped.most_common()) or "0"
+        return f"throttling: passed={self.passed} dropped: {dropped} buckets={len(self._buckets)}"
 
     async def __call__(
         self,
@@ -23,8 +132,16 @@ class ThrottlingMiddleware(BaseMiddleware):
         event: Union[Message, CallbackQuery],
         data: Dict[str, Any]
     ) -> Any:
-        if event.from_user.id in self._limit:
-            return
-        else:
-            self._limit[event.from_user.id] = None
-        return await handler(event, data)
\ No newline at end of file
+        if event.from_user is None:
+            return await handler(event, data)
+
+        allowed, notify = self.allow(event.from_user.id, self.get_action(event))
+        if allowed:
+            return await handler(event, data)
+
+        # Об ограничении говорим один раз за серию лишних нажатий,
+        # на остальные нажатия только убираем часики у кнопки
+        if isinstance(event, CallbackQuery):
+            await event.answer(THROTTLED_TEXT if notify else None)
+        elif notify:
+            await event.answer(THROTTLED_TEXT)
@@ -0,0 +1,401 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+
+from app import close_resources, create_bot, create_dispatcher, init_resources
+from config import config
+from db.pool import apply_migrations, get_db_pool
+
+# Многопроцессный запуск: процесс-диспетчер забирает обновления из Telegram
+# (long polling) и раздает их воркерам по user_id, каждый воркер - полноценный
+# бот со своим пулом БД, кэшами и FSM. Обновления одного пользователя всегда
+# попадают в один воркер и обрабатываются там по порядку, поэтому кэши
+# в памяти (FSM, троттлинг, подписки) остаются верными.
+#
+# Запуск:
+#     python runner.py --workers 4
+
+POLL_TIMEOUT = 30
+POLL_RETRY_DELAY = 5
+# Воркер шлет отчет о здоровье раз в HEALTH_INTERVAL секунд; молчащий дольше
+# HEALTH_TIMEOUT считается зависшим и перезапускается
+HEALTH_INTERVAL = 10
+HEALTH_TIMEOUT = 60
+HEALTH_LOG_INTERVAL = 60
+RESTART_DELAY = 2
+# Сколько ждать воркеры при остановке, пока они дорабатывают принятые обновления
+STOP_TIMEOUT = 30
+# Меньший пул не имеет смысла: обработчик держит соединение, пока ждет другое
+MIN_WORKER_POOL_SIZE = 2
+# Кроме пула, каждый воркер держит отдельное соединение для LISTEN
+WORKER_EXTRA_CONNECTIONS = 1
+# Сколько принятых обновлений воркер держит в ожидании сверх одновременно обрабатываемых
+WORKER_BACKLOG_FACTOR = 4
+
+def shard_key(update: Dict) -> int:
+    """Ключ шардирования обновления: id пользователя, иначе чата, иначе update_id"""
+    for kind, event in update.items():
+        if not isinstance(event, dict):
+            continue
+        if kind == 'chat_member':
+            # Подписка на канал: статус кэширует воркер того, кто подписался
+            return event['new_chat_member']['user']['id']
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+        chat = event.get('chat') or event.get('message', {}).get('chat')
+        if chat:
+            return chat['id']
+    return update.get('update_id', 0)
+
+def max_workers_for_budget() -> int:
+    """Сколько воркеров умещается в DB_POOL_MAX_SIZE - общий бюджет соединений на все процессы"""
+    return config.DB_POOL_MAX_SIZE // (MIN_WORKER_POOL_SIZE + WORKER_EXTRA_CONNECTIONS)
+
+def worker_pool_sizes(workers: int) -> tuple:
+    """Размеры пула на воркер: бюджет делится поровну с учетом соединения LISTEN"""
+    max_size = max(MIN_WORKER_POOL_SIZE, config.DB_POOL_MAX_SIZE // workers - WORKER_EXTRA_CONNECTIONS)
+    return min(config.DB_POOL_MIN_SIZE, max_size), max_size
+
+
+# ---------- Воркер ----------
+
+def worker_main(index: int, updates: multiprocessing.Queue, health: multiprocessing.Queue,
+                pool_min_size: int, pool_max_size: int):
+    # Ctrl+C приходит всей группе процессов; останавливает воркеры диспетчер
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_worker(index, updates, health, pool_min_size, pool_max_size))
+
+async def run_worker(index: int, updates: multiprocessing.Queue, health: multiprocessing.Queue,
+                     pool_min_size: int, pool_max_size: int):
+    await init_resources(pool_min_size, pool_max_size, migrate=False)
+    bot = create_bot()
+    dp = create_dispatcher()
+    await dp.emit_startup(bot=bot, dispatcher=dp, **dp.workflow_data)
+    print(f"[{datetime.now()}] Воркер {index} запущен (pid {os.getpid()})")
+
+    stats = {'processed': 0, 'failed': 0, 'active': 0}
+    # slots - одновременно обрабатываемые обновления, backlog - все принятые,
+    # включая ждущие предыдущее обновление своего пользователя
+    slots = asyncio.Semaphore(config.WORKER_MAX_CONCURRENT)
+    backlog = asyncio.Semaphore(config.WORKER_MAX_CONCURRENT * WORKER_BACKLOG_FACTOR)
+    # Последняя задача каждого пользователя: следующая ждет ее завершения
+    tails: Dict[int, asyncio.Task] = {}
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+
+    async def process(previous: Optional[asyncio.Task], update: Dict):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            # Место занимается только к началу обработки: ждущие своей очереди
+            # обновления не отнимают его у других пользователей
+            async with slots:
+                stats['active'] += 1
+                try:
+                    await dp.feed_raw_update(bot, update)
+                finally:
+                    stats['active'] -= 1
+            stats['processed'] += 1
+        except Exception as e:
+            stats['failed'] += 1
+            print(f"[{datetime.now()}] Воркер {index}: ошибка обработки обновления {update.get('update_id')}: {e}")
+        finally:
+            backlog.release()
+
+    def forget(key: int, task: asyncio.Task):
+        if tails.get(key) is task:
+            del tails[key]
+
+    async def report_health():
+        pool = await get_db_pool()
+        while True:
+            health.put({
+                'worker': index,
+                'pid': os.getpid(),
+                'processed': stats['processed'],
+                'failed': stats['failed'],
+                'active': stats['active'],
+                'pool_size': pool.get_size(),
+                'pool_idle': pool.get_idle_size()
+            })
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    reporter = asyncio.create_task(report_health())
+    try:
+        while True:
+            try:
+                update = await loop.run_in_executor(None, updates.get, True, 1)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    print(f"[{datetime.now()}] Воркер {index}: диспетчер завершился, останавливаемся")
+                    break
+                continue
+            if update is None:
+                break
+
+            await backlog.acquire()
+            key = shard_key(update)
+            task = asyncio.create_task(process(tails.get(key), update))
+            tails[key] = task
+            task.add_done_callback(lambda done, key=key: forget(key, done))
+
+        # Дорабатываем принятые обновления (последние задачи ждут предыдущие)
+        if tails:
+            _, pending = await asyncio.wait(set(tails.values()), timeout=STOP_TIMEOUT)
+            if pending:
+                print(f"[{datetime.now()}] Воркер {index}: не успели обработать {len(pending)} обновлений")
+    finally:
+        reporter.cancel()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, **dp.workflow_data)
+        await bot.session.close()
+        await close_resources()
+        print(f"[{datetime.now()}] Воркер {index} остановлен: обработано {stats['processed']}, "
+              f"ошибок {stats['failed']}")
+
+
+# ---------- Диспетчер ----------
+
+class Supervisor:
+    """Запускает воркеры, раздает им обновления, следит за здоровьем и перезапускает упавшие"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.pool_min_size, self.pool_max_size = worker_pool_sizes(workers)
+        self._ctx = multiprocessing.get_context('spawn')
+        # Очередь обновлений на каждый воркер
+        self.queues = [self._ctx.Queue() for _ in range(workers)]
+        self.health = self._ctx.Queue()
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self.started_at = [0.0] * workers
+        self.last_seen = [0.0] * workers
+        self.reports: List[Dict] = [{} for _ in range(workers)]
+        self.dispatched = [0] * workers
+        self.restarts = [0] * workers
+
+    def start_worker(self, index: int):
+        process = self._ctx.Process(
+            target=worker_main,
+            args=(index, self.queues[index], self.health, self.pool_min_size, self.pool_max_size),
+            name=f"footycards-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        self.reports[index] = {}
+
+    def replace_queue(self, index: int):
+        """Новая очередь для перезапускаемого воркера.
+
+        Убитый процесс мог оставить захваченной блокировку чтения старой очереди,
+        тогда новый воркер ждал бы ее вечно. Что удается дочитать - переносится"""
+        old, new = self.queues[index], self._ctx.Queue()
+        moved = 0
+        while True:
+            try:
+                new.put(old.get(timeout=0.1))
+                moved += 1
+            except queue.Empty:
+                break
+        old.close()
+        old.cancel_join_thread()
+        self.queues[index] = new
+        if moved:
+            print(f"[{datetime.now()}] Воркеру {index} перенесено необработанных обновлений: {moved}")
+
+    def dispatch(self, update: Dict):
+        index = shard_key(update) % self.workers
+        self.queues[index].put(update)
+        self.dispatched[index] += 1
+
+    def collect_reports(self):
+        while True:
+            try:
+                report = self.health.get_nowait()
+            except queue.Empty:
+                return
+            index = report['worker']
+            # Отчет прежнего экземпляра воркера после перезапуска не считается
+            if self.processes[index] is not None and report['pid'] == self.processes[index].pid:
+                self.reports[index] = report
+                self.last_seen[index] = time.monotonic()
+
+    def is_healthy(self, index: int) -> bool:
+        process = self.processes[index]
+        seen = max(self.last_seen[index], self.started_at[index])
+        return process is not None and process.is_alive() and time.monotonic() - seen < HEALTH_TIMEOUT
+
+    def status(self) -> Dict:
+        return {
+            'ok': all(self.is_healthy(index) for index in range(self.workers)),
+            'workers': [
+                {
+                    'worker': index,
+                    'alive': self.is_healthy(index),
+                    'dispatched': self.dispatched[index],
+                    'restarts': self.restarts[index],
+                    **self.reports[index]
+                }
+                for index in range(self.workers)
+            ]
+        }
+
+    async def monitor(self, stop_event: asyncio.Event):
+        """Собирает отчеты воркеров и перезапускает упавшие и зависшие"""
+        last_log = time.monotonic()
+        while not stop_event.is_set():
+            await asyncio.sleep(HEALTH_INTERVAL)
+            self.collect_reports()
+            for index, process in enumerate(self.processes):
+                if stop_event.is_set() or self.is_healthy(index):
+                    continue
+                if process.is_alive():
+                    print(f"[{datetime.now()}] Воркер {index} не отвечает {HEALTH_TIMEOUT} с, перезапуск")
+                    process.kill()
+                    await asyncio.get_running_loop().run_in_executor(None, process.join)
+                else:
+                    print(f"[{datetime.now()}] Воркер {index} завершился с кодом {process.exitcode}, перезапуск")
+                await asyncio.sleep(RESTART_DELAY)
+                self.replace_queue(index)
+                self.restarts[index] += 1
+                self.start_worker(index)
+
+            if time.monotonic() - last_log >= HEALTH_LOG_INTERVAL:
+                last_log = time.monotonic()
+                for worker in self.status()['workers']:
+                    print(f"[{datetime.now()}] Воркер {worker['worker']}: alive={worker['alive']} "
+                          f"dispatched={worker['dispatched']} processed={worker.get('processed')} "
+                          f"failed={worker.get('failed')} active={worker.get('active')} "
+                          f"pool={worker.get('pool_size')}/{worker.get('pool_idle')} restarts={worker['restarts']}")
+
+    async def poll(self, api: TelegramAPIServer, allowed_updates: List[str], stop_event: asyncio.Event):
+        """Long polling: обновления не разбираются, а сразу раздаются воркерам как JSON"""
+        token = config.BOT_TOKEN.get_secret_value()
+        timeout = aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(api.api_url(token, 'deleteWebhook'), json={
+                'drop_pending_updates': config.DROP_PENDING_UPDATES
+            }) as response:
+                await response.json()
+
+            offset = None
+            while not stop_event.is_set():
+                params = {'timeout': POLL_TIMEOUT, 'allowed_updates': allowed_updates}
+                if offset is not None:
+                    params['offset'] = offset
+                request = asyncio.ensure_future(session.post(api.api_url(token, 'getUpdates'), json=params))
+                stopped = asyncio.ensure_future(stop_event.wait())
+                await asyncio.wait([request, stopped], return_when=asyncio.FIRST_COMPLETED)
+                stopped.cancel()
+                if not request.done():
+                    # Остановка во время ожидания: полученные, но не подтвержденные
+                    # обновления Telegram отдаст после перезапуска
+                    request.cancel()
+                    break
+                try:
+                    async with request.result() as response:
+                        result = await response.json()
+                    if not result.get('ok'):
+                        raise RuntimeError(result.get('description'))
+                except Exception as e:
+                    print(f"[{datetime.now()}] Ошибка getUpdates: {e}")
+                    await asyncio.sleep(POLL_RETRY_DELAY)
+                    continue
+
+                # Следующий запрос с offset подтверждает эти обновления в Telegram
+                for update in result['result']:
+                    self.dispatch(update)
+                    offset = update['update_id'] + 1
+
+    async def serve_health(self, port: int) -> web.AppRunner:
+        async def health(request: web.Request) -> web.Response:
+            self.collect_reports()
+            status = self.status()
+            return web.json_response(status, status=200 if status['ok'] else 503)
+
+        app = web.Application()
+        app.router.add_get('/health', health)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, config.RUNNER_HEALTH_HOST, port).start()
+        print(f"[{datetime.now()}] Состояние воркеров: http://{config.RUNNER_HEALTH_HOST}:{port}/health")
+        return runner
+
+    async def stop_workers(self):
+        """Просит воркеры доработать очередь и завершиться"""
+        for worker_queue in self.queues:
+            worker_queue.put(None)
+        loop = asyncio.get_running_loop()
+        for index, process in enumerate(self.processes):
+            await loop.run_in_executor(None, process.join, STOP_TIMEOUT + 10)
+            if process.is_alive():
+                print(f"[{datetime.now()}] Воркер {index} не остановился, завершаем принудительно")
+                process.kill()
+
+
+async def run_supervisor(workers: int):
+    max_workers = max_workers_for_budget()
+    if workers > max_workers:
+        if max_workers >= 1:
+            print(f"[{datetime.now()}] DB_POOL_MAX_SIZE={config.DB_POOL_MAX_SIZE} хватает на {max_workers} "
+                  f"воркеров из {workers}, запускаем {max_workers}")
+            workers = max_workers
+        else:
+            workers = 1
+            print(f"[{datetime.now()}] DB_POOL_MAX_SIZE={config.DB_POOL_MAX_SIZE} меньше минимума на один воркер: "
+                  f"он откроет до {MIN_WORKER_POOL_SIZE + WORKER_EXTRA_CONNECTIONS} соединений")
+
+    # Миграции один раз до старта воркеров
+    await apply_migrations()
+    # Типы обновлений по зарегистрированным обработчикам (в том числе chat_member)
+    allowed_updates = create_dispatcher().resolve_used_update_types()
+
+    supervisor = Supervisor(workers)
+    for index in range(workers):
+        supervisor.start_worker(index)
+    print(f"[{datetime.now()}] Запущено воркеров: {workers}, пул БД на воркер: "
+          f"{supervisor.pool_min_size}-{supervisor.pool_max_size}")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остановка по KeyboardInterrupt
+            pass
+
+    api = TelegramAPIServer.from_base(config.TELEGRAM_API_URL) if config.TELEGRAM_API_URL else PRODUCTION
+    health_runner = await supervisor.serve_health(config.RUNNER_HEALTH_PORT) if config.RUNNER_HEALTH_PORT else None
+    monitor = asyncio.create_task(supervisor.monitor(stop_event))
+    try:
+        await supervisor.poll(api, allowed_updates, stop_event)
+    finally:
+        print(f"[{datetime.now()}] Остановка: воркеры дорабатывают очереди")
+        stop_event.set()
+        monitor.cancel()
+        await supervisor.stop_workers()
+        if health_runner:
+            await health_runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Многопроцессный запуск бота")
+    parser.add_argument('--workers', type=int, default=config.WORKERS or os.cpu_count() or 1,
+                        help="число процессов-воркеров (по умолчанию WORKERS или число ядер)")
+    args = parser.parse_args()
+    asyncio.run(run_supervisor(args.workers))
+
+if __name__ == "__main__":
+    main()
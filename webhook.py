@@ -0,0 +1,165 @@
+import asyncio
+import hmac
+import signal
+from datetime import datetime
+from typing import Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Прием обновлений от Telegram по вебхуку на локальном aiohttp-сервере.
+
+    Обновление подтверждается (200) сразу после приема и обрабатывается в фоне.
+    Одновременно обрабатывается не больше max_concurrent обновлений: следующее
+    ждет свободного места, не отвечая Telegram, и тот сам придерживает остальные
+    в своей очереди. При остановке новые обновления не принимаются (503 -
+    Telegram пришлет их повторно после перезапуска), а принятые дорабатываются
+    не дольше drain_timeout секунд.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        path: str,
+        secret: str,
+        max_concurrent: int = 50,
+        drain_timeout: float = 30.0
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self._secret = secret.encode()
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+        self._drain_timeout = drain_timeout
+        self._draining = False
+        self.received = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def _authorized(self, request: web.Request) -> bool:
+        token = request.headers.get(SECRET_HEADER, "").encode()
+        # Сравнение за постоянное время, чтобы секрет нельзя было подобрать по задержке ответа
+        return hmac.compare_digest(token, self._secret)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            self.rejected += 1
+            return web.Response(status=401)
+        if self._draining:
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            print(f"[{datetime.now()}] Некорректное обновление в вебхуке: {e}")
+            self.rejected += 1
+            return web.Response(status=400)
+
+        await self._slots.acquire()
+        if self._draining:
+            self._slots.release()
+            return web.Response(status=503)
+
+        self.received += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.failed += 1
+            print(f"[{datetime.now()}] Ошибка обработки обновления {update.update_id}: {e}")
+        finally:
+            self._slots.release()
+
+    async def drain(self):
+        """Перестает принимать обновления и ждет обработки принятых"""
+        self._draining = True
+        if not self._tasks:
+            return
+        print(f"[{datetime.now()}] Дорабатываем обновлений: {len(self._tasks)}")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=self._drain_timeout)
+        if pending:
+            print(f"[{datetime.now()}] Не успели обработать до остановки: {len(pending)}")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    def stats(self) -> str:
+        return (
+            f"webhook: received={self.received} in_flight={len(self._tasks)} "
+            f"rejected={self.rejected} failed={self.failed}"
+        )
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    url: str,
+    path: str,
+    host: str,
+    port: int,
+    secret: str,
+    max_concurrent: int = 50,
+    drain_timeout: float = 30.0,
+    drop_pending_updates: bool = False,
+    stop_event: Optional[asyncio.Event] = None
+):
+    """Запускает сервер, регистрирует вебхук и работает до SIGINT/SIGTERM (или stop_event).
+
+    Вебхук при остановке не удаляется: обновления, пришедшие, пока бот выключен,
+    Telegram хранит у себя и доставит после запуска.
+    """
+    if not url or not secret:
+        raise ValueError("Для вебхука нужны WEBHOOK_URL и WEBHOOK_SECRET")
+
+    server = WebhookServer(dp, bot, path, secret, max_concurrent, drain_timeout)
+    dp["webhook"] = server
+
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остановка по KeyboardInterrupt
+            pass
+
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+
+    await dp.emit_startup(bot=bot, dispatcher=dp, **dp.workflow_data)
+    try:
+        await bot.set_webhook(
+            url=url.rstrip('/') + path,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            # Telegram допускает от 1 до 100 соединений
+            max_connections=min(max_concurrent, 100),
+            drop_pending_updates=drop_pending_updates
+        )
+        print(f"[{datetime.now()}] Вебхук запущен на {host}:{port}{path}")
+        await stop_event.wait()
+    finally:
+        print(f"[{datetime.now()}] Остановка вебхука")
+        await server.drain()
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, **dp.workflow_data)
+        print(f"[{datetime.now()}] {server.stats()}")